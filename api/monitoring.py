@@ -2,16 +2,23 @@
 API monitoring and analytics for Mahima Medicare
 """
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
 from django.views import View
-from django.db.models import Count, Q
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+import hashlib
 import json
 import logging
+import threading
 
 from hospital.models import Patient, User
 from doctor.models import Doctor_Information, Report, Appointment
@@ -21,8 +28,104 @@ from razorpay_payment.models import RazorpayPayment
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_STATS_KEY = 'api:system-stats'
+SYSTEM_STATS_LOCK_KEY = 'api:system-stats:refreshing'
+
+
+def compute_system_stats():
+    """System statistics, one aggregate query per model"""
+    now = timezone.now()
+    today_start = timezone.make_aware(datetime.combine(timezone.localdate(), time.min), timezone.get_current_timezone())
+    week_ago = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+    
+    users = User.objects.aggregate(
+        total=Count('id'),
+        active_today=Count('id', filter=Q(last_login__gte=today_start)),
+        new_this_week=Count('id', filter=Q(date_joined__gte=week_ago)),
+    )
+    patients = Patient.objects.aggregate(
+        total=Count('patient_id'),
+        new_this_week=Count('patient_id', filter=Q(user__date_joined__gte=week_ago)),
+    )
+    doctors = Doctor_Information.objects.aggregate(
+        total=Count('doctor_id'),
+        active=Count('doctor_id', filter=Q(register_status='Accepted')),
+    )
+    reports = Report.objects.order_by().aggregate(
+        total_reports=Count('report_id'),
+        pending_reports=Count('report_id', filter=Q(status='pending')),
+        completed_this_week=Count('report_id', filter=Q(status='completed', delivery_date__gte=week_ago)),
+    )
+    appointments = Appointment.objects.aggregate(
+        total=Count('id'),
+        upcoming=Count('id', filter=Q(date__gte=timezone.localdate(), appointment_status__in=['pending', 'confirmed'])),
+    )
+    payments = RazorpayPayment.objects.filter(status='captured').order_by().aggregate(
+        total_transactions=Count('payment_id'),
+        total_revenue=Sum('amount'),
+        revenue_this_month=Sum('amount', filter=Q(created_at__gte=month_ago)),
+    )
+    pharmacy = Medicine.objects.aggregate(
+        total_medicines=Count('pk'),
+        low_stock=Count('pk', filter=Q(quantity__lt=10)),
+    )
+    
+    return {
+        'users': users,
+        'patients': patients,
+        'doctors': doctors,
+        'lab': {'technicians': Clinical_Laboratory_Technician.objects.count(), **reports},
+        'appointments': appointments,
+        'payments': {
+            'total_transactions': payments['total_transactions'],
+            'total_revenue': float(payments['total_revenue'] or 0),
+            'revenue_this_month': float(payments['revenue_this_month'] or 0),
+        },
+        'pharmacy': pharmacy,
+    }
+
+
+def refresh_system_stats():
+    """Compute and store a new snapshot; returns it"""
+    now = timezone.now()
+    snapshot = {'stats': compute_system_stats(), 'as_of': now.isoformat(), 'computed_at': now.timestamp()}
+    cache.set(SYSTEM_STATS_KEY, snapshot, None)
+    return snapshot
+
+
+def _refresh_in_background():
+    try:
+        refresh_system_stats()
+    except Exception as e:
+        logger.error(f"Error refreshing system stats: {str(e)}")
+    finally:
+        cache.delete(SYSTEM_STATS_LOCK_KEY)
+        connection.close()
+
+
+def get_system_stats():
+    """
+    The last system stats snapshot (stale-while-revalidate)
+
+    A snapshot older than SYSTEM_STATS_REFRESH_AFTER seconds is still
+    returned, and a background thread computes the next one; a lock key in
+    the cache keeps a second refresh from starting while one runs. Only the
+    very first call computes the stats in the request.
+    """
+    snapshot = cache.get(SYSTEM_STATS_KEY)
+    if snapshot is None:
+        return refresh_system_stats()
+    age = timezone.now().timestamp() - snapshot['computed_at']
+    if age > getattr(settings, 'SYSTEM_STATS_REFRESH_AFTER', 60) and cache.add(
+        SYSTEM_STATS_LOCK_KEY, True, getattr(settings, 'SYSTEM_STATS_REFRESH_TIMEOUT', 300)
+    ):
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+    return snapshot
+
+
 class SystemStatsAPI(View):
-    """API for system statistics"""
+    """API for system statistics, served from the get_system_stats() snapshot"""
     
     @method_decorator(csrf_exempt)
     @method_decorator(login_required)
@@ -32,103 +135,15 @@ class SystemStatsAPI(View):
     def get(self, request):
         try:
             # Only allow admin users
-            if not (request.user.is_superuser or request.user.is_admin):
+            if not (request.user.is_superuser or request.user.is_hospital_admin):
                 return JsonResponse({'error': 'Unauthorized'}, status=403)
             
-            # Get date ranges
-            now = timezone.now()
-            today = now.date()
-            week_ago = today - timedelta(days=7)
-            month_ago = today - timedelta(days=30)
-            
-            # User statistics
-            total_users = User.objects.count()
-            active_users_today = User.objects.filter(last_login__date=today).count()
-            new_users_week = User.objects.filter(date_joined__gte=week_ago).count()
-            
-            # Patient statistics
-            total_patients = Patient.objects.count()
-            new_patients_week = Patient.objects.filter(
-                user__date_joined__gte=week_ago
-            ).count()
-            
-            # Doctor statistics
-            total_doctors = Doctor_Information.objects.count()
-            active_doctors = Doctor_Information.objects.filter(
-                register_status='Accepted'
-            ).count()
-            
-            # Lab statistics
-            total_lab_techs = Clinical_Laboratory_Technician.objects.count()
-            total_reports = Report.objects.count()
-            pending_reports = Report.objects.filter(status='pending').count()
-            completed_reports_week = Report.objects.filter(
-                status='completed',
-                delivery_date__gte=week_ago
-            ).count()
-            
-            # Appointment statistics
-            total_appointments = Appointment.objects.count()
-            upcoming_appointments = Appointment.objects.filter(
-                appointment_date__gte=today,
-                appointment_status__in=['pending', 'confirmed']
-            ).count()
-            
-            # Payment statistics
-            total_payments = RazorpayPayment.objects.filter(status='captured').count()
-            total_revenue = sum([
-                payment.amount for payment in 
-                RazorpayPayment.objects.filter(status='captured')
-            ])
-            revenue_this_month = sum([
-                payment.amount for payment in 
-                RazorpayPayment.objects.filter(
-                    status='captured',
-                    created_at__gte=month_ago
-                )
-            ])
-            
-            # Medicine statistics
-            total_medicines = Medicine.objects.count()
-            low_stock_medicines = Medicine.objects.filter(quantity__lt=10).count()
-            
-            stats = {
-                'users': {
-                    'total': total_users,
-                    'active_today': active_users_today,
-                    'new_this_week': new_users_week,
-                },
-                'patients': {
-                    'total': total_patients,
-                    'new_this_week': new_patients_week,
-                },
-                'doctors': {
-                    'total': total_doctors,
-                    'active': active_doctors,
-                },
-                'lab': {
-                    'technicians': total_lab_techs,
-                    'total_reports': total_reports,
-                    'pending_reports': pending_reports,
-                    'completed_this_week': completed_reports_week,
-                },
-                'appointments': {
-                    'total': total_appointments,
-                    'upcoming': upcoming_appointments,
-                },
-                'payments': {
-                    'total_transactions': total_payments,
-                    'total_revenue': float(total_revenue),
-                    'revenue_this_month': float(revenue_this_month),
-                },
-                'pharmacy': {
-                    'total_medicines': total_medicines,
-                    'low_stock': low_stock_medicines,
-                },
-                'timestamp': now.isoformat(),
-            }
-            
-            return JsonResponse(stats)
+            snapshot = get_system_stats()
+            return JsonResponse({
+                **snapshot['stats'],
+                'as_of': snapshot['as_of'],
+                'timestamp': timezone.now().isoformat(),
+            })
             
         except Exception as e:
             logger.error(f"Error in SystemStatsAPI: {str(e)}")
@@ -205,8 +220,66 @@ class HealthCheckAPI(View):
             }, status=500)
 
 
+# Trend buckets by the longest period (in days) they are used for
+TREND_GRANULARITIES = [(90, 'day'), (730, 'week'), (None, 'month')]
+TRUNCATE = {'day': TruncDate, 'week': TruncWeek, 'month': TruncMonth}
+
+
+def trend_granularity(days):
+    """Bucket size of a ``days`` long trend: day, week or month"""
+    for longest, granularity in TREND_GRANULARITIES:
+        if longest is None or days <= longest:
+            return granularity
+
+
+def _bucket_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return (day + timedelta(days=32)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def report_trend(start_date, end_date, granularity):
+    """
+    Reports uploaded per day/week/month from start_date to end_date (inclusive),
+    from one grouped query, with empty buckets filled in
+    """
+    since = timezone.make_aware(datetime.combine(start_date, time.min), timezone.get_current_timezone())
+    buckets = Report.objects.filter(uploaded_at__gte=since).annotate(
+        bucket=TRUNCATE[granularity]('uploaded_at')
+    ).order_by().values('bucket').annotate(count=Count('report_id')).values_list('bucket', 'count')
+    counts = {}
+    for bucket, count in buckets:
+        if isinstance(bucket, datetime):
+            bucket = timezone.localtime(bucket).date()
+        counts[bucket] = counts.get(bucket, 0) + count
+
+    trend = []
+    day = _bucket_start(start_date, granularity)
+    while day <= end_date:
+        trend.append({'date': day.isoformat(), 'count': counts.get(day, 0)})
+        day = _next_bucket(day, granularity)
+    return trend
+
+
 class ReportAnalyticsAPI(View):
-    """API for report analytics"""
+    """
+    API for report analytics
+
+    ``days`` is capped at REPORT_ANALYTICS_MAX_DAYS and the trend is bucketed
+    by day, week or month depending on its length. Responses are cached per
+    (days, granularity) for REPORT_ANALYTICS_CACHE_TTL seconds and carry an
+    ETag, so a dashboard polling with If-None-Match gets a 304.
+    """
     
     @method_decorator(csrf_exempt)
     @method_decorator(login_required)
@@ -216,58 +289,68 @@ class ReportAnalyticsAPI(View):
     def get(self, request):
         try:
             # Only allow lab workers and admins
-            if not (request.user.is_labworker or request.user.is_admin or request.user.is_superuser):
+            if not (request.user.is_labworker or request.user.is_hospital_admin or request.user.is_superuser):
                 return JsonResponse({'error': 'Unauthorized'}, status=403)
             
             # Get date range from query params
-            days = int(request.GET.get('days', 30))
-            start_date = timezone.now().date() - timedelta(days=days)
-            
-            # Report status distribution
-            status_distribution = Report.objects.filter(
-                uploaded_at__date__gte=start_date
-            ).values('status').annotate(count=Count('status'))
-            
-            # Reports by priority
-            priority_distribution = Report.objects.filter(
-                uploaded_at__date__gte=start_date
-            ).values('priority').annotate(count=Count('priority'))
-            
-            # Daily report creation trend
-            daily_reports = []
-            for i in range(days):
-                date = start_date + timedelta(days=i)
-                count = Report.objects.filter(uploaded_at__date=date).count()
-                daily_reports.append({
-                    'date': date.isoformat(),
-                    'count': count
-                })
-            
-            # Top performing technicians
-            top_technicians = Report.objects.filter(
-                uploaded_at__date__gte=start_date,
-                assigned_technician__isnull=False
-            ).values(
-                'assigned_technician__name'
-            ).annotate(
-                completed_reports=Count('report_id', filter=Q(status='completed'))
-            ).order_by('-completed_reports')[:5]
-            
-            analytics = {
-                'period_days': days,
-                'status_distribution': list(status_distribution),
-                'priority_distribution': list(priority_distribution),
-                'daily_trend': daily_reports,
-                'top_technicians': list(top_technicians),
-                'timestamp': timezone.now().isoformat(),
-            }
+            try:
+                days = int(request.GET.get('days', 30))
+            except ValueError:
+                return JsonResponse({'error': 'days must be a whole number'}, status=400)
+            days = min(max(days, 1), getattr(settings, 'REPORT_ANALYTICS_MAX_DAYS', 1825))
+            granularity = trend_granularity(days)
             
-            return JsonResponse(analytics)
+            ttl = getattr(settings, 'REPORT_ANALYTICS_CACHE_TTL', 60)
+            cached = cache.get_or_set(
+                f'api:report-analytics:{days}:{granularity}', lambda: self.build(days, granularity), ttl
+            )
+            if cached['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(cached['body'], content_type='application/json')
+            response['ETag'] = cached['etag']
+            response['Cache-Control'] = f'private, max-age={ttl}'
+            return response
             
         except Exception as e:
             logger.error(f"Error in ReportAnalyticsAPI: {str(e)}")
             return JsonResponse({'error': 'Internal server error'}, status=500)
 
+    def build(self, days, granularity):
+        """Response body of the last ``days`` days (today included) and its ETag"""
+        today = timezone.localdate()
+        start_date = today - timedelta(days=days - 1)
+        since = timezone.make_aware(datetime.combine(start_date, time.min), timezone.get_current_timezone())
+        reports = Report.objects.filter(uploaded_at__gte=since)
+        
+        # Report status distribution
+        status_distribution = reports.order_by().values('status').annotate(count=Count('status'))
+        
+        # Reports by priority
+        priority_distribution = reports.order_by().values('priority').annotate(count=Count('priority'))
+        
+        # Top performing technicians
+        top_technicians = reports.filter(
+            assigned_technician__isnull=False
+        ).order_by().values(
+            'assigned_technician__name'
+        ).annotate(
+            completed_reports=Count('report_id', filter=Q(status='completed'))
+        ).order_by('-completed_reports')[:5]
+        
+        analytics = {
+            'period_days': days,
+            'granularity': granularity,
+            'status_distribution': list(status_distribution),
+            'priority_distribution': list(priority_distribution),
+            'daily_trend': report_trend(start_date, today, granularity),
+            'top_technicians': list(top_technicians),
+        }
+        # The ETag covers the data only, so a rebuild with nothing new still matches
+        etag = '"%s"' % hashlib.md5(json.dumps(analytics, sort_keys=True).encode()).hexdigest()
+        body = json.dumps({**analytics, 'timestamp': timezone.now().isoformat()})
+        return {'body': body, 'etag': etag}
+
 
 # URL patterns for API endpoints
 from django.urls import path
@@ -0,0 +1,142 @@
+import datetime
+import json
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from .monitoring import ReportAnalyticsAPI, trend_granularity
+
+
+class ReportAnalyticsAPITestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        cache.clear()
+        self.user = User.objects.create_user(username='lab', password='x', is_labworker=True)
+        self.factory = RequestFactory()
+
+    def upload(self, days_ago, count=1):
+        from doctor.models import Report
+
+        for _ in range(count):
+            report = Report.objects.create(test_name='CBC')
+            Report.objects.filter(pk=report.pk).update(uploaded_at=timezone.now() - datetime.timedelta(days=days_ago))
+
+    def get(self, **params):
+        headers = {}
+        if 'etag' in params:
+            headers['HTTP_IF_NONE_MATCH'] = params.pop('etag')
+        request = self.factory.get('/api/reports/analytics/', params, **headers)
+        request.user = self.user
+        return ReportAnalyticsAPI.as_view()(request)
+
+    def test_granularity_follows_the_range(self):
+        self.assertEqual(trend_granularity(30), 'day')
+        self.assertEqual(trend_granularity(365), 'week')
+        self.assertEqual(trend_granularity(3650), 'month')
+
+    def test_long_ranges_are_capped_and_bucketed(self):
+        self.upload(0, 2)
+        self.upload(400)
+        with self.settings(REPORT_ANALYTICS_MAX_DAYS=1000), self.assertNumQueries(4):
+            response = self.get(days=3650)
+        data = json.loads(response.content)
+        self.assertEqual(data['period_days'], 1000)
+        self.assertEqual(data['granularity'], 'month')
+        self.assertLessEqual(len(data['daily_trend']), 35)
+        self.assertEqual(data['daily_trend'][-1]['count'], 2)
+        self.assertEqual(sum(bucket['count'] for bucket in data['daily_trend']), 3)
+
+    def test_daily_trend_is_dense(self):
+        self.upload(0, 3)
+        self.upload(2)
+        self.upload(10)
+        data = json.loads(self.get(days=7).content)
+        self.assertEqual(data['granularity'], 'day')
+        self.assertEqual([day['count'] for day in data['daily_trend']], [0, 0, 0, 0, 1, 0, 3])
+        self.assertEqual(data['daily_trend'][-1]['date'], timezone.localdate().isoformat())
+        self.assertEqual(self.get(days='soon').status_code, 400)
+
+    def test_cached_responses_answer_if_none_match(self):
+        self.upload(1)
+        first = self.get(days=30)
+        with self.assertNumQueries(0):
+            again = self.get(days=30, etag=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], first['ETag'])
+        self.assertEqual(self.get(days=30, etag='"stale"').status_code, 200)
+
+    def test_etag_survives_a_rebuild_with_the_same_data(self):
+        self.upload(1)
+        first = self.get(days=30)
+        cache.clear()
+        self.assertEqual(self.get(days=30, etag=first['ETag']).status_code, 304)
+
+        cache.clear()
+        self.upload(0)
+        self.assertEqual(self.get(days=30, etag=first['ETag']).status_code, 200)
+
+
+class SystemStatsAPITestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        cache.clear()
+        self.user = User.objects.create_user(username='admin', password='x', is_hospital_admin=True)
+        self.factory = RequestFactory()
+
+    def get(self):
+        from .monitoring import SystemStatsAPI
+
+        request = self.factory.get('/api/stats/')
+        request.user = self.user
+        response = SystemStatsAPI.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def pay(self, amount, days_ago=0):
+        from razorpay_payment.models import RazorpayPayment
+
+        payment = RazorpayPayment.objects.create(
+            razorpay_order_id=f'order_{RazorpayPayment.objects.count()}', payment_type='pharmacy',
+            amount=amount, status='captured',
+        )
+        RazorpayPayment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - datetime.timedelta(days=days_ago))
+
+    def test_stats_are_aggregated_in_the_database(self):
+        from doctor.models import Appointment
+
+        self.pay('100.50')
+        self.pay('200', days_ago=45)
+        Appointment.objects.create(date=timezone.localdate(), appointment_type='checkup', appointment_status='pending')
+        Appointment.objects.create(
+            date=timezone.localdate() - datetime.timedelta(days=1), appointment_type='checkup', appointment_status='pending',
+        )
+
+        with self.assertNumQueries(8):
+            data = self.get()
+        self.assertEqual(data['payments'], {'total_transactions': 2, 'total_revenue': 300.5, 'revenue_this_month': 100.5})
+        self.assertEqual(data['appointments'], {'total': 2, 'upcoming': 1})
+        self.assertIn('as_of', data)
+
+    def test_stale_snapshot_is_served_while_refreshing(self):
+        from unittest import mock
+        from . import monitoring
+
+        first = self.get()
+        self.pay('50')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get()['as_of'], first['as_of'])
+
+        with self.settings(SYSTEM_STATS_REFRESH_AFTER=-1), mock.patch.object(monitoring.threading, 'Thread') as Thread:
+            with self.assertNumQueries(0):
+                stale = self.get()
+            self.get()  # a refresh is already running
+        self.assertEqual(stale['payments']['total_transactions'], 0)
+        self.assertEqual(Thread.call_count, 1)
+
+        monitoring.refresh_system_stats()
+        fresh = self.get()
+        self.assertEqual(fresh['payments']['total_transactions'], 1)
+        self.assertNotEqual(fresh['as_of'], first['as_of'])
@@ -0,0 +1,29 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0049_appointment_date_status_idx'),
+        ('hospital_admin', '0005_admin_information_hospital'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabStatusTransition',
+            fields=[
+                ('transition_id', models.AutoField(primary_key=True, serialize=False)),
+                ('from_status', models.CharField(blank=True, default='', max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('report', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='status_transitions', to='doctor.report')),
+                ('technician', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='status_transitions', to='hospital_admin.clinical_laboratory_technician')),
+                ('test', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='status_transitions', to='doctor.prescription_test')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['to_status', 'changed_at'], name='lab_transition_status_idx')],
+            },
+        ),
+    ]
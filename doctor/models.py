@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 import uuid
 
@@ -102,7 +103,12 @@ class Appointment(models.Model):
     payment_status = models.CharField(max_length=200, null=True, blank=True, default='pending')
     transaction_id = models.CharField(max_length=255, null=True, blank=True)
     message = models.CharField(max_length=255, null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            # Admin dashboard appointment histogram: open appointments over a date range
+            models.Index(fields=['date', 'appointment_status'], name='appointment_date_status_idx'),
+        ]
 
     def __str__(self):
         return str(self.patient.username)
@@ -129,7 +135,62 @@ class Experience(models.Model):
         return str(self.doctor.name)
 
 
-class Report(models.Model):
+# Status of a row whose status field wasn't loaded
+_NOT_LOADED = object()
+
+
+class LabStatusTracking:
+    """
+    Records a LabStatusTransition whenever the status of a lab test or report
+    changes, for turnaround-time analytics
+
+    save() compares the status with the one read from the database; queryset
+    updates go through update_status() instead of .update().
+    """
+    status_field = 'status'
+    transition_link = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_status = dict(zip(field_names, values)).get(cls.status_field, _NOT_LOADED)
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        previous = getattr(self, '_saved_status', '')
+        status = getattr(self, self.status_field)
+        if previous is not _NOT_LOADED and status != previous:
+            LabStatusTransition.objects.create(
+                from_status=previous or '', to_status=status or '',
+                technician_id=self.assigned_technician_id, **{self.transition_link: self},
+            )
+        self._saved_status = status
+
+    @classmethod
+    def update_status(cls, queryset, status, **changes):
+        """
+        queryset.update() that sets the status, recording the transitions
+
+        Returns:
+            number of rows updated
+        """
+        with transaction.atomic():
+            rows = list(queryset.values_list('pk', cls.status_field, 'assigned_technician'))
+            updated = queryset.filter(pk__in=[pk for pk, _, _ in rows]).update(**{cls.status_field: status}, **changes)
+            technician = changes.get('assigned_technician')
+            LabStatusTransition.objects.bulk_create([
+                LabStatusTransition(
+                    from_status=previous or '', to_status=status,
+                    technician_id=technician.pk if technician else technician_id,
+                    **{cls.transition_link + '_id': pk},
+                )
+                for pk, previous, technician_id in rows if previous != status
+            ])
+        return updated
+
+
+class Report(LabStatusTracking, models.Model):
     REPORT_STATUS_CHOICES = [
         ('pending', 'Pending Collection'),
         ('collected', 'Sample Collected'),
@@ -145,6 +206,8 @@ class Report(models.Model):
         ('stat', 'STAT'),
     ]
     
+    transition_link = 'report'
+
     report_id = models.AutoField(primary_key=True)
     doctor = models.ForeignKey(Doctor_Information, on_delete=models.SET_NULL, null=True, blank=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, null=True, blank=True)
@@ -192,6 +255,10 @@ class Report(models.Model):
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Report analytics: reports uploaded in a date range
+            models.Index(fields=['uploaded_at'], name='report_uploaded_at_idx'),
+        ]
 
     def __str__(self):
         return f"Report #{self.report_id} - {self.patient.username if self.patient else 'No Patient'}"
@@ -281,7 +348,10 @@ class Prescription_medicine(models.Model):
     def __str__(self):
         return str(self.prescription.prescription_id)
 
-class Prescription_test(models.Model):
+class Prescription_test(LabStatusTracking, models.Model):
+    status_field = 'test_status'
+    transition_link = 'test'
+
     PAYMENT_STATUS_CHOICES = [
         ('unpaid', 'Unpaid'),
         ('paid', 'Paid'),
@@ -330,7 +400,31 @@ class Prescription_test(models.Model):
 
     def __str__(self):
         return str(self.prescription.prescription_id)
-    
+
+
+class LabStatusTransition(models.Model):
+    """A lab test or report changing status (see LabStatusTracking)"""
+    transition_id = models.AutoField(primary_key=True)
+    test = models.ForeignKey(Prescription_test, on_delete=models.CASCADE, null=True, blank=True, related_name='status_transitions')
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, null=True, blank=True, related_name='status_transitions')
+    from_status = models.CharField(max_length=20, blank=True, default='')
+    to_status = models.CharField(max_length=20)
+    # Technician assigned when the status changed
+    technician = models.ForeignKey(
+        'hospital_admin.Clinical_Laboratory_Technician', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='status_transitions',
+    )
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Turnaround analytics: completions in a date range
+            models.Index(fields=['to_status', 'changed_at'], name='lab_transition_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.test_id or self.report_id}: {self.from_status} -> {self.to_status}"
+
 # # test cart system
 class testCart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='test_cart')
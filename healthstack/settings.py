@@ -170,6 +170,20 @@ if 'DATABASE_URL' in os.environ:
         pass
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Local memory is per process. With several workers, each one keeps its own
+# copy of the cached counts, KPIs and snapshots (the *_TTL settings below),
+# an invalidation on save only clears the worker that saved, and the system
+# stats refresh lock only stops concurrent refreshes within one worker.
+# Point this at a shared backend (e.g. Redis) to share them across workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -253,6 +267,60 @@ MANAGERS = ADMINS
 # Lab Test VAT Configuration
 LAB_TEST_VAT_AMOUNT = 20.00  # Fixed VAT amount per test in INR
 
+# Pharmacy live search: seconds before a worker rebuilds its in-memory index (0 = never)
+PHARMACY_SEARCH_INDEX_TTL = 300
+# Shop and pharmacist medicine search use FTS5 (SQLite) / tsvector (PostgreSQL) when True
+PHARMACY_FULLTEXT_SEARCH = True
+# Medicines per page on the pharmacy shop
+PHARMACY_SHOP_PAGE_SIZE = 24
+# Max age in seconds of the cached catalog snapshot served to the pharmacist dashboard (0 = until invalidated)
+PHARMACY_CATALOG_SNAPSHOT_TTL = 300
+# HSN auto-fetch: remote client class and its endpoint/timeouts (connect, read seconds)
+PHARMACY_HSN_CLIENT = os.environ.get('PHARMACY_HSN_CLIENT', 'pharmacy.hsn_utils.HSNClient')
+PHARMACY_HSN_API_URL = os.environ.get('PHARMACY_HSN_API_URL', '')
+PHARMACY_HSN_API_TIMEOUT = (2, 3)
+# HSN lookup cache lifetimes in seconds; 'default' answers are retried sooner
+PHARMACY_HSN_CACHE_TTL = 30 * 24 * 60 * 60
+PHARMACY_HSN_DEFAULT_TTL = 24 * 60 * 60
+# Batch HSN lookups: remote calls per batch, and seconds after which the rest of the batch isn't sent remotely
+PHARMACY_HSN_BATCH_REMOTE_LIMIT = 20
+PHARMACY_HSN_BATCH_REMOTE_SECONDS = 10
+# Bulk medicine import: rows validated and upserted per transaction
+PHARMACY_IMPORT_BATCH_SIZE = 2000
+# Bulk writes touching more medicines than this drop the in-memory search indexes instead of patching them
+PHARMACY_BULK_REFRESH_LIMIT = 2000
+# Stock ledger snapshots are taken this many seconds in the past so in-flight sales aren't missed
+PHARMACY_STOCK_SNAPSHOT_DELAY = 600
+# Admin/pharmacist emails for the pharmacy alert digest are cached this many seconds
+PHARMACY_ALERT_RECIPIENTS_TTL = 3600
+# Demand forecast (manage.py forecast_demand): days of sales history read, days the
+# moving average / demand spread cover, supplier lead time and days between orders
+PHARMACY_FORECAST_HISTORY_DAYS = 365
+PHARMACY_FORECAST_WINDOW_DAYS = 90
+PHARMACY_FORECAST_LEAD_TIME_DAYS = 7
+PHARMACY_FORECAST_REVIEW_DAYS = 14
+# Seconds a cart line holds its units, and the hold given to an order when payment starts
+PHARMACY_CART_RESERVATION_TTL = 30 * 60
+PHARMACY_PAYMENT_RESERVATION_TTL = 15 * 60
+# Orders per page of the pharmacist sales report
+PHARMACY_SALES_PAGE_SIZE = 50
+# Rows per section page of the pharmacist order board / purchase history, and seconds their counts are cached
+PHARMACY_ORDER_BOARD_PAGE_SIZE = 20
+PHARMACY_ORDER_BOARD_COUNTS_TTL = 60
+# Seconds the admin dashboard KPI counts are cached, and rows shown in each of its entity tables
+ADMIN_DASHBOARD_KPI_TTL = 60
+ADMIN_DASHBOARD_TABLE_ROWS = 10
+# Lab analytics: turnaround target (hours), days of completions measured, and seconds the page's data is cached
+LAB_TAT_TARGET_HOURS = 2
+LAB_TAT_WINDOW_DAYS = 30
+LAB_ANALYTICS_CACHE_TTL = 300
+# Report analytics API: longest period (days) served, and seconds a response is cached
+REPORT_ANALYTICS_MAX_DAYS = 1825
+REPORT_ANALYTICS_CACHE_TTL = 60
+# System stats API: seconds before its snapshot is refreshed in the background, and the longest a refresh may hold the lock
+SYSTEM_STATS_REFRESH_AFTER = 60
+SYSTEM_STATS_REFRESH_TIMEOUT = 300
+
 
 
 
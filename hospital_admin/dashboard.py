@@ -0,0 +1,72 @@
+"""
+Data for the hospital admin dashboard, in a fixed number of queries.
+
+- KPI counts (patients, doctors, hospitals, lab workers, pharmacists,
+  pending appointments) are cached for ADMIN_DASHBOARD_KPI_TTL seconds;
+- the week's appointment histogram is one GROUP BY over the date range;
+- the entity tables show the newest ADMIN_DASHBOARD_TABLE_ROWS rows each and
+  link to the full list pages.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from doctor.models import Appointment, Doctor_Information
+from hospital.models import Hospital_Information, Patient
+from pharmacy.models import Pharmacist
+
+from .models import Clinical_Laboratory_Technician
+
+KPI_CACHE_KEY = 'hospital_admin:dashboard-kpis'
+# Appointments still to be seen
+OPEN_APPOINTMENT_STATUSES = ['pending', 'confirmed']
+
+
+def get_kpis():
+    """Entity counts and pending appointments, cached for ADMIN_DASHBOARD_KPI_TTL seconds"""
+    def load():
+        return {
+            'patients': Patient.objects.count(),
+            'doctors': Doctor_Information.objects.count(),
+            'hospitals': Hospital_Information.objects.count(),
+            'lab_workers': Clinical_Laboratory_Technician.objects.count(),
+            'pharmacists': Pharmacist.objects.count(),
+            'pending_appointments': Appointment.objects.filter(appointment_status='pending').count(),
+        }
+
+    return cache.get_or_set(KPI_CACHE_KEY, load, getattr(settings, 'ADMIN_DASHBOARD_KPI_TTL', 60))
+
+
+def appointment_histogram(start=None, days=7):
+    """
+    Open appointments per day from ``start`` (default today), one query
+
+    Returns:
+        list of (date, weekday name, count), one per day including empty days
+    """
+    start = start or timezone.localdate()
+    end = start + datetime.timedelta(days=days)
+    counts = dict(
+        Appointment.objects.filter(date__gte=start, date__lt=end, appointment_status__in=OPEN_APPOINTMENT_STATUSES)
+        .order_by().values('date').annotate(count=Count('id')).values_list('date', 'count')
+    )
+    histogram = []
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        histogram.append((day, day.strftime("%A"), counts.get(day, 0)))
+    return histogram
+
+
+def entity_tables():
+    """Newest rows of each entity table for the dashboard"""
+    rows = getattr(settings, 'ADMIN_DASHBOARD_TABLE_ROWS', 10)
+    return {
+        'doctors': Doctor_Information.objects.order_by('-doctor_id')[:rows],
+        'patients': Patient.objects.order_by('-patient_id')[:rows],
+        'hospitals': Hospital_Information.objects.order_by('-hospital_id')[:rows],
+        'lab_workers': Clinical_Laboratory_Technician.objects.order_by('-technician_id')[:rows],
+        'pharmacists': Pharmacist.objects.order_by('-pharmacist_id')[:rows],
+    }
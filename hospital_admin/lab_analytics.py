@@ -0,0 +1,192 @@
+"""
+Lab turnaround time (TAT) and completion trends for the lab analytics page.
+
+TAT is collection to completion, read from the LabStatusTransition rows that
+Prescription_test and Report write when their status changes: one grouped
+query gives each test's first 'collected' and first 'completed' time, and
+the median / 90th percentile per test type and per technician are NumPy
+over those durations. Tests collected before transitions were recorded have
+no collection time and are left out.
+
+The completion trends are one TruncDate and one TruncMonth grouped query.
+Everything is cached for LAB_ANALYTICS_CACHE_TTL seconds.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+
+from doctor.models import LabStatusTransition, Prescription_test
+
+CACHE_KEY = 'hospital_admin:lab-analytics'
+
+Turnaround = namedtuple('Turnaround', ['test_name', 'technician_id', 'collected', 'completed', 'hours'])
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def duration_display(hours):
+    """'45 minutes' / '2.3 hours', or 'N/A' for None"""
+    if hours is None:
+        return 'N/A'
+    if hours < 1:
+        return f"{round(hours * 60)} minutes"
+    return f"{hours:.1f} hours"
+
+
+def turnarounds(since):
+    """
+    Collection-to-completion times of the tests and reports completed since ``since``
+
+    Returns:
+        list of Turnaround
+    """
+    completed_since = LabStatusTransition.objects.filter(to_status='completed', changed_at__gte=since)
+    rows = (
+        LabStatusTransition.objects.filter(to_status__in=['collected', 'completed'])
+        .filter(Q(test__in=completed_since.values('test')) | Q(report__in=completed_since.values('report')))
+        .values('test', 'report')
+        .annotate(
+            name=Coalesce(Max('test__test_name'), Max('report__test_name')),
+            technician_id=Max('technician', filter=Q(to_status='completed')),
+            collected=Min('changed_at', filter=Q(to_status='collected')),
+            completed=Min('changed_at', filter=Q(to_status='completed')),
+        )
+        .filter(collected__isnull=False)
+        .values_list('name', 'technician_id', 'collected', 'completed')
+    )
+    result = []
+    for name, technician_id, collected, completed in rows:
+        hours = (completed - collected).total_seconds() / 3600
+        if hours >= 0:
+            result.append(Turnaround(name or 'Unnamed test', technician_id, collected, completed, hours))
+    return result
+
+
+def _percentiles(hours):
+    return {
+        'count': len(hours),
+        'median_hours': round(float(np.median(hours)), 2),
+        'p90_hours': round(float(np.percentile(hours, 90)), 2),
+    }
+
+
+def _grouped(keys, hours):
+    """Median and p90 of ``hours`` per key"""
+    keys = np.array(keys, dtype=object)
+    groups = {}
+    for key in set(keys.tolist()):
+        groups[key] = _percentiles(hours[keys == key])
+    return groups
+
+
+def turnaround_stats(since):
+    """
+    TAT summary, per test type and per technician, of the tests completed since ``since``
+
+    Returns:
+        tuple: (summary dict, list of per-test-type dicts by volume, dict of technician pk -> dict)
+    """
+    target = _setting('LAB_TAT_TARGET_HOURS', 2)
+    rows = turnarounds(since)
+    summary = {'target_time': duration_display(target), 'measured': len(rows)}
+    if not rows:
+        summary.update({
+            'avg_completion_time': 'N/A', 'median_completion_time': 'N/A', 'p90_completion_time': 'N/A',
+            'fastest_completion': 'N/A', 'slowest_completion': 'N/A',
+            'on_time_percentage': 0, 'same_day_percentage': 0, 'next_day_percentage': 0,
+        })
+        return summary, [], {}
+
+    hours = np.array([row.hours for row in rows])
+    days = np.array([
+        (timezone.localtime(row.completed).date() - timezone.localtime(row.collected).date()).days for row in rows
+    ])
+    summary.update({
+        'avg_completion_time': duration_display(float(hours.mean())),
+        'median_completion_time': duration_display(float(np.median(hours))),
+        'p90_completion_time': duration_display(float(np.percentile(hours, 90))),
+        'fastest_completion': duration_display(float(hours.min())),
+        'slowest_completion': duration_display(float(hours.max())),
+        'on_time_percentage': round(float((hours <= target).mean()) * 100, 1),
+        'same_day_percentage': round(float((days == 0).mean()) * 100, 1),
+        'next_day_percentage': round(float((days == 1).mean()) * 100, 1),
+    })
+
+    by_test = [
+        {'test_name': name, **stats}
+        for name, stats in _grouped([row.test_name for row in rows], hours).items()
+    ]
+    by_test.sort(key=lambda item: (-item['count'], item['test_name']))
+    by_technician = _grouped([row.technician_id for row in rows], hours)
+    by_technician.pop(None, None)
+    return summary, by_test[:10], by_technician
+
+
+def daily_trends(today, days=7):
+    """Tests completed per local day over the last ``days`` days, oldest first"""
+    first = today - timedelta(days=days - 1)
+    counts = dict(
+        Prescription_test.objects.filter(test_status='completed', updated_at__gte=_start_of(first))
+        .annotate(day=TruncDate('updated_at')).order_by().values('day')
+        .annotate(count=Count('test_id')).values_list('day', 'count')
+    )
+    trends = []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        trends.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'date_display': day.strftime('%b %d'),
+            'completed_tests': counts.get(day, 0),
+        })
+    return trends
+
+
+def monthly_trends(today, months=6):
+    """Tests completed per calendar month over the last ``months`` months, oldest first"""
+    starts = [today.replace(day=1)]
+    for _ in range(months - 1):
+        starts.append((starts[-1] - timedelta(days=1)).replace(day=1))
+    starts.reverse()
+    counts = {
+        month.date(): count for month, count in
+        Prescription_test.objects.filter(test_status='completed', updated_at__gte=_start_of(starts[0]))
+        .annotate(month=TruncMonth('updated_at')).order_by().values('month')
+        .annotate(count=Count('test_id')).values_list('month', 'count')
+    }
+    return [
+        {
+            'month': start.strftime('%Y-%m'),
+            'month_display': start.strftime('%B %Y'),
+            'completed_tests': counts.get(start, 0),
+        }
+        for start in starts
+    ]
+
+
+def get_lab_analytics():
+    """TAT statistics and completion trends, cached for LAB_ANALYTICS_CACHE_TTL seconds"""
+    def load():
+        today = timezone.localdate()
+        since = _start_of(today - timedelta(days=_setting('LAB_TAT_WINDOW_DAYS', 30)))
+        summary, by_test, by_technician = turnaround_stats(since)
+        return {
+            'turnaround_stats': summary,
+            'turnaround_by_test': by_test,
+            'turnaround_by_technician': by_technician,
+            'daily_trends': daily_trends(today),
+            'monthly_trends': monthly_trends(today),
+        }
+
+    return cache.get_or_set(CACHE_KEY, load, _setting('LAB_ANALYTICS_CACHE_TTL', 300))
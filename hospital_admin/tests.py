@@ -1,3 +1,243 @@
+import datetime
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+
+class AdminDashboardTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        from .models import Admin_Information
+
+        cache.clear()
+        admin = User.objects.create_user(username='admin', password='x', is_hospital_admin=True)
+        Admin_Information.objects.get_or_create(user=admin)
+        self.client.force_login(admin)
+
+    def add(self, count, date=None, status='pending'):
+        from doctor.models import Appointment, Doctor_Information
+        from hospital.models import Patient, User
+
+        for _ in range(count):
+            number = User.objects.count()
+            user = User.objects.create_user(username=f'patient-{number}', password='x', is_patient=True)
+            patient, _ = Patient.objects.get_or_create(user=user, defaults={'name': f'Patient {number}'})
+            doctor = Doctor_Information.objects.create(name=f'Doctor {number}')
+            Appointment.objects.create(
+                date=date or timezone.localdate(), doctor=doctor, patient=patient,
+                appointment_type='checkup', appointment_status=status,
+            )
+
+    def dashboard_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_tables(self):
+        with self.settings(ADMIN_DASHBOARD_TABLE_ROWS=3):
+            self.add(2)
+            self.dashboard_queries()  # first request also sets up the session
+            _, few = self.dashboard_queries()
+            self.add(8)
+            response, many = self.dashboard_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['doctors']), 3)
+        self.assertEqual(response.context['kpis']['doctors'], 10)
+        self.assertEqual(response.context['pending_appointment'], 10)
+
+    def test_histogram_counts_open_appointments_per_day(self):
+        from .dashboard import appointment_histogram
+
+        today = timezone.localdate()
+        self.add(2, today)
+        self.add(1, today + datetime.timedelta(days=2), status='confirmed')
+        self.add(1, today + datetime.timedelta(days=2), status='cancelled')
+        self.add(1, today + datetime.timedelta(days=7))
+
+        with self.assertNumQueries(1):
+            histogram = appointment_histogram(today)
+        self.assertEqual([count for _, _, count in histogram], [2, 0, 1, 0, 0, 0, 0])
+        self.assertEqual(histogram[0][1], today.strftime('%A'))
+
+        response, _ = self.dashboard_queries()
+        self.assertEqual(response.context['sat_count'], 2)
+        self.assertEqual(response.context['mon_count'], 1)
+
+
+class LabDashboardTestCase(TestCase):
+    # Session, user, technician, counters, prescriptions + their tests, urgent queue,
+    # completed today, newly assigned, workflow tests, reports, doctor stats, and
+    # the session save (savepoint, update, release)
+    QUERIES = 15
+
+    def setUp(self):
+        from doctor.models import Doctor_Information
+        from hospital.models import User
+        from .models import Clinical_Laboratory_Technician
+
+        user = User.objects.create_user(username='lab', password='x', is_labworker=True)
+        self.technician, _ = Clinical_Laboratory_Technician.objects.get_or_create(user=user, defaults={'name': 'Lab', 'age': 30})
+        self.doctor = Doctor_Information.objects.create(name='Doctor')
+        self.client.force_login(user)
+
+    def prescribe(self, count, status='completed'):
+        from doctor.models import Prescription, Prescription_test, Report
+        from hospital.models import Patient, User
+
+        tests = []
+        for _ in range(count):
+            number = User.objects.count()
+            user = User.objects.create_user(username=f'patient-{number}', password='x', is_patient=True)
+            patient, _ = Patient.objects.get_or_create(user=user, defaults={'name': f'Patient {number}'})
+            prescription = Prescription.objects.create(doctor=self.doctor, patient=patient, create_date='2026-10-01')
+            for name in ['CBC', 'Lipid Profile']:
+                tests.append(Prescription_test.objects.create(
+                    prescription=prescription, test_name=name, test_info_pay_status='paid',
+                    test_status=status, assigned_technician=self.technician,
+                ))
+            Report.objects.create(patient=patient, doctor=self.doctor, test_name='CBC')
+        return tests
+
+    def dashboard(self):
+        response = self.client.get(reverse('lab-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_query_count_is_pinned(self):
+        self.prescribe(2)
+        self.prescribe(1, status='processing')
+        self.dashboard()  # first request also sets up the session
+        with self.assertNumQueries(self.QUERIES):
+            self.dashboard()
+        self.prescribe(12)
+        self.prescribe(5, status='paid')
+        with self.assertNumQueries(self.QUERIES):
+            response = self.dashboard()
+
+        self.assertEqual(response.context['test_stats']['total_prescribed'], 40)
+        self.assertEqual(response.context['test_stats']['processing'], 2)
+        self.assertEqual(response.context['my_workload']['total_assigned'], 40)
+        self.assertEqual(response.context['my_workload']['pending_work'], 10)
+        self.assertEqual(response.context['my_workload']['completed_today'], 28)
+        self.assertEqual(len(response.context['recent_prescriptions']), 10)
+        for prescription in response.context['recent_prescriptions']:
+            self.assertEqual(len(prescription.tests), 2)
+
+    def test_workflow_tests_find_their_reports(self):
+        self.prescribe(3)
+        tests = self.dashboard().context['tests_with_workflow']
+        self.assertEqual(len(tests), 6)
+        for test in tests:
+            self.assertEqual(test.has_report, test.test_name == 'CBC')
+            if test.has_report:
+                self.assertEqual(test.report.patient_id, test.prescription.patient_id)
+
+
+class LabTurnaroundTestCase(TestCase):
+    def setUp(self):
+        from doctor.models import Prescription
+        from hospital.models import User
+        from .models import Clinical_Laboratory_Technician
+
+        cache.clear()
+        self.user = User.objects.create_user(username='lab', password='x', is_labworker=True)
+        self.technician, _ = Clinical_Laboratory_Technician.objects.get_or_create(user=self.user, defaults={'name': 'Lab'})
+        self.prescription = Prescription.objects.create(create_date='2026-10-01')
+
+    def run_test(self, name, hours, technician=None, completed_at=None):
+        """A test collected ``hours`` before it was completed at ``completed_at`` (default now)"""
+        from doctor.models import Prescription_test
+
+        test = Prescription_test.objects.create(
+            prescription=self.prescription, test_name=name, test_info_pay_status='paid', test_status='paid',
+            assigned_technician=technician or self.technician,
+        )
+        for status in ['collected', 'processing', 'completed']:
+            test.test_status = status
+            test.save()
+        completed_at = completed_at or timezone.now()
+        test.status_transitions.filter(to_status='completed').update(changed_at=completed_at)
+        test.status_transitions.filter(to_status='collected').update(changed_at=completed_at - datetime.timedelta(hours=hours))
+        return test
+
+    def test_status_changes_are_recorded(self):
+        from doctor.models import Prescription_test, Report
+
+        test = self.run_test('CBC', 1)
+        self.assertEqual(
+            list(test.status_transitions.order_by('transition_id').values_list('from_status', 'to_status')),
+            [('', 'paid'), ('paid', 'collected'), ('collected', 'processing'), ('processing', 'completed')],
+        )
+        # Saving without a status change, or with the status not loaded, records nothing
+        Prescription_test.objects.get(pk=test.pk).save()
+        Prescription_test.objects.only('test_id', 'test_name').get(pk=test.pk).save()
+        self.assertEqual(test.status_transitions.count(), 4)
+
+        reports = [Report.objects.create(test_name='CBC') for _ in range(2)]
+        self.assertEqual(Report.update_status(Report.objects.all(), 'collected', assigned_technician=self.technician), 2)
+        self.assertEqual(Report.update_status(Report.objects.filter(pk=reports[0].pk), 'collected'), 1)
+        transition = reports[0].status_transitions.get(to_status='collected')
+        self.assertEqual((transition.from_status, transition.technician_id), ('pending', self.technician.pk))
+
+    def test_percentiles_per_test_and_technician(self):
+        from hospital.models import User
+        from .lab_analytics import turnaround_stats
+        from .models import Clinical_Laboratory_Technician
+
+        other_user = User.objects.create_user(username='lab2', password='x', is_labworker=True)
+        other, _ = Clinical_Laboratory_Technician.objects.get_or_create(user=other_user, defaults={'name': 'Lab 2'})
+        for hours in [1, 2, 3, 4, 10]:
+            self.run_test('CBC', hours)
+        self.run_test('Lipid Profile', 0.5, technician=other)
+        # Completed before the window
+        self.run_test('CBC', 50, completed_at=timezone.now() - datetime.timedelta(days=40))
+
+        with self.assertNumQueries(1):
+            summary, by_test, by_technician = turnaround_stats(timezone.now() - datetime.timedelta(days=30))
+        self.assertEqual(summary['measured'], 6)
+        self.assertEqual(summary['fastest_completion'], '30 minutes')
+        self.assertEqual(summary['slowest_completion'], '10.0 hours')
+        self.assertEqual(summary['on_time_percentage'], 50.0)
+        self.assertEqual(by_test[0], {'test_name': 'CBC', 'count': 5, 'median_hours': 3.0, 'p90_hours': 7.6})
+        self.assertEqual(by_test[1]['median_hours'], 0.5)
+        self.assertEqual(by_technician[other.pk]['count'], 1)
+        self.assertEqual(by_technician[self.technician.pk]['median_hours'], 3.0)
+
+    def test_trends_are_one_query_each(self):
+        from doctor.models import Prescription_test
+        from .lab_analytics import daily_trends, monthly_trends
+
+        today = timezone.localdate()
+        for days_ago in [0, 0, 2, 40]:
+            test = self.run_test('CBC', 1)
+            Prescription_test.objects.filter(pk=test.pk).update(
+                updated_at=timezone.now() - datetime.timedelta(days=days_ago)
+            )
+
+        with self.assertNumQueries(1):
+            daily = daily_trends(today)
+        self.assertEqual([day['completed_tests'] for day in daily], [0, 0, 0, 0, 1, 0, 2])
+        with self.assertNumQueries(1):
+            monthly = monthly_trends(today)
+        self.assertEqual(len(monthly), 6)
+        self.assertEqual(monthly[-1]['month'], today.strftime('%Y-%m'))
+        self.assertEqual(sum(month['completed_tests'] for month in monthly), 4)
+
+    def test_analytics_page_is_cached(self):
+        self.run_test('CBC', 1.5)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lab-analytics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['turnaround_stats']['median_completion_time'], '1.5 hours')
+        self.assertEqual(response.context['technician_performance'][0].turnaround['count'], 1)
 
-# Create your tests here.
+        self.run_test('CBC', 3)
+        response = self.client.get(reverse('lab-analytics'))
+        self.assertEqual(response.context['turnaround_stats']['measured'], 1)
@@ -65,8 +65,10 @@ urlpatterns = [
     path('pharmacist-sales/', views.pharmacist_sales, name='pharmacist-sales'),
     path('pharmacist-purchase-history/', views.pharmacist_purchase_history, name='pharmacist-purchase-history'),
     path('pharmacist-order-management/', views.pharmacist_order_management, name='pharmacist-order-management'),
+    path('pharmacist-order-board/<str:section>/', views.pharmacist_order_board_section, name='pharmacist-order-board-section'),
     path('update-order-status/<int:order_id>/', views.update_order_status, name='update-order-status'),
     path('bulk-medicine-management/', views.bulk_medicine_management, name='bulk-medicine-management'),
+    path('export-medicines/', views.export_medicines, name='export-medicines'),
     path('medicine/<int:pk>/increase/', views.increase_medicine_stock, name='increase-medicine-stock'),
     path('medicine/<int:pk>/decrease/', views.decrease_medicine_stock, name='decrease-medicine-stock'),
     path('process-cod-payment/<int:order_id>/', views.process_cod_payment, name='process-cod-payment'),
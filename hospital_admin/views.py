@@ -12,11 +12,13 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.core.paginator import Paginator
 from hospital.models import Hospital_Information, User, Patient
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
-from pharmacy.models import Medicine, Pharmacist
+from pharmacy.models import Medicine, MedicineForecast, Pharmacist, StockMovement
+from pharmacy import batches, ledger
 from pharmacy.forms import MedicineForm
-from doctor.models import Doctor_Information, Prescription, Prescription_test, Report, Appointment, Experience , Education,Specimen,Test
+from doctor.models import Doctor_Information, Prescription, Prescription_test, Report, Experience , Education,Specimen,Test
 from pharmacy.models import Order, Cart
 from .forms import AdminUserCreationForm, LabWorkerCreationForm, EditHospitalForm, EditEmergencyForm,AdminForm , PharmacistCreationForm 
 
@@ -26,8 +28,9 @@ import random,re
 import string
 import uuid
 import json
-from django.db.models import Count, Q
+from django.db.models import Count, F, FloatField, Prefetch, Q, Value
 from django.db.models import Sum
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
@@ -67,56 +70,16 @@ def dashboard(request):
 def admin_dashboard(request):
     # admin = Admin_Information.objects.get(user_id=pk)
     if request.user.is_hospital_admin:
-        user = Admin_Information.objects.get(user=request.user)
-        total_patient_count = Patient.objects.annotate(count=Count('patient_id'))
-        total_doctor_count = Doctor_Information.objects.annotate(count=Count('doctor_id'))
-        total_pharmacist_count = Pharmacist.objects.annotate(count=Count('pharmacist_id'))
-        total_hospital_count = Hospital_Information.objects.annotate(count=Count('hospital_id'))
-        total_labworker_count = Clinical_Laboratory_Technician.objects.annotate(count=Count('technician_id'))
-        pending_appointment = Appointment.objects.filter(appointment_status='pending').count()
-        doctors = Doctor_Information.objects.all()
-        patients = Patient.objects.all()
-        hospitals = Hospital_Information.objects.all()
-        lab_workers = Clinical_Laboratory_Technician.objects.all()
-        pharmacists = Pharmacist.objects.all()
-        
-        sat_date = datetime.date.today()
-        sat_date_str = str(sat_date)
-        sat = sat_date.strftime("%A")
+        from .dashboard import appointment_histogram, entity_tables, get_kpis
 
-        sun_date = sat_date + datetime.timedelta(days=1) 
-        sun_date_str = str(sun_date)
-        sun = sun_date.strftime("%A")
-        
-        mon_date = sat_date + datetime.timedelta(days=2) 
-        mon_date_str = str(mon_date)
-        mon = mon_date.strftime("%A")
-        
-        tues_date = sat_date + datetime.timedelta(days=3) 
-        tues_date_str = str(tues_date)
-        tues = tues_date.strftime("%A")
-        
-        wed_date = sat_date + datetime.timedelta(days=4) 
-        wed_date_str = str(wed_date)
-        wed = wed_date.strftime("%A")
-        
-        thurs_date = sat_date + datetime.timedelta(days=5) 
-        thurs_date_str = str(thurs_date)
-        thurs = thurs_date.strftime("%A")
-        
-        fri_date = sat_date + datetime.timedelta(days=6) 
-        fri_date_str = str(fri_date)
-        fri = fri_date.strftime("%A")
-        
-        sat_count = Appointment.objects.filter(date=sat_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        sun_count = Appointment.objects.filter(date=sun_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        mon_count = Appointment.objects.filter(date=mon_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        tues_count = Appointment.objects.filter(date=tues_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        wed_count = Appointment.objects.filter(date=wed_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        thurs_count = Appointment.objects.filter(date=thurs_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-        fri_count = Appointment.objects.filter(date=fri_date_str).filter(Q(appointment_status='pending') | Q(appointment_status='confirmed')).count()
-
-        context = {'admin': user,'total_patient_count': total_patient_count,'total_doctor_count':total_doctor_count,'pending_appointment':pending_appointment,'doctors':doctors,'patients':patients,'hospitals':hospitals,'lab_workers':lab_workers,'total_pharmacist_count':total_pharmacist_count,'total_hospital_count':total_hospital_count,'total_labworker_count':total_labworker_count,'sat_count': sat_count, 'sun_count': sun_count, 'mon_count': mon_count, 'tues_count': tues_count, 'wed_count': wed_count, 'thurs_count': thurs_count, 'fri_count': fri_count, 'sat': sat, 'sun': sun, 'mon': mon, 'tues': tues, 'wed': wed, 'thurs': thurs, 'fri': fri, 'pharmacists': pharmacists}
+        user = Admin_Information.objects.get(user=request.user)
+        kpis = get_kpis()
+        context = {'admin': user, 'kpis': kpis, 'pending_appointment': kpis['pending_appointments']}
+        context.update(entity_tables())
+        # The chart reads the seven days starting today as sat..fri
+        for key, (day, weekday, count) in zip(['sat', 'sun', 'mon', 'tues', 'wed', 'thurs', 'fri'], appointment_histogram()):
+            context[key] = weekday
+            context[key + '_count'] = count
         return render(request, 'hospital_admin/admin-dashboard.html', context)
     elif request.user.is_labworker:
         # messages.error(request, 'You are not authorized to access this page')
@@ -833,7 +796,7 @@ def generate_random_medicine_ID():
 @csrf_exempt
 @login_required(login_url='admin_login')
 def add_medicine(request):
-    from pharmacy.hsn_utils import auto_fetch_hsn_code
+    from pharmacy import hsn_cache
     
     user = None
     pharmacist_ctx = None
@@ -901,7 +864,7 @@ def add_medicine(request):
         # Auto-fetch HSN code if requested and not manually provided
         hsn_info = None
         if fetch_hsn and not hsn_code and name:
-            hsn_result = auto_fetch_hsn_code(
+            hsn_result = hsn_cache.lookup(
                 medicine_name=name,
                 composition=composition,
                 category=category_type
@@ -996,7 +959,7 @@ def add_medicine(request):
 @csrf_exempt
 @login_required(login_url='admin_login')
 def edit_medicine(request, pk):
-    from pharmacy.hsn_utils import auto_fetch_hsn_code
+    from pharmacy import hsn_cache
     
     if request.user.is_pharmacist:
         user = Pharmacist.objects.get(user=request.user)
@@ -1010,6 +973,7 @@ def edit_medicine(request, pk):
     medicine = get_object_or_404(Medicine, serial_number=pk)
     
     if request.method == 'POST':
+        before = (medicine.quantity, medicine.stock_quantity)
         form = MedicineForm(request.POST, request.FILES, instance=medicine)
         
         if form.is_valid():
@@ -1018,7 +982,7 @@ def edit_medicine(request, pk):
             # Handle HSN auto-fetch if requested
             fetch_hsn = request.POST.get('fetch_hsn', 'off') == 'on'
             if fetch_hsn and not updated_medicine.hsn_code:
-                hsn_result = auto_fetch_hsn_code(
+                hsn_result = hsn_cache.lookup(
                     medicine_name=updated_medicine.name,
                     composition=updated_medicine.composition,
                     category=updated_medicine.medicine_category
@@ -1042,7 +1006,15 @@ def edit_medicine(request, pk):
                 except ValueError:
                     pass  # Keep existing value if conversion fails
             
-            updated_medicine.save()
+            with transaction.atomic():
+                updated_medicine.save()
+                movement = ledger.record_levels(updated_medicine, before, StockMovement.ADJUSTMENT, reference='edit', user=request.user)
+                batches.apply_changes([(
+                    updated_medicine.pk,
+                    movement.quantity_change if movement else 0,
+                    updated_medicine.batch_no or '',
+                    updated_medicine.expiry_date,
+                )])
             
             # Enhanced success message with composition and HSN info
             success_msg = f'Medicine "{updated_medicine.name}" updated successfully!'
@@ -1591,26 +1563,31 @@ def pharmacist_dashboard(request):
             }
 
             # Expiring medicines within next 30 days
-            import datetime as _dt
-            today = _dt.date.today()
-            threshold = today + _dt.timedelta(days=30)
-            expiring_medicines = Medicine.objects.filter(expiry_date__isnull=False, expiry_date__lte=threshold).order_by('expiry_date')[:20]
-
-            # Sales summaries (today, last 7 days, last 30 days)
-            start_today = _dt.datetime.combine(today, _dt.time.min).replace(tzinfo=timezone.get_current_timezone())
-            start_7d = start_today - _dt.timedelta(days=7)
-            start_30d = start_today - _dt.timedelta(days=30)
-
-            def sum_orders_since(start_dt):
-                orders = Order.objects.filter(ordered=True, created__gte=start_dt)
-                total = 0.0
-                for o in orders:
-                    total += float(o.get_totals())
-                return round(total, 2)
-
-            sales_today = sum_orders_since(start_today)
-            sales_7d = sum_orders_since(start_7d)
-            sales_30d = sum_orders_since(start_30d)
+            expiring_medicines = batches.expiring_batches(30)[:20]
+
+            # Sales summaries (today, last 7 days, last 30 days) from the daily rollup
+            from pharmacy import sales
+
+            def sum_orders_since(days_back):
+                local_today = timezone.localdate()
+                total = sales.daily_totals(local_today - timedelta(days=days_back), local_today)['revenue']
+                return round(float(total), 2)
+
+            sales_today = sum_orders_since(0)
+            sales_7d = sum_orders_since(7)
+            sales_30d = sum_orders_since(30)
+
+            # Medicines at or below their forecast reorder point, soonest to run out first
+            on_hand = Greatest(Coalesce(F('medicine__quantity'), 0), 0)
+            reorder_suggestions = (
+                MedicineForecast.objects.select_related('medicine')
+                .filter(daily_demand__gt=0, medicine__quantity__lte=F('reorder_point'))
+                .annotate(
+                    to_order=Greatest(F('order_up_to') - on_hand, Value(0)),
+                    cover_days=on_hand * Value(1.0, output_field=FloatField()) / F('daily_demand'),
+                )
+                .order_by('cover_days')[:20]
+            )
 
             # Top-selling medicines by purchased cart items
             top_selling = (
@@ -1627,39 +1604,20 @@ def pharmacist_dashboard(request):
             page_number = request.GET.get('page')
             page_obj = paginator.get_page(page_number)
             
-            # Prepare JSON data for JavaScript charts and search
+            # Stock chart data; the full catalog for search/modal is fetched
+            # lazily from the pharmacy catalog snapshot endpoint
             import json
-            medicines_for_chart = Medicine.objects.all()[:20]  # Top 20 for chart
-            all_medicines_for_search = Medicine.objects.all()  # All medicines for search functionality
-            
-            # Chart data (limited to 20)
+            medicines_for_chart = Medicine.objects.values_list('name', 'quantity')[:20]
             chart_json = json.dumps([
                 {
-                    'name': medicine.name,
-                    'stock': medicine.quantity if medicine.quantity else 0,
-                }
-                for medicine in medicines_for_chart
-            ])
-            
-            # All medicines data for search and modal functionality
-            medicines_json = json.dumps([
-                {
-                    'id': medicine.serial_number,
-                    'serial_number': medicine.serial_number,
-                    'name': medicine.name,
-                    'stock': medicine.quantity if medicine.quantity else 0,
-                    'price': float(medicine.price) if medicine.price else 0.0,
-                    'category': medicine.medicine_category or '',
-                    'type': medicine.medicine_type or '',
-                    'composition': medicine.composition or '',
-                    'hsn_code': medicine.hsn_code or ''
+                    'name': name,
+                    'stock': quantity if quantity else 0,
                 }
-                for medicine in all_medicines_for_search
+                for name, quantity in medicines_for_chart
             ])
             
             context = {'pharmacist':pharmacist, 'medicine':page_obj,
                        'medicines': medicine_list,  # All medicines for template
-                       'medicines_json': medicines_json,  # All medicines data for search/modal
                        'chart_json': chart_json,  # Limited data for charts
                        'total_pharmacist_count':total_pharmacist_count, 
                        'total_medicine_count':total_medicine_count, 
@@ -1671,6 +1629,7 @@ def pharmacist_dashboard(request):
                        'sales_7d': sales_7d,
                        'sales_30d': sales_30d,
                        'top_selling': top_selling,
+                       'reorder_suggestions': reorder_suggestions,
                        }
             return render(request, 'hospital_admin/pharmacist-dashboard.html',context)
 
@@ -1685,9 +1644,19 @@ def increase_medicine_stock(request, pk):
             count = int(request.POST.get('count', 1))
             if count < 1:
                 count = 1
-            medicine.quantity = (medicine.quantity or 0) + count
-            medicine.stock_quantity = (medicine.stock_quantity or 0) + count
-            medicine.save()
+            # Optional: the batch the units came in (default: the medicine's current batch)
+            batch_no = request.POST.get('batch_no', '').strip() or None
+            expiry_date = None
+            if request.POST.get('expiry_date'):
+                expiry_date = datetime.datetime.strptime(request.POST['expiry_date'], '%Y-%m-%d').date()
+            with transaction.atomic():
+                medicine = Medicine.objects.select_for_update().get(serial_number=pk)
+                ledger.set_levels(
+                    medicine, StockMovement.RECEIPT,
+                    (medicine.quantity or 0) + count, (medicine.stock_quantity or 0) + count,
+                    reference='dashboard', user=request.user,
+                )
+                batches.apply_changes([(medicine.pk, count, batch_no, expiry_date)])
             messages.success(request, f"Increased stock for {medicine.name} by {count}")
         except Exception as e:
             messages.error(request, f"Error: {e}")
@@ -1704,11 +1673,16 @@ def decrease_medicine_stock(request, pk):
             count = int(request.POST.get('count', 1))
             if count < 1:
                 count = 1
-            new_q = max(0, (medicine.quantity or 0) - count)
-            diff = (medicine.quantity or 0) - new_q
-            medicine.quantity = new_q
-            medicine.stock_quantity = max(0, (medicine.stock_quantity or 0) - diff)
-            medicine.save()
+            with transaction.atomic():
+                medicine = Medicine.objects.select_for_update().get(serial_number=pk)
+                new_q = max(0, (medicine.quantity or 0) - count)
+                diff = (medicine.quantity or 0) - new_q
+                ledger.set_levels(
+                    medicine, StockMovement.ADJUSTMENT,
+                    new_q, max(0, (medicine.stock_quantity or 0) - diff),
+                    reference='dashboard', user=request.user,
+                )
+                batches.apply_changes([(medicine.pk, -diff, None, None)])
             messages.success(request, f"Decreased stock for {medicine.name} by {diff}")
         except Exception as e:
             messages.error(request, f"Error: {e}")
@@ -1768,52 +1742,47 @@ def pharmacist_sales(request):
         return redirect('admin-logout')
     pharmacist = Pharmacist.objects.get(user=request.user)
 
-    # Completed orders
-    orders = Order.objects.filter(ordered=True).select_related('user').order_by('-created')
+    from urllib.parse import urlencode
+    from pharmacy import sales
+    from pharmacy.utils import keyset_paginate
 
     # Optional date filter
     start = request.GET.get('start')
     end = request.GET.get('end')
-    from datetime import datetime as _dt
+    start_date = end_date = None
     if start:
         try:
-            start_dt = _dt.strptime(start, "%Y-%m-%d")
-            orders = orders.filter(created__date__gte=start_dt.date())
+            start_date = datetime.datetime.strptime(start, "%Y-%m-%d").date()
         except ValueError:
             messages.error(request, 'Invalid start date')
     if end:
         try:
-            end_dt = _dt.strptime(end, "%Y-%m-%d")
-            orders = orders.filter(created__date__lte=end_dt.date())
+            end_date = datetime.datetime.strptime(end, "%Y-%m-%d").date()
         except ValueError:
             messages.error(request, 'Invalid end date')
 
-    # Aggregate totals
-    total_revenue = sum(float(o.get_totals()) for o in orders)
-    total_orders = orders.count()
+    # Completed orders; totals and top sellers are aggregated in the database
+    orders = sales.placed_orders(start_date, end_date)
+    totals = sales.summary(orders)
+    top_items = sales.top_items(orders)
 
-    # Top 10 items by quantity within filtered orders timeframe/users
-    carts_qs = Cart.objects.filter(purchased=True)
-    user_ids = list(orders.values_list('user_id', flat=True))
-    if user_ids:
-        carts_qs = carts_qs.filter(user_id__in=user_ids)
-    if start:
-        try:
-            carts_qs = carts_qs.filter(updated__date__gte=start_dt.date())
-        except Exception:
-            pass
-    if end:
-        try:
-            carts_qs = carts_qs.filter(updated__date__lte=end_dt.date())
-        except Exception:
-            pass
-    top_items = carts_qs.values('item__name').annotate(total_qty=Sum('quantity')).order_by('-total_qty')[:10]
+    # Newest first, seeking on (created, id) instead of loading every order
+    cursor = request.GET.get('after')
+    page, next_cursor = keyset_paginate(
+        orders.select_related('user').annotate(amount=sales.order_subtotal()),
+        ('-created', '-id'), cursor=cursor, page_size=getattr(settings, 'PHARMACY_SALES_PAGE_SIZE', 50),
+    )
+    base_query = {key: value for key, value in (('start', start), ('end', end)) if value}
+    next_page_url = '?' + urlencode({**base_query, 'after': next_cursor}) if next_cursor else None
+    first_page_url = '?' + urlencode(base_query) if cursor else None
 
     context = {
-        'orders': orders,
-        'total_revenue': round(total_revenue, 2),
-        'total_orders': total_orders,
+        'orders': page,
+        'total_revenue': round(float(totals['revenue']), 2),
+        'total_orders': totals['orders'],
         'top_items': top_items,
+        'next_page_url': next_page_url,
+        'first_page_url': first_page_url,
         'start': start or '',
         'end': end or '',
         'pharmacist': pharmacist,
@@ -1828,27 +1797,16 @@ def pharmacist_purchase_history(request):
         return redirect('admin-logout')
     pharmacist = Pharmacist.objects.get(user=request.user)
 
-    # Get completed orders with their items (including COD orders)
-    from pharmacy.models import Order
-    from django.db.models import Q
-    completed_orders = (
-        Order.objects.filter(ordered=True)
-        .filter(Q(payment_status='paid') | Q(payment_status='cod') | Q(payment_status='cash_on_delivery'))
-        .select_related('user')
-        .prefetch_related('orderitems__item')
-        .order_by('-created')
-    )
-
-    # Each purchased cart item as row history (for backward compatibility)
-    purchased_items = (
-        Cart.objects.filter(purchased=True)
-        .select_related('item', 'user')
-        .order_by('-updated')
-    )
+    # First page of completed orders and purchased items; older rows load over JSON
+    from pharmacy import order_board
+    completed_orders, orders_cursor = order_board.get_page('completed_orders')
+    purchased_items, items_cursor = order_board.get_page('purchased_items')
 
     context = {
         'purchased_items': purchased_items,
         'completed_orders': completed_orders,
+        'next_cursors': {'completed_orders': orders_cursor, 'purchased_items': items_cursor},
+        'counts': order_board.get_counts(),
         'pharmacist': pharmacist,
     }
     return render(request, 'hospital_admin/pharmacist-purchase-history.html', context)
@@ -1861,139 +1819,57 @@ def pharmacist_order_management(request):
         return redirect('admin-logout')
     pharmacist = Pharmacist.objects.get(user=request.user)
 
-    # Get all orders with different payment statuses
-    from pharmacy.models import Order, PrescriptionUpload
-    from django.db.models import Q
-    
-    # Online paid orders
-    online_orders = (
-        Order.objects.filter(ordered=True, payment_status='paid')
-        .exclude(order_status__in=['delivered', 'completed', 'cancelled'])
-        .select_related('user__patient')
-        .prefetch_related('orderitems__item')
-        .order_by('-created')
-    )
-    
-    # COD orders (Cash on Delivery)
-    cod_orders = (
-        Order.objects.filter(
-            ordered=True, 
-            payment_status__in=['cod', 'cash_on_delivery', 'cod_pending']
-        )
-        .exclude(order_status__in=['delivered', 'completed', 'cancelled'])
-        .select_related('user__patient')
-        .prefetch_related('orderitems__item')
-        .order_by('-created')
-    )
-    
-    # Failed payment orders that need attention
-    failed_orders = (
-        Order.objects.filter(
-            Q(payment_status='failed') | Q(payment_status='pending'),
-            ordered=False
-        )
-        .select_related('user__patient')
-        .prefetch_related('orderitems__item')
-        .order_by('-created')[:10]  # Last 10 failed orders
-    )
-    
-    # Orders ready for pickup
-    ready_orders = (
-        Order.objects.filter(
-            ordered=True,
-            order_status='ready',
-            payment_status__in=['paid', 'cod', 'cash_on_delivery']
-        )
-        .select_related('user__patient')
-        .prefetch_related('orderitems__item')
-        .order_by('created')
-    )
-    
-    # Out for delivery orders
-    delivery_orders = (
-        Order.objects.filter(
-            ordered=True,
-            order_status='out_for_delivery',
-            delivery_method='delivery'
-        )
-        .select_related('user__patient')
-        .prefetch_related('orderitems__item')
-        .order_by('created')
-    )
+    from pharmacy import order_board
+    from pharmacy.models import Order
+
+    # First page of every section (orders and prescription uploads); the
+    # rest loads over JSON from pharmacist_order_board_section
+    context = {'pharmacist': pharmacist, 'next_cursors': {}}
+    for section in order_board.BOARD_SECTIONS:
+        rows, next_cursor = order_board.get_page(section)
+        key = section if section.endswith('_prescriptions') else f'{section}_orders'
+        context[key] = rows
+        context['next_cursors'][section] = next_cursor
 
     # Calculate stats
-    total_pending = online_orders.count() + cod_orders.count()
-    total_revenue_today = sum([
-        float(order.final_bill()) for order in 
+    counts = order_board.get_counts()
+    total_revenue_today = float(
         Order.objects.filter(
             ordered=True,
             payment_status__in=['paid', 'cod', 'cash_on_delivery'],
             created__date=timezone.now().date()
-        )
-    ])
-    
-    # Low stock medicines alert
-    low_stock_medicines = Medicine.objects.filter(quantity__lte=10).order_by('quantity')[:10]
-
-    # PRESCRIPTION UPLOADS MANAGEMENT
-    # Pending prescription reviews
-    pending_prescriptions = (
-        PrescriptionUpload.objects.filter(status='pending')
-        .select_related('patient')
-        .order_by('-uploaded_at')
-    )
-    
-    # Approved prescriptions waiting for payment
-    approved_prescriptions = (
-        PrescriptionUpload.objects.filter(status='approved', related_order__isnull=True)
-        .select_related('patient', 'pharmacist')
-        .prefetch_related('medicines__medicine')
-        .order_by('-reviewed_at')
-    )
-    
-    # Paid prescriptions waiting for processing (NEW)
-    paid_pending_prescriptions = (
-        PrescriptionUpload.objects.filter(status='paid_pending')
-        .select_related('patient', 'pharmacist', 'related_order')
-        .prefetch_related('medicines__medicine')
-        .order_by('-updated_at')
-    )
-    
-    # Fulfilled prescription orders
-    fulfilled_prescriptions = (
-        PrescriptionUpload.objects.filter(status='fulfilled')
-        .select_related('patient', 'pharmacist', 'related_order')
-        .prefetch_related('medicines__medicine')
-        .order_by('-updated_at')[:20]  # Last 20 fulfilled prescriptions
-    )
-    
-    # Rejected prescriptions (for review)
-    rejected_prescriptions = (
-        PrescriptionUpload.objects.filter(status='rejected')
-        .select_related('patient', 'pharmacist')
-        .order_by('-reviewed_at')[:10]  # Last 10 rejected
+        ).aggregate(total=Sum('grand_total'))['total'] or 0
     )
 
-    context = {
-        'online_orders': online_orders,
-        'cod_orders': cod_orders,
-        'failed_orders': failed_orders,
-        'ready_orders': ready_orders,
-        'delivery_orders': delivery_orders,
-        'pharmacist': pharmacist,
-        'total_pending': total_pending,
+    context.update({
+        'counts': counts,
+        'total_pending': counts['online'] + counts['cod'],
         'total_revenue_today': round(total_revenue_today, 2),
-        'low_stock_medicines': low_stock_medicines,
-        # Prescription management
-        'pending_prescriptions': pending_prescriptions,
-        'approved_prescriptions': approved_prescriptions,
-        'paid_pending_prescriptions': paid_pending_prescriptions,
-        'fulfilled_prescriptions': fulfilled_prescriptions,
-        'rejected_prescriptions': rejected_prescriptions,
-    }
+        # Low stock medicines alert
+        'low_stock_medicines': Medicine.objects.filter(quantity__lte=10).order_by('quantity')[:10],
+    })
     return render(request, 'hospital_admin/pharmacist-order-management.html', context)
 
 
+@csrf_exempt
+@login_required(login_url='admin_login')
+def pharmacist_order_board_section(request, section):
+    """Next page of an order board / purchase history section as rendered rows"""
+    if not request.user.is_pharmacist:
+        return JsonResponse({'error': 'Not authorized'}, status=403)
+
+    from pharmacy import order_board
+    if section not in order_board.SECTIONS:
+        return JsonResponse({'error': 'Unknown section'}, status=404)
+
+    rows, next_cursor = order_board.get_page(section, request.GET.get('after'))
+    return JsonResponse({
+        'html': order_board.render_rows(section, rows, request=request),
+        'next_cursor': next_cursor,
+        'count': order_board.get_counts()[section],
+    })
+
+
 @csrf_exempt
 @login_required(login_url='admin_login')
 def update_order_status(request, order_id):
@@ -2038,12 +1914,7 @@ def update_order_status(request, order_id):
             if new_status == 'cancelled' and old_status != 'cancelled':
                 try:
                     # Restore stock quantities
-                    for order_item in order.orderitems.all():
-                        medicine = order_item.item
-                        medicine.quantity += order_item.quantity
-                        if medicine.stock_quantity is not None:
-                            medicine.stock_quantity += order_item.quantity
-                        medicine.save()
+                    order.stock_quantity_restore(user=request.user)
                     success_message += " - Stock quantities restored"
                 except Exception as e:
                     success_message += f" - Warning: Stock restoration failed: {str(e)}"
@@ -2212,18 +2083,15 @@ def handle_payment_failure(request, order_id):
             order.payment_status = 'cod'
             order.ordered = True
             order.order_status = 'confirmed'
+            if not order.totals_frozen:
+                order.freeze_totals()
             order.save()
             messages.success(request, f'Order #{order.id} converted to Cash on Delivery')
             
         elif action == 'cancel_order':
             # Cancel the order and restore stock
             try:
-                for order_item in order.orderitems.all():
-                    medicine = order_item.item
-                    medicine.quantity += order_item.quantity
-                    if medicine.stock_quantity is not None:
-                        medicine.stock_quantity += order_item.quantity
-                    medicine.save()
+                order.stock_quantity_restore(user=request.user)
                 
                 order.order_status = 'cancelled'
                 order.payment_status = 'cancelled'
@@ -2255,73 +2123,59 @@ def bulk_medicine_management(request):
                 messages.error(request, f"Error deleting: {e}")
             return redirect('bulk-medicine-management')
 
-        # CSV import
+        # CSV / Excel import
         if action == 'import':
             file = request.FILES.get('file')
             if not file:
                 messages.error(request, 'No file uploaded')
                 return redirect('bulk-medicine-management')
 
-            import csv, io
+            from pharmacy.importing import MedicineImportError, import_medicines
             try:
-                decoded = file.read().decode('utf-8')
-                reader = csv.DictReader(io.StringIO(decoded))
-                created = 0
-                for row in reader:
-                    name = (row.get('name') or '').strip()
-                    if not name:
-                        continue
-                    quantity = int(row.get('quantity') or 0)
-                    price = float(row.get('price') or 0)
-                    weight = (row.get('weight') or '').strip()
-                    description = (row.get('description') or '').strip()
-                    composition = (row.get('composition') or '').strip()
-                    hsn_code = (row.get('hsn_code') or '').strip()
-                    medicine_type = (row.get('medicine_type') or '').strip() or None
-                    medicine_category = (row.get('medicine_category') or '').strip() or None
-                    requirement = (row.get('prescription_required') or '').strip() or None
-                    expiry_date = None
-                    exp = (row.get('expiry_date') or '').strip()
-                    if exp:
-                        try:
-                            from datetime import datetime as _dt2
-                            expiry_date = _dt2.strptime(exp, '%Y-%m-%d').date()
-                        except ValueError:
-                            expiry_date = None
-
-                    # Auto-fetch HSN if not provided but composition is available
-                    if composition and not hsn_code:
-                        from pharmacy.hsn_utils import auto_fetch_hsn_code
-                        hsn_result = auto_fetch_hsn_code(name, composition, medicine_category)
-                        if hsn_result['success']:
-                            hsn_code = hsn_result['hsn_code']
-
-                    Medicine.objects.create(
-                        name=name,
-                        weight=weight,
-                        quantity=quantity,
-                        stock_quantity=quantity,
-                        price=price,
-                        description=description,
-                        composition=composition,
-                        hsn_code=hsn_code,
-                        medicine_type=medicine_type,
-                        medicine_category=medicine_category,
-                        Prescription_reqiuired=requirement,
-                        featured_image='medicines/default.png',
-                        medicine_id=f"#M-{str(uuid.uuid4())[:8].upper()}",
-                        expiry_date=expiry_date,
-                    )
-                    created += 1
-                messages.success(request, f"Imported {created} medicines from CSV.")
+                import_report = import_medicines(file, file.name, user=request.user)
+            except MedicineImportError as e:
+                messages.error(request, f"Import failed: {e}")
+                return redirect('bulk-medicine-management')
             except Exception as e:
                 messages.error(request, f"Import failed: {e}")
-            return redirect('bulk-medicine-management')
+                return redirect('bulk-medicine-management')
+
+            messages.success(request, f"Imported {import_report.imported} medicines ({import_report.created} new, {import_report.updated} updated).")
+            if import_report.errors:
+                messages.warning(request, f"{len(import_report.errors)} problems found; see the error report below.")
+            medicines = Medicine.objects.all().order_by('name')
+            return render(request, 'hospital_admin/bulk-medicine.html', {
+                'medicine_list': medicines,
+                'pharmacist': pharmacist,
+                'import_report': import_report,
+                'import_errors': import_report.errors[:500],
+            })
 
     medicines = Medicine.objects.all().order_by('name')
     return render(request, 'hospital_admin/bulk-medicine.html', {'medicine_list': medicines, 'pharmacist': pharmacist})
 
 
+
+@login_required(login_url='admin_login')
+def export_medicines(request):
+    if not (request.user.is_pharmacist or request.user.is_hospital_admin):
+        return redirect('admin-logout')
+
+    from django.http import StreamingHttpResponse
+    from pharmacy import exporting
+    export_format = request.GET.get('format', 'csv')
+    try:
+        filters = exporting.parse_filters(request.GET)
+        stream = exporting.export_medicines(exporting.medicines_for_export(**filters), export_format)
+    except exporting.MedicineExportError as e:
+        messages.error(request, f"Export failed: {e}")
+        return redirect('bulk-medicine-management' if request.user.is_pharmacist else 'admin-dashboard')
+
+    response = StreamingHttpResponse(stream, content_type=exporting.FORMATS[export_format])
+    filename = f"medicines-{timezone.localdate():%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 # Lab Report PDF Upload/Download Views
 @csrf_exempt
 @login_required(login_url='admin_login')
@@ -2466,8 +2320,8 @@ def lab_dashboard(request):
             age=30
         )
     
-    # Get date ranges
-    today = timezone.now().date()
+    # Get date ranges (local days, as updated_at__date compares them)
+    today = timezone.localdate()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
     
@@ -2478,52 +2332,52 @@ def lab_dashboard(request):
         'prescription__doctor', 'assigned_technician'
     ).all()
     
-    # Test status breakdown
-    test_stats = {
-        'total_prescribed': all_tests.count(),
-        'paid_tests': all_tests.filter(test_info_pay_status='paid').count(),
-        'pending_collection': all_tests.filter(test_status__in=['prescribed', 'paid'], test_info_pay_status='paid').count(),
-        'collected': all_tests.filter(test_status='collected').count(),
-        'processing': all_tests.filter(test_status='processing').count(),
-        'completed': all_tests.filter(test_status='completed').count(),
-        'unpaid': all_tests.filter(test_info_pay_status='unpaid').count(),
-    }
-    
-    # My workload
+    # Test status breakdown and my workload, in one conditional aggregate
     my_assigned_tests = all_tests.filter(assigned_technician=lab_worker)
-    completed_today_count = my_assigned_tests.filter(
-        test_status='completed',
-        updated_at__date=today
-    ).count()
-    total_assigned_count = my_assigned_tests.count()
+    mine = Q(assigned_technician=lab_worker)
+    counters = Prescription_test.objects.aggregate(
+        total_prescribed=Count('test_id'),
+        paid_tests=Count('test_id', filter=Q(test_info_pay_status='paid')),
+        pending_collection=Count('test_id', filter=Q(test_status__in=['prescribed', 'paid'], test_info_pay_status='paid')),
+        collected=Count('test_id', filter=Q(test_status='collected')),
+        processing=Count('test_id', filter=Q(test_status='processing')),
+        completed=Count('test_id', filter=Q(test_status='completed')),
+        unpaid=Count('test_id', filter=Q(test_info_pay_status='unpaid')),
+        total_assigned=Count('test_id', filter=mine),
+        pending_work=Count('test_id', filter=mine & Q(test_status__in=['paid', 'collected'])),
+        currently_processing=Count('test_id', filter=mine & Q(test_status='processing')),
+        completed_today=Count('test_id', filter=mine & Q(test_status='completed', updated_at__date=today)),
+        completed_week=Count('test_id', filter=mine & Q(test_status='completed', updated_at__date__gte=week_ago)),
+    )
+    test_stats = {key: counters[key] for key in [
+        'total_prescribed', 'paid_tests', 'pending_collection', 'collected', 'processing', 'completed', 'unpaid',
+    ]}
+    completed_today_count = counters['completed_today']
+    total_assigned_count = counters['total_assigned']
     
     my_workload = {
         'total_assigned': total_assigned_count,
-        'pending_work': my_assigned_tests.filter(test_status__in=['paid', 'collected']).count(),
-        'currently_processing': my_assigned_tests.filter(test_status='processing').count(),
+        'pending_work': counters['pending_work'],
+        'currently_processing': counters['currently_processing'],
         'completed_today': completed_today_count,
-        'completed_week': my_assigned_tests.filter(
-            test_status='completed',
-            updated_at__date__gte=week_ago
-        ).count(),
+        'completed_week': counters['completed_week'],
         'completion_percentage': (completed_today_count / total_assigned_count * 100) if total_assigned_count > 0 else 0,
     }
     
     # === DOCTOR-PATIENT-LAB INTEGRATION ===
     # Recent prescriptions with doctor-patient details
     recent_prescriptions = Prescription.objects.select_related(
-        'doctor', 'patient', 'patient__user'
+        'doctor', 'doctor__specialization', 'patient', 'patient__user'
     ).filter(
         prescription_test__test_info_pay_status='paid'
-    ).distinct().order_by('-create_date')[:10]
+    ).distinct().order_by('-create_date').prefetch_related(Prefetch(
+        'prescription_test_set',
+        queryset=Prescription_test.objects.filter(test_info_pay_status='paid').select_related('assigned_technician'),
+        to_attr='tests',
+    ))[:10]
     
-    # Add test details to each prescription
+    # Add doctor and patient details to each prescription
     for prescription in recent_prescriptions:
-        prescription.tests = Prescription_test.objects.filter(
-            prescription=prescription,
-            test_info_pay_status='paid'
-        ).select_related('assigned_technician')
-        
         # Doctor information
         prescription.doctor_info = {
             'name': prescription.doctor.name,
@@ -2586,14 +2440,8 @@ def lab_dashboard(request):
     
     # === PERFORMANCE METRICS ===
     performance_metrics = {
-        'avg_completion_time': my_assigned_tests.filter(
-            test_status='completed',
-            updated_at__date__gte=week_ago
-        ).count(),  # Simplified for now
-        'daily_throughput': my_assigned_tests.filter(
-            test_status='completed',
-            updated_at__date=today
-        ).count(),
+        'avg_completion_time': counters['completed_week'],  # Simplified for now
+        'daily_throughput': completed_today_count,
         'accuracy_rate': 98.5,  # Placeholder - can be calculated based on QC data
         'patient_satisfaction': 4.7,  # Placeholder - from feedback system
     }
@@ -2626,7 +2474,7 @@ def lab_dashboard(request):
     newly_assigned = my_assigned_tests.filter(
         assigned_technician=lab_worker,
         test_status__in=['paid', 'collected']
-    ).order_by('-updated_at')[:3]
+    ).select_related('prescription__patient__user').order_by('-updated_at')[:3]
     
     for test in newly_assigned:
         # Safe patient name extraction
@@ -2648,9 +2496,20 @@ def lab_dashboard(request):
     
     # === COMPREHENSIVE TEST WORKFLOW DATA ===
     # Get all tests with detailed workflow information (like mypatient_list)
-    workflow_tests = all_tests.select_related(
+    workflow_tests = list(all_tests.select_related(
         'prescription__patient__user', 'prescription__doctor'
-    )[:20]  # Limit to recent 20 tests for dashboard display
+    )[:20])  # Limit to recent 20 tests for dashboard display
+    
+    # Existing reports of those tests in one query, keyed by (patient, test name);
+    # the newest report wins when a patient has several for the same test
+    reports = {}
+    report_patients = {test.prescription.patient_id for test in workflow_tests if test.prescription}
+    report_names = {test.test_name for test in workflow_tests}
+    named = Q(test_name__in=report_names - {None})
+    if None in report_names:
+        named |= Q(test_name__isnull=True)
+    for report in Report.objects.filter(named, patient_id__in=report_patients).order_by('-report_id'):
+        reports.setdefault((report.patient_id, report.test_name), report)
     
     tests_with_workflow = []
     for test in workflow_tests:
@@ -2673,17 +2532,9 @@ def lab_dashboard(request):
             test.doctor_name = test.prescription.doctor.name if test.prescription.doctor else 'Unknown'
             
             # Check if there's an existing report/PDF
-            try:
-                test.report = Report.objects.get(
-                    patient=patient,
-                    test_name=test.test_name
-                )
-                test.has_pdf = bool(getattr(test.report, 'file', None))
-                test.has_report = True
-            except (Report.DoesNotExist, AttributeError):
-                test.report = None
-                test.has_pdf = False
-                test.has_report = False
+            test.report = reports.get((patient.patient_id, test.test_name))
+            test.has_report = test.report is not None
+            test.has_pdf = bool(getattr(test.report, 'file', None))
             
             # Set action buttons availability
             test.can_collect = test.test_status in ['prescribed', 'paid'] and test.test_info_pay_status == 'paid'
@@ -3129,29 +2980,25 @@ def bulk_report_actions(request):
         lab_worker = Clinical_Laboratory_Technician.objects.get(user=request.user)
         
         if action == 'assign_to_me':
-            updated = Report.objects.filter(
-                report_id__in=report_ids,
-                assigned_technician__isnull=True
-            ).update(
+            updated = Report.update_status(
+                Report.objects.filter(report_id__in=report_ids, assigned_technician__isnull=True),
+                'collected',
                 assigned_technician=lab_worker,
-                status='collected'
             )
             messages.success(request, f'{updated} reports assigned to you successfully.')
             
         elif action == 'mark_processing':
-            updated = Report.objects.filter(
-                report_id__in=report_ids,
-                assigned_technician=lab_worker
-            ).update(status='processing')
+            updated = Report.update_status(
+                Report.objects.filter(report_id__in=report_ids, assigned_technician=lab_worker),
+                'processing',
+            )
             messages.success(request, f'{updated} reports marked as processing.')
             
         elif action == 'mark_completed':
-            updated = Report.objects.filter(
-                report_id__in=report_ids,
-                assigned_technician=lab_worker
-            ).update(
-                status='completed',
-                delivery_date=timezone.now()
+            updated = Report.update_status(
+                Report.objects.filter(report_id__in=report_ids, assigned_technician=lab_worker),
+                'completed',
+                delivery_date=timezone.now(),
             )
             messages.success(request, f'{updated} reports marked as completed.')
     
@@ -3641,6 +3488,8 @@ def lab_analytics_dashboard(request):
     if not request.user.is_labworker:
         return redirect('admin-logout')
     
+    from .lab_analytics import get_lab_analytics
+
     lab_worker = Clinical_Laboratory_Technician.objects.get(user=request.user)
     
     # Date ranges for analysis
@@ -3713,23 +3562,16 @@ def lab_analytics_dashboard(request):
         )
     ).order_by('-weekly_completed_tests')[:8]
     
-    # Add completion rate for each technician
+    # Turnaround times and completion trends (cached)
+    analytics = get_lab_analytics()
+    
+    # Add completion rate and median turnaround for each technician
     for tech in technician_performance:
         if tech.weekly_assigned_tests > 0:
             tech.completion_rate = round((tech.weekly_completed_tests / tech.weekly_assigned_tests) * 100, 1)
         else:
             tech.completion_rate = 0
-    
-    # Turnaround time analysis
-    turnaround_stats = {
-        'avg_completion_time': '2.3 hours',
-        'fastest_completion': '45 minutes',
-        'slowest_completion': '6.2 hours',
-        'target_time': '2 hours',
-        'on_time_percentage': 87.5,
-        'same_day_percentage': 94.2,
-        'next_day_percentage': 5.8,
-    }
+        tech.turnaround = analytics['turnaround_by_technician'].get(tech.technician_id)
     
     # Revenue analytics
     try:
@@ -3761,72 +3603,17 @@ def lab_analytics_dashboard(request):
             'monthly_revenue': 0,
         }
     
-    # Quality metrics
-    quality_metrics = {
-        'accuracy_rate': 98.7,
-        'repeat_rate': 1.3,
-        'calibration_compliance': 99.2,
-        'equipment_uptime': 97.8,
-        'patient_satisfaction': 4.6,
-        'error_rate': 0.8,
-        'contamination_rate': 0.2,
-    }
-    
-    # Trend data for charts (last 7 days)
-    daily_trends = []
-    for i in range(7):
-        date = today - timedelta(days=i)
-        daily_count = Prescription_test.objects.filter(
-            updated_at__date=date,
-            test_status='completed'
-        ).count()
-        daily_trends.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'date_display': date.strftime('%b %d'),
-            'completed_tests': daily_count,
-        })
-    daily_trends.reverse()
-    
-    # Monthly trends (last 6 months)
-    monthly_trends = []
-    for i in range(6):
-        month_start = today.replace(day=1) - timedelta(days=30*i)
-        month_end = month_start.replace(day=28) + timedelta(days=4)  # Ensure we get end of month
-        month_end = month_end - timedelta(days=month_end.day)
-        
-        monthly_count = Prescription_test.objects.filter(
-            updated_at__date__gte=month_start,
-            updated_at__date__lte=month_end,
-            test_status='completed'
-        ).count()
-        
-        monthly_trends.append({
-            'month': month_start.strftime('%Y-%m'),
-            'month_display': month_start.strftime('%B %Y'),
-            'completed_tests': monthly_count,
-        })
-    monthly_trends.reverse()
-    
-    # Equipment utilization (mock data)
-    equipment_stats = [
-        {'name': 'Bio-Analyzer 3000', 'utilization': 89.5, 'uptime': 98.2, 'tests_today': 45},
-        {'name': 'Hematology Analyzer', 'utilization': 76.8, 'uptime': 99.1, 'tests_today': 32},
-        {'name': 'Chemistry Analyzer', 'utilization': 82.3, 'uptime': 97.8, 'tests_today': 38},
-        {'name': 'Immunology System', 'utilization': 65.2, 'uptime': 99.5, 'tests_today': 28},
-    ]
-    
     context = {
         'lab_worker': lab_worker,
         'test_analytics': test_analytics,
         'test_type_stats': test_type_stats,
         'department_stats': department_stats,
         'technician_performance': technician_performance,
-        'turnaround_stats': turnaround_stats,
+        'turnaround_stats': analytics['turnaround_stats'],
+        'turnaround_by_test': analytics['turnaround_by_test'],
         'revenue_analytics': revenue_analytics,
-        'quality_metrics': quality_metrics,
-        'daily_trends': daily_trends,
-        'monthly_trends': monthly_trends,
-        'equipment_stats': equipment_stats,
+        'daily_trends': analytics['daily_trends'],
+        'monthly_trends': analytics['monthly_trends'],
         'today': today,
     }
     
@@ -4799,11 +4586,13 @@ def review_prescription_upload(request, upload_id):
         return redirect('pharmacist-order-management')
     
     # GET request - show review form
+    from pharmacy.utils import with_substitutes
     available_medicines = Medicine.objects.filter(quantity__gt=0).order_by('name')
     
     context = {
         'prescription': prescription,
         'pharmacist': pharmacist,
+        'prescription_medicines': with_substitutes(prescription),
         'medicines': available_medicines,
     }
     return render(request, 'hospital_admin/review-prescription-upload.html', context)
@@ -4856,10 +4645,24 @@ def add_medicine_to_prescription(request, upload_id):
             prescription.estimated_cost = total_cost
             prescription.save()
             
+            # Same-ingredient alternatives, e.g. when this one can't cover the quantity
+            from pharmacy.ingredients import find_substitutes
+            substitutes = [
+                {
+                    'id': substitute.serial_number,
+                    'name': substitute.name,
+                    'price': float(substitute.price or 0),
+                    'stock': substitute.quantity or 0,
+                }
+                for substitute in find_substitutes(medicine)
+            ]
+            
             return JsonResponse({
                 'success': True,
                 'message': f'Added {medicine.name} to prescription',
                 'medicine_name': medicine.name,
+                'in_stock': (medicine.quantity or 0) >= quantity,
+                'substitutes': substitutes,
                 'quantity': quantity,
                 'price': float(medicine.price * quantity),
                 'estimated_cost': float(total_cost),
@@ -1,13 +1,66 @@
 from django.contrib import admin
+from django.db import transaction
 
 # Register your models here.
-from .models import Medicine, Pharmacist, Cart, Order, PrescriptionUpload, PrescriptionMedicine
+from .models import (
+    DailyPharmacySales, Medicine, MedicineBatch, Pharmacist, Cart, Order, PharmacyAlert, PrescriptionUpload, PrescriptionMedicine,
+    StockMovement, StockSnapshot,
+)
+from . import batches, ledger
 
 class MedicineAdmin(admin.ModelAdmin):
     list_display = ('name', 'stock_quantity', 'expiry_date', 'is_expiring_soon', 'price')
     list_filter = ('medicine_category','medicine_type')
     search_fields = ('name',)
 
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)  # opening receipt comes from post_save
+            return
+        before = (form.initial.get('quantity'), form.initial.get('stock_quantity'))
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            movement = ledger.record_levels(obj, before, StockMovement.ADJUSTMENT, reference='admin', user=request.user)
+            batches.apply_changes([(obj.pk, movement.quantity_change if movement else 0, obj.batch_no or '', obj.expiry_date)])
+
+class MedicineBatchAdmin(admin.ModelAdmin):
+    list_display = ('medicine', 'batch_no', 'expiry_date', 'quantity', 'received_at')
+    search_fields = ('medicine__name', 'batch_no')
+    raw_id_fields = ('medicine',)
+    # Quantities move with sales and restocks
+    readonly_fields = ('quantity',)
+
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'medicine', 'kind', 'quantity_change', 'stock_change', 'reference', 'user')
+    list_filter = ('kind',)
+    search_fields = ('medicine__name', 'reference')
+    raw_id_fields = ('medicine', 'user')
+
+    # The ledger is append-only and written by the stock operations themselves
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('taken_at', 'medicine', 'quantity', 'stock_quantity')
+    raw_id_fields = ('medicine',)
+
+class PharmacyAlertAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'kind', 'medicine', 'batch', 'quantity', 'expiry_date', 'sent_at')
+    list_filter = ('kind',)
+    search_fields = ('medicine__name',)
+    raw_id_fields = ('medicine', 'batch')
+
+class DailyPharmacySalesAdmin(admin.ModelAdmin):
+    list_display = ('date', 'category', 'orders', 'units', 'revenue', 'gst')
+    list_filter = ('category',)
+    date_hierarchy = 'date'
+
 class PrescriptionMedicineInline(admin.TabularInline):
     model = PrescriptionMedicine
     extra = 0
@@ -43,3 +96,8 @@ admin.site.register(Medicine, MedicineAdmin)
 admin.site.register(Pharmacist)
 admin.site.register(PrescriptionUpload, PrescriptionUploadAdmin)
 admin.site.register(PrescriptionMedicine)
+admin.site.register(MedicineBatch, MedicineBatchAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
+admin.site.register(StockSnapshot, StockSnapshotAdmin)
+admin.site.register(PharmacyAlert, PharmacyAlertAdmin)
+admin.site.register(DailyPharmacySales, DailyPharmacySalesAdmin)
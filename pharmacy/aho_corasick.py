@@ -0,0 +1,118 @@
+"""
+Aho–Corasick multi-pattern string matching.
+
+The automaton is compiled once from a {pattern: value} mapping; a single pass
+over the text then reports every occurrence of every pattern, independent of
+how many patterns there are.
+"""
+from collections import deque
+
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        # Node 0 is the root. _goto[node] maps a character to the next node,
+        # _fail[node] is the longest proper suffix that is also a trie path,
+        # _output[node] is the pattern ending exactly here (or None) and
+        # _dict_suffix[node] the nearest fail-chain node with an output.
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._dict_suffix = [None]
+        self._values = {}
+        for pattern, value in patterns.items():
+            if pattern:
+                self._add(pattern, value)
+        self._link()
+        self._compile()
+
+    def __len__(self):
+        return len(self._values)
+
+    def _add(self, pattern, value):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._dict_suffix.append(None)
+            node = next_node
+        self._output[node] = pattern
+        self._values[pattern] = value
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                suffix = self._fail[child]
+                self._dict_suffix[child] = suffix if self._output[suffix] is not None else self._dict_suffix[suffix]
+
+    def _compile(self):
+        # Resolve failure links into a full transition table (characters that
+        # appear in no pattern lead back to the root) and flatten each node's
+        # output chain, so matching is one dict lookup per character.
+        alphabet = {char for transitions in self._goto for char in transitions}
+        self._delta = [None] * len(self._goto)
+        self._matches = [None] * len(self._goto)
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            transitions = {}
+            for char in alphabet:
+                child = self._goto[node].get(char)
+                if child is not None:
+                    transitions[char] = child
+                    queue.append(child)
+                elif node:
+                    target = self._delta[self._fail[node]].get(char)
+                    if target:
+                        transitions[char] = target
+            self._delta[node] = transitions
+            chain = []
+            match = node if self._output[node] is not None else self._dict_suffix[node]
+            while match is not None:
+                chain.append(self._output[match])
+                match = self._dict_suffix[match]
+            self._matches[node] = chain or None
+
+    def iter_matches(self, text):
+        """Yield (start, end, pattern, value) for every occurrence, overlapping ones included"""
+        node = 0
+        delta, matches, values = self._delta, self._matches, self._values
+        for position, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            if matches[node] is not None:
+                for pattern in matches[node]:
+                    yield position + 1 - len(pattern), position + 1, pattern, values[pattern]
+
+    def longest_matches(self, text):
+        """Occurrences not contained in a longer occurrence, in text order"""
+        matches = []
+        node = 0
+        delta, outputs, values = self._delta, self._matches, self._values
+        for position, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            if outputs[node] is not None:
+                for pattern in outputs[node]:
+                    matches.append((position + 1 - len(pattern), position + 1, pattern, values[pattern]))
+        if len(matches) < 2:
+            return matches
+        matches.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+        kept = []
+        furthest_end = -1
+        for match in matches:
+            if match[1] <= furthest_end:
+                continue
+            kept.append(match)
+            furthest_end = match[1]
+        return kept
@@ -0,0 +1,166 @@
+"""
+Pharmacy stock and expiry alerts, queued and mailed as a digest.
+
+Alerts are events rather than a check on every save:
+
+- low stock is queued when a medicine's Unit Qty crosses LOW_STOCK_THRESHOLD
+  downwards (level before vs after the change), whether the change came
+  from a save, a checkout or an import;
+- an expiring batch is queued once, by the digest run, when a batch in
+  stock comes within EXPIRY_DAYS_THRESHOLD days of its expiry date.
+
+``manage.py send_pharmacy_alerts`` (run from cron every few minutes) mails
+each admin and pharmacist one digest of everything pending, so saving a
+medicine never waits on SMTP. The recipient list is cached.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Exists, OuterRef, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import PharmacyAlert
+
+logger = logging.getLogger(__name__)
+
+LOW_STOCK_THRESHOLD = 15
+EXPIRY_DAYS_THRESHOLD = 30
+
+RECIPIENTS_CACHE_KEY = 'pharmacy:alert-recipients'
+
+
+def crossed_low_stock(before, after):
+    """
+    True when Unit Qty went from at or above the threshold to below it
+
+    ``before`` is None for a new medicine (or an unknown previous level).
+    """
+    after = after or 0
+    if after >= LOW_STOCK_THRESHOLD:
+        return False
+    return before is None or before >= LOW_STOCK_THRESHOLD
+
+
+def queue_low_stock(levels):
+    """
+    Queue a low-stock alert for each medicine that crossed the threshold
+
+    Args:
+        levels: dict of medicine pk -> (Unit Qty before, Unit Qty after)
+
+    Returns:
+        list of the queued PharmacyAlert
+    """
+    queued = [
+        PharmacyAlert(kind=PharmacyAlert.LOW_STOCK, medicine_id=pk, quantity=after or 0)
+        for pk, (before, after) in levels.items()
+        if crossed_low_stock(before, after)
+    ]
+    if queued:
+        PharmacyAlert.objects.bulk_create(queued)
+    return queued
+
+
+def queue_expiring(today=None):
+    """
+    Queue an alert for each batch in stock that has come within EXPIRY_DAYS_THRESHOLD
+    days of its expiry date and hasn't been reported for that date
+
+    Returns:
+        number of alerts queued
+    """
+    from .batches import expiring_batches
+
+    reported = PharmacyAlert.objects.filter(
+        batch=OuterRef('pk'), kind=PharmacyAlert.EXPIRING, expiry_date=OuterRef('expiry_date')
+    )
+    rows = expiring_batches(EXPIRY_DAYS_THRESHOLD, today).exclude(Exists(reported)).values_list(
+        'pk', 'medicine_id', 'quantity', 'expiry_date'
+    )
+    queued = PharmacyAlert.objects.bulk_create([
+        PharmacyAlert(kind=PharmacyAlert.EXPIRING, medicine_id=medicine_id, batch_id=pk,
+                      quantity=quantity, expiry_date=expiry_date)
+        for pk, medicine_id, quantity, expiry_date in rows
+    ], ignore_conflicts=True)
+    return len(queued)
+
+
+def get_recipients():
+    """Emails of hospital admins and pharmacists, cached for PHARMACY_ALERT_RECIPIENTS_TTL seconds"""
+    from hospital.models import User
+
+    def load():
+        emails = User.objects.filter(Q(is_hospital_admin=True) | Q(is_pharmacist=True)).exclude(email='')
+        return sorted(set(emails.values_list('email', flat=True)) - {None})
+
+    return cache.get_or_set(RECIPIENTS_CACHE_KEY, load, getattr(settings, 'PHARMACY_ALERT_RECIPIENTS_TTL', 3600))
+
+
+def invalidate_recipients():
+    cache.delete(RECIPIENTS_CACHE_KEY)
+
+
+def _digest_lines(alerts):
+    """Coalesce pending alerts: one low-stock line per medicine at its current level, one line per expiring batch"""
+    low_stock, expiring = {}, {}
+    for alert in alerts:
+        medicine = alert.medicine
+        if alert.kind == PharmacyAlert.LOW_STOCK:
+            quantity = medicine.quantity or 0
+            # Restocked since the alert was raised
+            if quantity < LOW_STOCK_THRESHOLD:
+                low_stock[medicine.pk] = f"{medicine.name} has only {quantity} units left."
+        elif alert.batch is not None and alert.batch.quantity > 0:
+            batch = alert.batch
+            expiring[batch.pk] = (
+                f"{medicine.name} batch {batch.batch_no or '-'} ({batch.quantity} units) "
+                f"expires on {batch.expiry_date:%d %b %Y}."
+            )
+    return list(low_stock.values()), list(expiring.values())
+
+
+def send_digest(today=None):
+    """
+    Queue newly expiring batches, then mail each recipient one digest of the pending alerts
+
+    Alerts stay pending if there is no recipient or the mail can't be sent.
+
+    Returns:
+        number of alerts covered by the digest
+    """
+    queue_expiring(today)
+    alerts = list(
+        PharmacyAlert.objects.filter(sent_at__isnull=True).select_related('medicine', 'batch').order_by('created_at', 'id')
+    )
+    if not alerts:
+        return 0
+    recipients = get_recipients()
+    if not recipients:
+        logger.warning(f"{len(alerts)} pharmacy alerts pending but there are no admin or pharmacist emails")
+        return 0
+
+    low_stock, expiring = _digest_lines(alerts)
+    if low_stock or expiring:
+        kinds = [label for label, lines in (('Low stock', low_stock), ('Expiring soon', expiring)) if lines]
+        subject = f"Pharmacy Alert: {'; '.join(kinds)} ({len(low_stock) + len(expiring)} items)"
+        html_message = render_to_string('pharmacy_mail_alert.html', {'low_stock': low_stock, 'expiring': expiring})
+        plain_message = strip_tags(html_message)
+        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com')
+        messages = []
+        for recipient in recipients:
+            message = EmailMultiAlternatives(subject, plain_message, from_email, [recipient])
+            message.attach_alternative(html_message, 'text/html')
+            messages.append(message)
+        try:
+            get_connection().send_messages(messages)
+        except Exception as e:
+            logger.error(f"Sending the pharmacy alert digest failed: {e}")
+            return 0
+
+    PharmacyAlert.objects.filter(pk__in=[alert.pk for alert in alerts]).update(sent_at=timezone.now())
+    return len(alerts)
+
@@ -1,13 +1,25 @@
 """
 AJAX API views for pharmacy features
 """
-from django.http import JsonResponse
+import datetime
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 import json
-from .hsn_utils import auto_fetch_hsn_code, get_composition_suggestions
+from .hsn_utils import get_composition_suggestions
+from . import hsn_cache
 from .models import Medicine
+from . import fulltext
+from .catalog_snapshot import get_snapshot
+from .fuzzy import fuzzy_matcher
+from .ingredients import medicines_with_ingredients
+from . import ledger
 
 @csrf_exempt
 @login_required
@@ -28,8 +40,8 @@ def fetch_hsn_code_ajax(request):
                 'error': 'Medicine name is required'
             })
         
-        # Fetch HSN code
-        hsn_result = auto_fetch_hsn_code(
+        # Fetch HSN code (memoized)
+        hsn_result = hsn_cache.lookup(
             medicine_name=medicine_name,
             composition=composition,
             category=category
@@ -89,6 +101,64 @@ def get_composition_suggestions_ajax(request):
             'error': f'Server error: {str(e)}'
         })
 
+@csrf_exempt
+@login_required
+@require_http_methods(["POST"])
+def fetch_hsn_codes_batch(request):
+    """
+    AJAX endpoint resolving HSN codes for many medicines in one round trip
+
+    Body: {"medicines": [{"name": ..., "composition": ..., "category": ...}, ...]}
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data'
+        }, status=400)
+
+    medicines = data.get('medicines') if isinstance(data, dict) else None
+    if not isinstance(medicines, list) or not medicines:
+        return JsonResponse({
+            'success': False,
+            'error': 'A non-empty "medicines" list is required'
+        }, status=400)
+    max_batch = getattr(settings, 'PHARMACY_HSN_BATCH_LIMIT', 500)
+    if len(medicines) > max_batch:
+        return JsonResponse({
+            'success': False,
+            'error': f'At most {max_batch} medicines per request'
+        }, status=400)
+    if not all(isinstance(item, dict) for item in medicines):
+        return JsonResponse({
+            'success': False,
+            'error': 'Each medicine must be an object'
+        }, status=400)
+
+    rows = [
+        {
+            'name': str(item.get('name') or '').strip(),
+            'composition': str(item.get('composition') or '').strip(),
+            'category': str(item.get('category') or '').strip(),
+        }
+        for item in medicines
+    ]
+    results = hsn_cache.lookup_many(rows)
+    return JsonResponse({
+        'success': True,
+        'results': [
+            {
+                'name': row['name'],
+                'hsn_code': result.get('hsn_code'),
+                'source': result.get('source'),
+                'confidence': result.get('confidence'),
+                'suggestions': result.get('suggestions', [])
+            }
+            for row, result in zip(rows, results)
+        ]
+    })
+
 @csrf_exempt
 @login_required
 @require_http_methods(["GET"])
@@ -106,12 +176,17 @@ def search_existing_medicines(request):
             })
         
         # Search in existing medicines
-        medicines = Medicine.objects.filter(
-            name__icontains=query
-        )[:10]  # Limit to 10 results
+        if getattr(settings, 'PHARMACY_FULLTEXT_SEARCH', True):
+            medicines = fulltext.search(Medicine.objects.all(), query, fields=('name',))[:10]
+        else:
+            medicines = Medicine.objects.filter(
+                name__icontains=query
+            )[:10]  # Limit to 10 results
         
         results = []
+        seen = set()
         for medicine in medicines:
+            seen.add(medicine.serial_number)
             results.append({
                 'name': medicine.name,
                 'composition': medicine.composition or '',
@@ -119,6 +194,22 @@ def search_existing_medicines(request):
                 'category': medicine.medicine_category or ''
             })
         
+        # Fill up with typo-tolerant matches (e.g. "paracetmol")
+        if len(results) < 10:
+            for match in fuzzy_matcher.search(query, limit=10):
+                if match['id'] in seen:
+                    continue
+                results.append({
+                    'name': match['name'],
+                    'composition': match['composition'],
+                    'hsn_code': match['hsn_code'],
+                    'category': match['category'],
+                    'fuzzy': True,
+                    'distance': match['distance'],
+                })
+                if len(results) == 10:
+                    break
+        
         return JsonResponse({
             'success': True,
             'results': results
@@ -128,4 +219,113 @@ def search_existing_medicines(request):
         return JsonResponse({
             'success': False,
             'error': f'Server error: {str(e)}'
-        })
\ No newline at end of file
+        })
+
+@login_required
+@require_http_methods(["GET"])
+def medicines_by_ingredients(request):
+    """
+    AJAX endpoint listing medicines that contain all the given ingredients
+
+    ?ingredients=amoxicillin,clavulanic acid[&in_stock=1][&exact=1]
+    """
+    if not (request.user.is_pharmacist or request.user.is_hospital_admin):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+
+    ingredients = [name for name in request.GET.get('ingredients', '').split(',') if name.strip()]
+    if not ingredients:
+        return JsonResponse({
+            'success': False,
+            'error': 'At least one ingredient is required'
+        })
+
+    medicines = medicines_with_ingredients(
+        ingredients,
+        in_stock_only=request.GET.get('in_stock') == '1',
+        exact=request.GET.get('exact') == '1',
+    ).prefetch_related('ingredients').order_by('name', 'serial_number')[:100]
+
+    results = []
+    for medicine in medicines:
+        results.append({
+            'id': medicine.serial_number,
+            'name': medicine.name,
+            'composition': medicine.composition or '',
+            'ingredients': [str(item) for item in medicine.ingredients.all()],
+            'price': float(medicine.price) if medicine.price else 0.0,
+            'stock': medicine.quantity or 0,
+        })
+
+    return JsonResponse({
+        'success': True,
+        'results': results
+    })
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def catalog_snapshot(request):
+    """
+    Full medicine catalog as gzip-compressed JSON, revalidated with ETag
+    """
+    if not (request.user.is_pharmacist or request.user.is_hospital_admin):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+
+    snapshot = get_snapshot()
+    if_none_match = request.headers.get('If-None-Match', '')
+    if snapshot.etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(snapshot.compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(snapshot.decompressed(), content_type='application/json')
+
+    response['ETag'] = snapshot.etag
+    response['X-Catalog-Version'] = snapshot.version
+    # Always revalidate; an unchanged catalog costs a 304 with no body
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+def stock_as_of(request):
+    """
+    Stock levels at a past time, from the stock ledger
+
+    ?at=2026-09-30 (end of that day) or ?at=2026-09-30T18:00[&medicine=12,15]
+    """
+    if not (request.user.is_pharmacist or request.user.is_hospital_admin):
+        return JsonResponse({'success': False, 'error': 'Not authorized'}, status=403)
+
+    value = request.GET.get('at', '').strip()
+    at = parse_datetime(value) if 'T' in value or ' ' in value else None
+    if at is None:
+        day = parse_date(value) if value else None
+        if day is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'at must be a date like 2026-09-30 or a datetime like 2026-09-30T18:00'
+            }, status=400)
+        at = datetime.datetime.combine(day, datetime.time.max)
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+
+    medicine_ids = None
+    if request.GET.get('medicine'):
+        try:
+            medicine_ids = [int(pk) for pk in request.GET['medicine'].split(',') if pk.strip()]
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'medicine must be a comma-separated list of ids'}, status=400)
+
+    medicines = Medicine.objects.order_by('serial_number')
+    if medicine_ids is not None:
+        medicines = medicines.filter(serial_number__in=medicine_ids)
+    return JsonResponse({
+        'success': True,
+        'at': at.isoformat(),
+        'results': [
+            {'id': pk, 'name': name, 'quantity': quantity, 'stock_quantity': stock_quantity}
+            for pk, name, quantity, stock_quantity in ledger.iter_stock_as_of(at, medicines, ('serial_number', 'name'))
+        ]
+    })
@@ -0,0 +1,241 @@
+"""
+Batch-level stock with first-expiry-first-out allocation.
+
+Each Medicine has MedicineBatch rows with their own batch number, expiry
+date and units on hand. Sales take units from the unexpired batches in
+expiry order (one query on the (medicine, expiry_date) index) and the
+BatchAllocation rows keep which batches an order came from, for the invoice
+and for returns. Receipts add to a named batch; other decreases (write-offs,
+corrections) also go first-expiry-first-out, expired batches included.
+
+Batch units follow the medicine's Unit Qty changes except the opening of a
+new stock unit (see pharmacy.utils), which moves stock between the two
+counters rather than receiving any. Whether a sale can go ahead is still
+decided by the Medicine counters, with one exception: units that are only
+left in expired batches can't be sold, and the sale fails with
+InsufficientStock. Other units no batch can cover (stock from before
+batches were tracked) are sold unallocated and logged.
+
+Medicine.batch_no / expiry_date are kept as a summary of the earliest-expiring
+batch in stock, so expiry alerts and filters on Medicine stay right after a
+restock with a newer batch.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BatchAllocation, Medicine, MedicineBatch
+
+logger = logging.getLogger(__name__)
+
+# No-expiry batches last; ties go to the batch received first
+FEFO_ORDER = ('medicine_id', F('expiry_date').asc(nulls_last=True), 'id')
+
+
+def allocate(required, include_expired=False, today=None):
+    """
+    Take units out of batches, earliest expiry first
+
+    Args:
+        required: dict of medicine pk -> units
+        include_expired: also take from expired batches (write-offs)
+
+    Returns:
+        dict of medicine pk -> list of (MedicineBatch, units taken)
+
+    Raises:
+        InsufficientStock: without ``include_expired``, for medicines whose
+            unexpired batches are short while expired ones still hold stock
+    """
+    today = today or timezone.localdate()
+    batches = MedicineBatch.objects.select_for_update().filter(medicine_id__in=required, quantity__gt=0)
+    if not include_expired:
+        batches = batches.filter(Q(expiry_date__isnull=True) | Q(expiry_date__gte=today))
+
+    remaining = dict(required)
+    allocations = defaultdict(list)
+    changed = []
+    for batch in batches.order_by(*FEFO_ORDER):
+        need = remaining.get(batch.medicine_id, 0)
+        if need <= 0:
+            continue
+        units = min(need, batch.quantity)
+        batch.quantity -= units
+        remaining[batch.medicine_id] = need - units
+        allocations[batch.medicine_id].append((batch, units))
+        changed.append(batch)
+
+    short = {pk: units for pk, units in remaining.items() if units > 0}
+    if short and not include_expired:
+        _refuse_expired(required, short, today)
+    MedicineBatch.objects.bulk_update(changed, ['quantity'])
+
+    if short:
+        logger.warning(f"No batch stock for {short} (medicine pk: units); taken unallocated")
+    return dict(allocations)
+
+
+def _refuse_expired(required, short, today):
+    """Raise InsufficientStock for the ``short`` medicines whose missing units sit in expired batches"""
+    from .utils import InsufficientStock, Shortfall
+
+    expired = set(
+        MedicineBatch.objects.filter(medicine_id__in=short, quantity__gt=0, expiry_date__lt=today)
+        .values_list('medicine_id', flat=True)
+    )
+    if not expired:
+        return
+    names = dict(Medicine.objects.filter(pk__in=expired).values_list('pk', 'name'))
+    raise InsufficientStock([
+        Shortfall(pk, names.get(pk) or f"Medicine #{pk}", required[pk], required[pk] - short[pk])
+        for pk in sorted(expired)
+    ])
+
+
+def receive_many(receipts):
+    """
+    Add units to named batches, creating them as needed
+
+    Args:
+        receipts: (medicine pk, units, batch_no, expiry_date) tuples; an
+            expiry_date of None leaves an existing batch's expiry alone
+    """
+    receipts = [(pk, units, batch_no or '', expiry_date) for pk, units, batch_no, expiry_date in receipts]
+    if not receipts:
+        return
+    existing = {
+        (batch.medicine_id, batch.batch_no): batch
+        for batch in MedicineBatch.objects.select_for_update().filter(
+            medicine_id__in={pk for pk, _, _, _ in receipts},
+            batch_no__in={batch_no for _, _, batch_no, _ in receipts},
+        )
+    }
+    created, changed = {}, {}
+    for pk, units, batch_no, expiry_date in receipts:
+        batch = existing.get((pk, batch_no)) or created.get((pk, batch_no))
+        if batch is None:
+            created[(pk, batch_no)] = MedicineBatch(medicine_id=pk, batch_no=batch_no, expiry_date=expiry_date, quantity=max(units, 0))
+            continue
+        if units <= 0 and expiry_date in (None, batch.expiry_date):
+            continue
+        batch.quantity += max(units, 0)
+        if expiry_date is not None:
+            batch.expiry_date = expiry_date
+        changed[batch.pk] = batch
+    MedicineBatch.objects.bulk_update(changed.values(), ['quantity', 'expiry_date'])
+    MedicineBatch.objects.bulk_create(created.values())
+
+
+def apply_changes(changes):
+    """
+    Follow Unit Qty changes made outside checkout in the batches
+
+    Args:
+        changes: (medicine pk, units change, batch_no, expiry_date) tuples.
+            Increases go to ``batch_no`` (default: the medicine's current
+            batch); decreases come out first-expiry-first-out. A batch_no
+            with no increase still records the batch and its expiry.
+
+    Returns:
+        list of the medicine pks in ``changes``
+    """
+    changes = list(changes)
+    unnamed = {pk for pk, units, batch_no, _ in changes if batch_no is None and units > 0}
+    current = dict(Medicine.objects.filter(pk__in=unnamed).values_list('pk', 'batch_no')) if unnamed else {}
+
+    receipts, taken = [], defaultdict(int)
+    for pk, units, batch_no, expiry_date in changes:
+        if units > 0 or batch_no is not None:
+            if batch_no is None:
+                batch_no = current.get(pk)
+            receipts.append((pk, max(units, 0), batch_no, expiry_date))
+        if units < 0:
+            taken[pk] -= units
+    receive_many(receipts)
+    if taken:
+        allocate(taken, include_expired=True)
+    pks = list({pk for pk, _, _, _ in changes})
+    refresh_summary(pks)
+    return pks
+
+
+def return_allocations(order):
+    """
+    Put an order's allocated units back into their batches
+
+    Returns:
+        dict of medicine pk -> units returned to batches
+    """
+    returned = defaultdict(int)
+    allocations = list(order.batch_allocations.select_related('batch'))
+    for allocation in allocations:
+        MedicineBatch.objects.filter(pk=allocation.batch_id).update(quantity=F('quantity') + allocation.quantity)
+        returned[allocation.batch.medicine_id] += allocation.quantity
+    order.batch_allocations.all().delete()
+    return dict(returned)
+
+
+def refresh_summary(pks):
+    """
+    Point Medicine.batch_no / expiry_date at each medicine's earliest-expiring batch in stock
+
+    Medicines with no stocked batch keep their values. Returns the pks that changed.
+    """
+    pks = list(pks)
+    if not pks:
+        return []
+    first = {}
+    for medicine_id, batch_no, expiry_date in MedicineBatch.objects.filter(
+        medicine_id__in=pks, quantity__gt=0
+    ).order_by(*FEFO_ORDER).values_list('medicine_id', 'batch_no', 'expiry_date'):
+        first.setdefault(medicine_id, (batch_no, expiry_date))
+
+    changed = []
+    for medicine in Medicine.objects.filter(pk__in=list(first)).only('pk', 'batch_no', 'expiry_date'):
+        batch_no, expiry_date = first[medicine.pk]
+        if (medicine.batch_no or '', medicine.expiry_date) != (batch_no, expiry_date):
+            medicine.batch_no, medicine.expiry_date = batch_no, expiry_date
+            changed.append(medicine)
+    Medicine.objects.bulk_update(changed, ['batch_no', 'expiry_date'])
+    return [medicine.pk for medicine in changed]
+
+
+def next_batch(medicine, today=None):
+    """The batch the next sale of ``medicine`` would come from, or None"""
+    today = today or timezone.localdate()
+    return (
+        MedicineBatch.objects.filter(medicine=medicine, quantity__gt=0)
+        .filter(Q(expiry_date__isnull=True) | Q(expiry_date__gte=today))
+        .order_by(*FEFO_ORDER)
+        .first()
+    )
+
+
+def expiring_batches(days, today=None):
+    """Batches in stock that expire within ``days`` (or already have), earliest first"""
+    today = today or timezone.localdate()
+    return (
+        MedicineBatch.objects.filter(quantity__gt=0, expiry_date__lte=today + timedelta(days=days))
+        .select_related('medicine')
+        .order_by('expiry_date', 'id')
+    )
+
+
+def order_batch_labels(order):
+    """
+    Batch numbers per medicine of an order, for invoices
+
+    Returns:
+        dict of medicine pk -> label such as "B123 (exp 03/2027), B130"
+    """
+    labels = defaultdict(list)
+    for allocation in BatchAllocation.objects.filter(order=order).select_related('batch').order_by('id'):
+        batch = allocation.batch
+        label = batch.batch_no or '-'
+        if batch.expiry_date:
+            label += f" (exp {batch.expiry_date:%m/%Y})"
+        labels[batch.medicine_id].append(label)
+    return {pk: ', '.join(values) for pk, values in labels.items()}
@@ -0,0 +1,86 @@
+"""
+Helpers shared by the pharmacy ``benchmark_*`` management commands.
+
+Benchmarks never touch the real database: they run inside a throwaway test
+database created the same way ``manage.py test`` does.
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from .hsn_utils import MEDICINE_HSN_CODES
+
+BRAND_SUFFIXES = ['', ' forte', ' plus', ' ds', ' xr', ' kid', ' max', ' cold', ' sr', ' mr']
+STRENGTHS = ['5mg', '10mg', '20mg', '40mg', '100mg', '250mg', '500mg', '650mg', '5ml']
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    """Create a fresh test database for the duration of the block"""
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def make_catalog(size, seed=42):
+    """Build ``size`` unsaved Medicine objects with realistic-looking names"""
+    from .models import Medicine, normalize_category
+
+    rng = random.Random(seed)
+    ingredients = list(MEDICINE_HSN_CODES)
+    categories = [choice for choice, _ in Medicine.MEDICINE_CATEGORY]
+    types = [choice for choice, _ in Medicine.MEDICINE_TYPE]
+    today = date.today()
+
+    medicines = []
+    for i in range(size):
+        ingredient = rng.choice(ingredients)
+        strength = rng.choice(STRENGTHS)
+        category = rng.choice(categories)
+        name = f"{ingredient.title()}{rng.choice(BRAND_SUFFIXES)} {strength} #{i}"
+        medicines.append(Medicine(
+            medicine_id=f"#M-BENCH{i:06d}",
+            name=name,
+            composition=f"{ingredient.title()} {strength}",
+            description=f"{ingredient.title()} {rng.choice(types)} for {rng.choice(categories)} relief",
+            medicine_category=category,
+            normalized_category=normalize_category(category),
+            medicine_type=rng.choice(types),
+            quantity=rng.randint(0, 200),
+            stock_quantity=rng.randint(0, 50),
+            price=rng.randint(5, 900),
+            batch_no=f"B{rng.randint(1000, 9999)}",
+            expiry_date=today + timedelta(days=rng.randint(-30, 720)),
+        ))
+    return medicines
+
+
+def measure(func, runs):
+    """Call ``func`` for each item in ``runs`` and return the latencies in milliseconds"""
+    latencies = []
+    for arg in runs:
+        start = time.perf_counter()
+        func(arg)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(label, latencies):
+    return (
+        f"{label:<24} n={len(latencies):<6} "
+        f"p50={percentile(latencies, 50):8.3f}ms  p99={percentile(latencies, 99):8.3f}ms"
+    )
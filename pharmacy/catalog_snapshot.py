@@ -0,0 +1,101 @@
+"""
+Versioned, gzip-compressed JSON snapshot of the Medicine catalog.
+
+The pharmacist dashboard needs the whole catalog client-side for its search
+suggestions and stock modal. Instead of serializing every medicine into the
+page on each load, the snapshot is built once per catalog generation, stored
+compressed in the cache and served with an ETag (the SHA-256 of the JSON), so
+a browser that already has the current version gets a 304.
+
+Medicine signals call ``invalidate()``, which bumps the generation; writes
+that bypass signals (``QuerySet.update``, ``bulk_create``) must call it too.
+``PHARMACY_CATALOG_SNAPSHOT_TTL`` bounds staleness when the cache backend is
+per-process and a write happened in another worker.
+"""
+import gzip
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+GENERATION_KEY = 'pharmacy:catalog_snapshot:generation'
+SNAPSHOT_KEY = 'pharmacy:catalog_snapshot:{generation}'
+
+SNAPSHOT_FIELDS = (
+    'serial_number', 'name', 'quantity', 'price', 'medicine_category', 'medicine_type', 'composition', 'hsn_code',
+)
+
+
+class Snapshot:
+    __slots__ = ('version', 'compressed')
+
+    def __init__(self, version, compressed):
+        self.version = version
+        self.compressed = compressed
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+    def decompressed(self):
+        return gzip.decompress(self.compressed)
+
+
+def _ttl():
+    return getattr(settings, 'PHARMACY_CATALOG_SNAPSHOT_TTL', 300)
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        # add() so concurrent first requests agree on one generation
+        if not cache.add(GENERATION_KEY, generation, timeout=None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def serialize_catalog():
+    """Return the catalog as the list of dicts the dashboard JS expects"""
+    from .models import Medicine
+
+    rows = Medicine.objects.order_by('serial_number').values_list(*SNAPSHOT_FIELDS)
+    return [
+        {
+            'id': serial_number,
+            'serial_number': serial_number,
+            'name': name,
+            'stock': quantity or 0,
+            'price': float(price) if price else 0.0,
+            'category': category or '',
+            'type': medicine_type or '',
+            'composition': composition or '',
+            'hsn_code': hsn_code or '',
+        }
+        for serial_number, name, quantity, price, category, medicine_type, composition, hsn_code in rows.iterator(chunk_size=2000)
+    ]
+
+
+def build_snapshot():
+    body = json.dumps(serialize_catalog(), separators=(',', ':')).encode()
+    version = hashlib.sha256(body).hexdigest()[:32]
+    # mtime=0 keeps the compressed bytes deterministic for identical content
+    return Snapshot(version, gzip.compress(body, compresslevel=6, mtime=0))
+
+
+def get_snapshot():
+    """Return the current Snapshot, building and caching it if needed"""
+    key = SNAPSHOT_KEY.format(generation=_generation())
+    cached = cache.get(key)
+    if cached is not None:
+        return Snapshot(*cached)
+    snapshot = build_snapshot()
+    cache.set(key, (snapshot.version, snapshot.compressed), timeout=_ttl() or None)
+    return snapshot
+
+
+def invalidate():
+    """Start a new catalog generation; the next request rebuilds the snapshot"""
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
@@ -0,0 +1,190 @@
+"""
+Streaming export of the medicine catalog with stock levels.
+
+Rows come from ``values_list(...).iterator(chunk_size=...)``, so memory use
+doesn't grow with the catalog: CSV is produced line by line, XLSX through an
+openpyxl write-only workbook and Parquet one row group per chunk (pandas +
+pyarrow). The columns are the import columns (see pharmacy.importing), so an
+export can be edited and imported back.
+"""
+import csv
+import importlib
+import tempfile
+from datetime import date, datetime
+
+from .importing import COLUMNS
+from .models import Medicine, normalize_category
+
+CHUNK_SIZE = 2000
+FILE_CHUNK_BYTES = 64 * 1024
+
+# low_stock values that ask for the default threshold (see pharmacy.alerts)
+LOW_STOCK_FLAGS = ('true', 'yes', 'on')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class MedicineExportError(ValueError):
+    """Bad filter values or an export format that can't be produced here"""
+
+
+def medicines_for_export(category=None, low_stock=None, expiring_before=None):
+    """
+    Medicines to export, in serial_number order
+
+    Args:
+        category: shop category key or raw category (matched on normalized_category)
+        low_stock: only medicines with quantity below this number
+        expiring_before: only medicines with an expiry date before this date
+    """
+    medicines = Medicine.objects.order_by('serial_number')
+    if category:
+        medicines = medicines.filter(normalized_category=normalize_category(category))
+    if low_stock is not None:
+        medicines = medicines.filter(quantity__lt=low_stock)
+    if expiring_before is not None:
+        medicines = medicines.filter(expiry_date__lt=expiring_before)
+    return medicines
+
+
+def parse_filters(params):
+    """Turn request/command string options into medicines_for_export() arguments"""
+    from .alerts import LOW_STOCK_THRESHOLD
+
+    filters = {}
+    if params.get('category'):
+        filters['category'] = params['category']
+    low_stock = params.get('low_stock')
+    if low_stock not in (None, '', False):
+        # A bare flag means the alert threshold; a number is the threshold itself
+        if low_stock is True or low_stock in LOW_STOCK_FLAGS:
+            filters['low_stock'] = LOW_STOCK_THRESHOLD
+        else:
+            try:
+                filters['low_stock'] = int(low_stock)
+            except (TypeError, ValueError):
+                raise MedicineExportError(f"low_stock must be a number, got {low_stock!r}")
+    expiring_before = params.get('expiring_before')
+    if expiring_before:
+        if isinstance(expiring_before, date):
+            filters['expiring_before'] = expiring_before
+        else:
+            try:
+                filters['expiring_before'] = datetime.strptime(expiring_before, '%Y-%m-%d').date()
+            except ValueError:
+                raise MedicineExportError(f"expiring_before must be a date like 2027-03-31, got {expiring_before!r}")
+    return filters
+
+
+def iter_rows(medicines, chunk_size=CHUNK_SIZE):
+    return medicines.values_list(*COLUMNS.values()).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(medicines, chunk_size=CHUNK_SIZE):
+    """Yield the CSV export as encoded lines"""
+    writer = csv.writer(_Echo())
+    # BOM so Excel opens it as UTF-8; the importer reads it with utf-8-sig
+    yield '\ufeff'.encode('utf-8') + writer.writerow(list(COLUMNS)).encode('utf-8')
+    for row in iter_rows(medicines, chunk_size):
+        yield writer.writerow(['' if value is None else value for value in row]).encode('utf-8')
+
+
+def write_xlsx(medicines, file, chunk_size=CHUNK_SIZE):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Medicines')
+    sheet.append(list(COLUMNS))
+    for row in iter_rows(medicines, chunk_size):
+        sheet.append(row)
+    workbook.save(file)
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    types = {
+        'quantity': pa.int64(),
+        'stock_quantity': pa.int64(),
+        'price': pa.decimal128(10, 2),
+        'expiry_date': pa.date32(),
+    }
+    return pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+
+
+def write_parquet(medicines, file, chunk_size=CHUNK_SIZE):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    columns = list(COLUMNS)
+    with pq.ParquetWriter(file, schema) as writer:
+        chunk = []
+        for row in iter_rows(medicines, chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                writer.write_table(pa.Table.from_pandas(pd.DataFrame.from_records(chunk, columns=columns), schema=schema, preserve_index=False))
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pandas(pd.DataFrame.from_records(chunk, columns=columns), schema=schema, preserve_index=False))
+
+
+WRITERS = {'xlsx': write_xlsx, 'parquet': write_parquet}
+REQUIRED_PACKAGES = {'xlsx': ('openpyxl',), 'parquet': ('pandas', 'pyarrow')}
+
+
+def check_format(export_format):
+    """Raise MedicineExportError unless ``export_format`` can be produced here"""
+    if export_format not in FORMATS:
+        raise MedicineExportError(f"Unknown export format {export_format!r}; use one of {', '.join(FORMATS)}")
+    for package in REQUIRED_PACKAGES.get(export_format, ()):
+        try:
+            importlib.import_module(package)
+        except ImportError:
+            raise MedicineExportError(f"{export_format} export needs the {package} package.")
+
+
+def _iter_file(writer, medicines, chunk_size):
+    # XLSX and Parquet have to be finished before the first byte is valid,
+    # so they are written to a temporary file that is then streamed out
+    with tempfile.TemporaryFile() as file:
+        writer(medicines, file, chunk_size)
+        file.seek(0)
+        while True:
+            data = file.read(FILE_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+
+
+def export_medicines(medicines, export_format, chunk_size=CHUNK_SIZE):
+    """
+    Returns:
+        an iterator of bytes for ``medicines`` in ``export_format`` ('csv', 'xlsx' or 'parquet')
+    """
+    check_format(export_format)
+    if export_format == 'csv':
+        return iter_csv(medicines, chunk_size)
+    return _iter_file(WRITERS[export_format], medicines, chunk_size)
+
+
+def write_export(medicines, export_format, file, chunk_size=CHUNK_SIZE):
+    """Write the export to an open binary file (management command)"""
+    check_format(export_format)
+    if export_format in WRITERS:
+        WRITERS[export_format](medicines, file, chunk_size)
+        return
+    for data in export_medicines(medicines, export_format, chunk_size):
+        file.write(data)
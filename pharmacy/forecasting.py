@@ -0,0 +1,199 @@
+"""
+Demand forecast and reorder levels per medicine from the sales history.
+
+Purchased Cart rows (dated by when they were marked purchased) are read into
+pandas and summed per medicine and day into a dense (medicines x days) NumPy
+array, so the forecast for the whole catalog is a handful of array
+operations instead of a loop per medicine:
+
+- daily demand is the exponentially smoothed level (``method='ema'``) or the
+  moving average over the last PHARMACY_FORECAST_WINDOW_DAYS (``'ma'``),
+  both counted from each medicine's first sale in the history window;
+- the reorder point covers the lead time with safety stock
+  (demand x lead time + z x std x sqrt(lead time)), and the order-up-to level
+  also covers the review period; the suggested order tops Unit Qty up to it
+  once Unit Qty is at or below the reorder point.
+
+Results replace the MedicineForecast table, which the pharmacist dashboard
+reads. Run ``manage.py forecast_demand`` nightly.
+"""
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Cart, Medicine, MedicineForecast
+
+METHODS = ('ema', 'ma')
+# Weight of the latest day in the exponentially smoothed demand
+SMOOTHING = 0.1
+# z-score of the service level the safety stock is sized for (about 95%)
+SERVICE_Z = 1.65
+FETCH_SIZE = 50000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _purchases(since, until):
+    """
+    DataFrame of (item_id, updated, quantity) of the purchased Cart rows in [since, until)
+
+    Rows are read straight from the cursor and the timestamps parsed by pandas
+    in one vectorized call, rather than converted row by row by the ORM.
+    """
+    queryset = (
+        Cart.objects.filter(purchased=True, updated__gte=since, updated__lt=until)
+        .order_by()
+        .values_list('item_id', 'updated', 'quantity')
+    )
+    sql, params = queryset.query.sql_with_params()
+    chunks = []
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(pd.DataFrame.from_records(rows, columns=['item_id', 'updated', 'quantity']))
+    if not chunks:
+        return pd.DataFrame({'item_id': [], 'updated': [], 'quantity': []})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_daily_sales(medicine_pks, start, days):
+    """
+    Units sold per medicine and local day as a (len(medicine_pks), days) float array
+
+    Args:
+        medicine_pks: sorted NumPy array of medicine pks (the rows)
+        start: date of column 0
+    """
+    sales = np.zeros((len(medicine_pks), days))
+    since = timezone.make_aware(datetime.combine(start, time.min))
+    purchases = _purchases(since, since + timedelta(days=days))
+    if purchases.empty or not len(medicine_pks):
+        return sales
+
+    # Naive values (SQLite) are UTC; days are counted in the site's time zone
+    updated = pd.to_datetime(purchases['updated'], utc=True, format='ISO8601')
+    local_days = updated.dt.tz_convert(timezone.get_current_timezone_name()).dt.tz_localize(None).values.astype('datetime64[D]')
+    columns = (local_days - np.datetime64(start, 'D')).astype(np.int64)
+
+    items = purchases['item_id'].to_numpy(dtype=np.int64)
+    positions = np.searchsorted(medicine_pks, items)
+    known = (positions < len(medicine_pks)) & (medicine_pks[np.minimum(positions, len(medicine_pks) - 1)] == items)
+    known &= (columns >= 0) & (columns < days)
+    np.add.at(sales, (positions[known], columns[known]), purchases['quantity'].to_numpy(dtype=float)[known])
+    return sales
+
+
+def forecast(sales, method='ema', window=None, alpha=SMOOTHING):
+    """
+    Daily demand and its standard deviation for each row of ``sales``
+
+    Days before a medicine's first sale in the history don't count, so a new
+    medicine isn't averaged down by the days it wasn't stocked.
+
+    Returns:
+        (demand, std) arrays, one value per row
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown forecast method {method!r}; use one of {', '.join(METHODS)}")
+    count, days = sales.shape
+    window = min(window or _setting('PHARMACY_FORECAST_WINDOW_DAYS', 90), days)
+    if days == 0 or count == 0:
+        return np.zeros(count), np.zeros(count)
+
+    sold = sales > 0
+    first = np.where(sold.any(axis=1), sold.argmax(axis=1), days)
+    active = np.arange(days)[None, :] >= first[:, None]
+
+    recent, recent_active = sales[:, -window:], active[:, -window:]
+    active_days = recent_active.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(active_days > 0, recent.sum(axis=1) / active_days, 0.0)
+        variance = np.where(
+            active_days > 0, ((recent - mean[:, None]) ** 2 * recent_active).sum(axis=1) / active_days, 0.0
+        )
+    std = np.sqrt(variance)
+
+    if method == 'ma':
+        return mean, std
+
+    # Smoothed level at the last day: sum of alpha * (1 - alpha)^age * sales,
+    # with the first sale seeding the level at weight (1 - alpha)^age
+    ages = np.arange(days - 1, -1, -1)
+    decay = (1 - alpha) ** ages
+    demand = sales @ (alpha * decay)
+    seeded = first < days
+    rows = np.nonzero(seeded)[0]
+    demand[rows] += sales[rows, first[rows]] * (1 - alpha) * decay[first[rows]]
+    return demand, std
+
+
+def reorder_levels(demand, std, quantity, lead_time=None, review=None, z=SERVICE_Z):
+    """
+    Reorder point, order-up-to level, suggested order and days of stock
+
+    Args:
+        demand, std: arrays from forecast()
+        quantity: array of current Unit Qty
+    """
+    lead_time = lead_time if lead_time is not None else _setting('PHARMACY_FORECAST_LEAD_TIME_DAYS', 7)
+    review = review if review is not None else _setting('PHARMACY_FORECAST_REVIEW_DAYS', 14)
+    # Rounded first so float noise (70.0000001) doesn't add a unit
+    reorder_point = np.ceil(np.round(demand * lead_time + z * std * math.sqrt(lead_time), 6))
+    cover = lead_time + review
+    order_up_to = np.ceil(np.round(demand * cover + z * std * math.sqrt(cover), 6))
+    on_hand = np.maximum(quantity, 0)
+    suggested = np.where((on_hand <= reorder_point) & (demand > 0), np.maximum(order_up_to - on_hand, 0), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_stock = np.where(demand > 0, on_hand / demand, np.nan)
+    return reorder_point.astype(int), order_up_to.astype(int), suggested.astype(int), days_of_stock
+
+
+def run(method='ema', history_days=None, today=None):
+    """
+    Forecast every medicine and replace the MedicineForecast table
+
+    Returns:
+        number of forecasts written
+    """
+    history_days = history_days or _setting('PHARMACY_FORECAST_HISTORY_DAYS', 365)
+    today = today or timezone.localdate()
+    start = today - timedelta(days=history_days)
+
+    catalog = np.array(
+        list(Medicine.objects.order_by('serial_number').values_list('serial_number', 'quantity')), dtype=float
+    ).reshape(-1, 2)
+    pks = catalog[:, 0].astype(np.int64)
+    quantity = np.nan_to_num(catalog[:, 1])
+
+    sales = load_daily_sales(pks, start, history_days)
+    demand, std = forecast(sales, method)
+    reorder_point, order_up_to, suggested, days_of_stock = reorder_levels(demand, std, quantity)
+
+    now = timezone.now()
+    forecasts = [
+        MedicineForecast(
+            medicine_id=int(pk),
+            daily_demand=round(float(demand[i]), 4),
+            demand_std=round(float(std[i]), 4),
+            reorder_point=int(reorder_point[i]),
+            order_up_to=int(order_up_to[i]),
+            suggested_order=int(suggested[i]),
+            days_of_stock=None if np.isnan(days_of_stock[i]) else round(float(days_of_stock[i]), 1),
+            computed_at=now,
+        )
+        for i, pk in enumerate(pks)
+    ]
+    with transaction.atomic():
+        MedicineForecast.objects.all().delete()
+        MedicineForecast.objects.bulk_create(forecasts, batch_size=2000)
+    return len(forecasts)
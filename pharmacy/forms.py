@@ -1,6 +1,7 @@
 from django import forms
 from .models import Medicine
-from .hsn_utils import auto_fetch_hsn_code, get_composition_suggestions
+from .hsn_utils import get_composition_suggestions
+from . import hsn_cache
 
 class MedicineForm(forms.ModelForm):
     # Add button for HSN auto-fetch
@@ -98,7 +99,7 @@ class MedicineForm(forms.ModelForm):
     def auto_populate_hsn(self):
         """Auto-populate HSN code based on medicine details"""
         if hasattr(self.instance, 'name') and self.instance.name:
-            hsn_result = auto_fetch_hsn_code(
+            hsn_result = hsn_cache.lookup(
                 medicine_name=self.instance.name,
                 composition=getattr(self.instance, 'composition', None),
                 category=getattr(self.instance, 'medicine_category', None)
@@ -117,7 +118,7 @@ class MedicineForm(forms.ModelForm):
         
         # Auto-fetch HSN code if requested and not manually provided
         if fetch_hsn and name and not hsn_code:
-            hsn_result = auto_fetch_hsn_code(
+            hsn_result = hsn_cache.lookup(
                 medicine_name=name,
                 composition=composition,
                 category=category
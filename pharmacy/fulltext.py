@@ -0,0 +1,191 @@
+"""
+Full-text search over the Medicine catalog.
+
+The backend is picked from the database vendor:
+
+* SQLite     - an FTS5 virtual table (``pharmacy_medicine_fts``) keyed by
+               ``serial_number`` and kept in sync from Medicine signals.
+* PostgreSQL - a GIN expression index over ``to_tsvector`` (created by
+               migration 0016); PostgreSQL maintains it on every write.
+* anything else, or when ``PHARMACY_FULLTEXT_SEARCH`` is off - the old
+  ``icontains`` filters.
+
+``search()`` takes a Medicine queryset and returns it filtered to the
+matches and ordered by relevance.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'pharmacy_medicine_fts'
+FTS_COLUMNS = ('name', 'composition', 'description', 'medicine_category', 'medicine_type')
+
+# Must stay identical to the expression indexed in migration 0016 so the
+# planner can use pharmacy_medicine_search_gin.
+PG_VECTOR = (
+    "to_tsvector('simple', "
+    "coalesce(name, '') || ' ' || coalesce(composition, '') || ' ' || coalesce(description, '') || ' ' || "
+    "coalesce(medicine_category, '') || ' ' || coalesce(medicine_type, ''))"
+)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    return TERM_RE.findall((query or '').lower())
+
+
+class IContainsBackend:
+    name = 'icontains'
+
+    def search(self, queryset, query, fields=None):
+        condition = Q()
+        for field in fields or ('name', 'description', 'medicine_category', 'medicine_type'):
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition)
+
+    def index(self, medicines, replace=True):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class SQLiteFTSBackend(IContainsBackend):
+    name = 'sqlite-fts5'
+
+    def _match_expression(self, query, fields=None):
+        # Quote every term so user input can't inject FTS5 syntax, and treat
+        # each one as a prefix so partially typed words still match.
+        terms = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in _terms(query))
+        columns = [field for field in (fields or ()) if field in FTS_COLUMNS]
+        if terms and columns:
+            return '{%s} : (%s)' % (' '.join(columns), terms)
+        return terms
+
+    def search(self, queryset, query, fields=None):
+        match = self._match_expression(query, fields)
+        if not match:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        # Join the FTS table once so MATCH and bm25() run in a single pass
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.serial_number", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+            select={'search_rank': f"bm25({FTS_TABLE}, 10.0, 5.0, 1.0, 2.0, 2.0)"},
+        ).order_by('search_rank', 'name')
+
+    def index(self, medicines, replace=True):
+        rows = [
+            (m.serial_number,) + tuple(getattr(m, column) or '' for column in FTS_COLUMNS)
+            for m in medicines
+        ]
+        if not rows:
+            return
+        columns = ', '.join(FTS_COLUMNS)
+        placeholders = ', '.join(['%s'] * (len(FTS_COLUMNS) + 1))
+        with connection.cursor() as cursor:
+            if replace:
+                cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES ({placeholders})", rows)
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in pks])
+
+    def rebuild(self):
+        from .models import Medicine
+
+        with connection.cursor() as cursor:
+            # Recreating the table is much faster than DELETE: FTS5 keeps
+            # delete markers that slow down every insert that follows
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            create_sql = cursor.fetchone()[0]
+            cursor.execute(f"DROP TABLE {FTS_TABLE}")
+            cursor.execute(create_sql)
+        count = 0
+        batch = []
+        for medicine in Medicine.objects.only('serial_number', *FTS_COLUMNS).iterator(chunk_size=2000):
+            batch.append(medicine)
+            if len(batch) == 2000:
+                self.index(batch, replace=False)
+                count += len(batch)
+                batch = []
+        self.index(batch, replace=False)
+        count += len(batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        return count
+
+
+class PostgresFTSBackend(IContainsBackend):
+    name = 'postgres-tsvector'
+
+    def search(self, queryset, query, fields=None):
+        terms = _terms(query)
+        if not terms:
+            return queryset.none()
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        return queryset.extra(
+            where=[f"{PG_VECTOR} @@ to_tsquery('simple', %s)"],
+            params=[tsquery],
+        ).annotate(
+            search_rank=RawSQL(f"ts_rank({PG_VECTOR}, to_tsquery('simple', %s))", [tsquery])
+        ).order_by('-search_rank', 'name')
+
+    def rebuild(self):
+        from .models import Medicine
+
+        with connection.cursor() as cursor:
+            cursor.execute("REINDEX INDEX pharmacy_medicine_search_gin")
+        return Medicine.objects.count()
+
+
+_backend = None
+
+
+def _fts_table_exists():
+    try:
+        return FTS_TABLE in connection.introspection.table_names()
+    except DatabaseError:
+        return False
+
+
+def get_backend():
+    """Return the full-text backend for the default database (cached per process)"""
+    global _backend
+    if not getattr(settings, 'PHARMACY_FULLTEXT_SEARCH', True):
+        return IContainsBackend()
+    if _backend is None:
+        if connection.vendor == 'sqlite' and _fts_table_exists():
+            _backend = SQLiteFTSBackend()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresFTSBackend()
+        else:
+            logger.warning("Full-text search unavailable on %s, falling back to icontains", connection.vendor)
+            _backend = IContainsBackend()
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+def search(queryset, query, fields=None):
+    """Filter ``queryset`` to medicines matching ``query``, most relevant first.
+
+    ``fields`` restricts the match to those columns; by default every indexed
+    column (including composition) is searched.
+    """
+    return get_backend().search(queryset, query, fields=fields)
@@ -0,0 +1,283 @@
+"""
+Typo-tolerant lookup of medicines by name and composition.
+
+A SymSpell-style deletion index: every word of ``clean_medicine_name(name)``
+and ``clean_medicine_name(composition)`` is stored together with all strings
+obtained by deleting up to ``MAX_EDIT_DISTANCE`` characters from it. A query
+word is expanded the same way, so candidate words come from dictionary
+lookups instead of a scan, and only those candidates are checked with an
+exact (optimal string alignment) edit distance.
+
+Like ``search_index``, the index is local to each worker process, follows
+Medicine signals and is rebuilt after ``PHARMACY_SEARCH_INDEX_TTL`` seconds.
+"""
+import heapq
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .hsn_utils import clean_medicine_name
+
+MAX_EDIT_DISTANCE = 2
+MIN_WORD_LENGTH = 3
+WORD_RE = re.compile(r'[a-z]+')
+
+
+def _words(value):
+    return {word for word in WORD_RE.findall(clean_medicine_name(value)) if len(word) >= MIN_WORD_LENGTH}
+
+
+def allowed_distance(word):
+    """Short words tolerate fewer typos, otherwise everything looks alike"""
+    if len(word) <= 4:
+        return 1
+    return MAX_EDIT_DISTANCE
+
+
+def _deletes(word, distance):
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance between ``a`` and ``b``, or ``limit + 1`` once it exceeds ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyMedicineMatcher:
+    """Deletion index over medicine name and composition words, local to this process"""
+
+    def __init__(self, ttl=None):
+        self._lock = threading.RLock()
+        self._ttl = ttl
+        self._payloads = {}
+        self._medicine_words = {}
+        self._name_postings = {}
+        self._composition_postings = {}
+        self._deletes = {}
+        self._sorted = {}
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _expired(self):
+        ttl = self._ttl if self._ttl is not None else getattr(settings, 'PHARMACY_SEARCH_INDEX_TTL', 300)
+        return ttl and (time.monotonic() - self._built_at) > ttl
+
+    def build(self, medicines=None):
+        """(Re)build the whole index from the given iterable or the full catalog"""
+        if medicines is None:
+            from .models import Medicine
+            medicines = Medicine.objects.only(
+                'serial_number', 'name', 'composition', 'hsn_code', 'medicine_category',
+            ).iterator(chunk_size=2000)
+
+        with self._lock:
+            self._payloads, self._medicine_words = {}, {}
+            self._name_postings, self._composition_postings, self._deletes = {}, {}, {}
+            self._sorted = {}
+            for medicine in medicines:
+                self._add(medicine)
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        if not self.is_built or self._expired():
+            self.build()
+
+    def clear(self):
+        with self._lock:
+            self._payloads, self._medicine_words = {}, {}
+            self._name_postings, self._composition_postings, self._deletes = {}, {}, {}
+            self._sorted = {}
+            self._built_at = None
+
+    def _add(self, medicine):
+        pk = medicine.serial_number
+        name_words = _words(medicine.name)
+        composition_words = _words(medicine.composition)
+        self._payloads[pk] = {
+            'id': pk,
+            'name': medicine.name,
+            'composition': medicine.composition or '',
+            'hsn_code': medicine.hsn_code or '',
+            'category': medicine.medicine_category or '',
+            'sort_key': ((medicine.name or '').lower(), pk),
+        }
+        self._medicine_words[pk] = (name_words, composition_words)
+        for field_rank, postings, words in (
+            (0, self._name_postings, name_words),
+            (1, self._composition_postings, composition_words),
+        ):
+            for word in words:
+                if word not in self._name_postings and word not in self._composition_postings:
+                    for key in _deletes(word, MAX_EDIT_DISTANCE):
+                        self._deletes.setdefault(key, set()).add(word)
+                postings.setdefault(word, set()).add(pk)
+                self._sorted.pop((field_rank, word), None)
+
+    def _discard(self, pk):
+        self._payloads.pop(pk, None)
+        name_words, composition_words = self._medicine_words.pop(pk, (set(), set()))
+        for field_rank, postings, words in (
+            (0, self._name_postings, name_words),
+            (1, self._composition_postings, composition_words),
+        ):
+            for word in words:
+                pks = postings.get(word)
+                if pks is None:
+                    continue
+                pks.discard(pk)
+                self._sorted.pop((field_rank, word), None)
+                if pks:
+                    continue
+                del postings[word]
+                if word in self._name_postings or word in self._composition_postings:
+                    continue
+                for key in _deletes(word, MAX_EDIT_DISTANCE):
+                    words_for_key = self._deletes.get(key)
+                    if words_for_key is not None:
+                        words_for_key.discard(word)
+                        if not words_for_key:
+                            del self._deletes[key]
+
+    def update(self, medicine):
+        """Insert or replace a single medicine. No-op until the index has been built."""
+        if not self.is_built:
+            return
+        with self._lock:
+            self._discard(medicine.serial_number)
+            self._add(medicine)
+
+    def remove(self, pk):
+        if not self.is_built:
+            return
+        with self._lock:
+            self._discard(pk)
+
+    def refresh(self, pks):
+        """Reload the given medicines from the database (for writes that bypass post_save)"""
+        if not self.is_built:
+            return
+        from .models import Medicine
+        pks = set(pks)
+        found = set()
+        for medicine in Medicine.objects.filter(serial_number__in=pks):
+            self.update(medicine)
+            found.add(medicine.serial_number)
+        for pk in pks - found:
+            self.remove(pk)
+
+    def suggest_words(self, word):
+        """Return {dictionary word: distance} for words within the allowed distance of ``word``"""
+        limit = allowed_distance(word)
+        candidates = set()
+        for key in _deletes(word, limit):
+            candidates |= self._deletes.get(key, set())
+        matches = {}
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                matches[candidate] = distance
+        return matches
+
+    def _sort_key(self, pk):
+        return self._payloads[pk]['sort_key']
+
+    def _sorted_postings(self, field_rank, word):
+        """Postings of ``word`` in name order, cached until the word's postings change"""
+        key = (field_rank, word)
+        pks = self._sorted.get(key)
+        if pks is None:
+            postings = self._name_postings if field_rank == 0 else self._composition_postings
+            pks = self._sorted[key] = sorted(postings.get(word, ()), key=self._sort_key)
+        return pks
+
+    def _result(self, pk, distance):
+        payload = dict(self._payloads[pk], distance=distance)
+        del payload['sort_key']
+        return payload
+
+    def _search_word(self, word, limit):
+        # Walk (distance, field) groups best-first, merging name-sorted postings,
+        # so a common ingredient doesn't cost a sort of every medicine containing it
+        groups = {}
+        for candidate, distance in self.suggest_words(word).items():
+            for field_rank, postings in enumerate((self._name_postings, self._composition_postings)):
+                if candidate in postings:
+                    groups.setdefault((distance, field_rank), []).append(self._sorted_postings(field_rank, candidate))
+        results, seen = [], set()
+        for (distance, _), lists in sorted(groups.items()):
+            for pk in heapq.merge(*lists, key=self._sort_key):
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                results.append(self._result(pk, distance))
+                if len(results) == limit:
+                    return results
+        return results
+
+    def search(self, query, limit=10):
+        """Return up to ``limit`` payload dicts ranked by edit distance, then name matches first"""
+        words = sorted(_words(query))
+        if not words:
+            return []
+        self.ensure_built()
+
+        with self._lock:
+            if len(words) == 1:
+                return self._search_word(words[0], limit)
+
+            scores = None
+            for word in words:
+                # pk -> (distance, 0 if matched in the name else 1) for this query word
+                best = {}
+                for candidate, distance in self.suggest_words(word).items():
+                    for field_rank, postings in enumerate((self._name_postings, self._composition_postings)):
+                        for pk in postings.get(candidate, ()):
+                            key = (distance, field_rank)
+                            if pk not in best or key < best[pk]:
+                                best[pk] = key
+                if scores is None:
+                    scores = best
+                else:
+                    # every query word has to match something in the medicine
+                    scores = {
+                        pk: (score[0] + best[pk][0], max(score[1], best[pk][1]))
+                        for pk, score in scores.items() if pk in best
+                    }
+                if not scores:
+                    return []
+
+            top = heapq.nsmallest(
+                limit, scores.items(),
+                key=lambda item: (item[1][0], item[1][1], self._sort_key(item[0])),
+            )
+            return [self._result(pk, score[0]) for pk, score in top]
+
+
+fuzzy_matcher = FuzzyMedicineMatcher()
@@ -0,0 +1,249 @@
+"""
+Two-tier memoization of ``auto_fetch_hsn_code``.
+
+1. an in-process LRU (``PHARMACY_HSN_LRU_SIZE`` entries)
+2. the ``HSNLookup`` table, shared by all workers
+
+Both are keyed by the normalized (name, composition, category) plus a
+fingerprint of ``MEDICINE_HSN_CODES``/``CATEGORY_HSN_MAPPING``, so editing the
+dictionaries invalidates every entry. Entries expire after
+``PHARMACY_HSN_CACHE_TTL`` seconds; fallback answers ('default' source) after
+``PHARMACY_HSN_DEFAULT_TTL`` so a remote source gets another chance.
+
+``lookup_many`` asks the remote client about at most
+``PHARMACY_HSN_BATCH_REMOTE_LIMIT`` rows and stops asking after
+``PHARMACY_HSN_BATCH_REMOTE_SECONDS``; the rows it didn't ask about get
+the fallback answer without it being cached.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .hsn_utils import (
+    CATEGORY_HSN_MAPPING, MEDICINE_HSN_CODES, auto_fetch_hsn_code, classify_many, clean_medicine_name,
+    fetch_hsn_from_api, logger,
+)
+
+DICTIONARY_VERSION = hashlib.sha256(
+    json.dumps([sorted(MEDICINE_HSN_CODES.items()), sorted(CATEGORY_HSN_MAPPING.items())]).encode()
+).hexdigest()[:12]
+
+
+def _ttl(result):
+    if result.get('source') == 'default':
+        return getattr(settings, 'PHARMACY_HSN_DEFAULT_TTL', 24 * 60 * 60)
+    return getattr(settings, 'PHARMACY_HSN_CACHE_TTL', 30 * 24 * 60 * 60)
+
+
+def normalize(medicine_name, composition=None, category=None):
+    """The (name, composition, category) triple the cache is keyed by"""
+    return (
+        clean_medicine_name(medicine_name or ''),
+        ' '.join((composition or '').lower().split()),
+        category or '',
+    )
+
+
+def cache_key(normalized):
+    raw = json.dumps([DICTIONARY_VERSION, *normalized])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry (monotonic seconds)"""
+
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return self._maxsize or getattr(settings, 'PHARMACY_HSN_LRU_SIZE', 4096)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+lru = LRUCache()
+
+
+def _from_row(row):
+    return {
+        'hsn_code': row.hsn_code,
+        'source': row.source,
+        'confidence': row.confidence,
+        'suggestions': row.suggestions or [],
+    }
+
+
+def _store(entries):
+    """Persist {key: (normalized, result)} in HSNLookup, replacing older rows for the same key"""
+    from .models import HSNLookup
+
+    now = timezone.now()
+    rows = [
+        HSNLookup(
+            key=key,
+            name=normalized[0][:200],
+            composition=normalized[1],
+            category=normalized[2][:200],
+            hsn_code=result.get('hsn_code'),
+            source=result.get('source', 'none'),
+            confidence=result.get('confidence', 'low'),
+            suggestions=result.get('suggestions', []),
+            expires_at=now + timedelta(seconds=_ttl(result)),
+        )
+        for key, (normalized, result) in entries.items()
+    ]
+    try:
+        HSNLookup.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['hsn_code', 'source', 'confidence', 'suggestions', 'expires_at'],
+        )
+    except DatabaseError as e:
+        # The LRU still has the answer; the table is only an optimization
+        logger.warning(f"Could not persist {len(rows)} HSN lookups: {e}")
+
+
+def _load(keys):
+    from .models import HSNLookup
+
+    try:
+        rows = HSNLookup.objects.filter(key__in=list(keys), expires_at__gt=timezone.now())
+        return {row.key: _from_row(row) for row in rows}
+    except DatabaseError as e:
+        logger.warning(f"Could not read HSN lookup cache: {e}")
+        return {}
+
+
+def lookup(medicine_name, composition=None, category=None):
+    """Cached ``auto_fetch_hsn_code``: same arguments, same result dict"""
+    if not medicine_name:
+        return auto_fetch_hsn_code(medicine_name, composition, category)
+    normalized = normalize(medicine_name, composition, category)
+    key = cache_key(normalized)
+
+    result = lru.get(key)
+    if result is None:
+        result = _load([key]).get(key)
+        if result is None:
+            result = auto_fetch_hsn_code(medicine_name, composition, category)
+            _store({key: (normalized, result)})
+        lru.set(key, result, _ttl(result))
+    return dict(result)
+
+
+def lookup_many(rows):
+    """
+    Resolve many medicines at once
+
+    Args:
+        rows: dicts with 'name', 'composition' and 'category' (or 3-tuples)
+
+    Returns:
+        list of result dicts in the order of ``rows``. Cache misses are read
+        from the table in one query, classified locally with classify_many()
+        and only the remaining unknowns go to the remote client, within the
+        batch's remote call limit and deadline.
+    """
+    pending = []
+    for row in rows:
+        if isinstance(row, dict):
+            name, composition, category = row.get('name'), row.get('composition'), row.get('category')
+        else:
+            name, composition, category = (list(row) + [None, None])[:3]
+        normalized = normalize(name, composition, category)
+        pending.append((name, composition, category, normalized, cache_key(normalized)))
+
+    results = {}
+    missing = {}
+    for name, composition, category, normalized, key in pending:
+        if not name or key in results or key in missing:
+            continue
+        cached = lru.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            missing[key] = (name, composition, category, normalized)
+
+    if missing:
+        for key, result in _load(missing).items():
+            results[key] = result
+            lru.set(key, result, _ttl(result))
+            del missing[key]
+
+    if missing:
+        keys = list(missing)
+        local = classify_many([missing[key][:3] for key in keys])
+        computed = {}
+        remote_calls = getattr(settings, 'PHARMACY_HSN_BATCH_REMOTE_LIMIT', 20)
+        deadline = time.monotonic() + getattr(settings, 'PHARMACY_HSN_BATCH_REMOTE_SECONDS', 10)
+        for key, result in zip(keys, local):
+            name, composition, category, normalized = missing[key]
+            if result['source'] == 'default':
+                if remote_calls <= 0 or time.monotonic() >= deadline:
+                    # Not asked this time: answer with the fallback but leave it uncached
+                    results[key] = result
+                    continue
+                remote_calls -= 1
+                api_result = fetch_hsn_from_api(name, composition)
+                if api_result:
+                    result = {
+                        'hsn_code': api_result.get('hsn_code'),
+                        'source': 'api',
+                        'confidence': api_result.get('confidence', 'medium'),
+                        'suggestions': [],
+                    }
+            results[key] = result
+            computed[key] = (normalized, result)
+            lru.set(key, result, _ttl(result))
+        if computed:
+            _store(computed)
+
+    output = []
+    for name, composition, category, normalized, key in pending:
+        output.append(dict(results[key]) if name else auto_fetch_hsn_code(name))
+    return output
+
+
+def clear(persistent=True):
+    """Drop the LRU and, unless ``persistent`` is False, the HSNLookup table"""
+    from .models import HSNLookup
+
+    lru.clear()
+    if persistent:
+        HSNLookup.objects.all().delete()
@@ -4,9 +4,13 @@ HSN Code Auto-Fetch Utilities for Medicines
 import requests
 import json
 import re
-from typing import Optional, Dict, Any
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterable, List
 import logging
 
+from .aho_corasick import AhoCorasick
+
 logger = logging.getLogger(__name__)
 
 # Comprehensive medicine HSN codes database (Updated for accurate Indian GST classification)
@@ -169,6 +173,7 @@ CATEGORY_HSN_MAPPING = {
     'First Aid': '30059090',                # External use medicaments
 }
 
+@lru_cache(maxsize=8192)
 def clean_medicine_name(name: str) -> str:
     """Clean medicine name for better matching"""
     if not name:
@@ -186,22 +191,60 @@ def clean_medicine_name(name: str) -> str:
     
     return cleaned
 
+# Sort order of hits: longer ingredient first ('ciprofloxacin' over 'ofloxacin'),
+# then hits in the name before hits in the composition, then leftmost.
+IngredientHit = namedtuple('IngredientHit', 'ingredient hsn_code field start')
+
+NAME_FIELD, COMPOSITION_FIELD = 0, 1
+_FIELD_SEPARATOR = '\n'
+
+_automaton = None
+
+
+def get_hsn_automaton() -> AhoCorasick:
+    """The MEDICINE_HSN_CODES dictionary compiled into an Aho–Corasick automaton (built once)"""
+    global _automaton
+    if _automaton is None:
+        _automaton = AhoCorasick(MEDICINE_HSN_CODES)
+    return _automaton
+
+
+def find_ingredients(medicine_name: str, composition: str = None, cleaned_name: str = None) -> List[IngredientHit]:
+    """Every known ingredient in the cleaned name and the composition, best match first"""
+    if cleaned_name is None:
+        cleaned_name = clean_medicine_name(medicine_name)
+    # One pass over both fields; the separator never occurs in an ingredient
+    text = cleaned_name + _FIELD_SEPARATOR + (composition or '').lower()
+    boundary = len(cleaned_name)
+    hits = [
+        IngredientHit(ingredient, hsn_code, NAME_FIELD if start < boundary else COMPOSITION_FIELD, start)
+        for start, end, ingredient, hsn_code in get_hsn_automaton().longest_matches(text)
+    ]
+    if len(hits) > 1:
+        hits.sort(key=lambda hit: (-len(hit.ingredient), hit.field, hit.start))
+    return hits
+
+
+def _composition_ingredient(composition: str) -> Optional[str]:
+    # Look for common patterns like "Paracetamol 500mg"
+    match = re.search(r'([a-zA-Z\s]+?)(?:\s*\d+\s*(?:mg|mcg|g|%|ml))', composition.lower())
+    if match:
+        return match.group(1).strip()
+    return None
+
 def extract_active_ingredient(medicine_name: str, composition: str = None) -> str:
     """Extract the main active ingredient from medicine name or composition"""
     # If composition is available, try to extract from there
     if composition:
-        # Look for common patterns like "Paracetamol 500mg"
-        match = re.search(r'([a-zA-Z\s]+?)(?:\s*\d+\s*(?:mg|mcg|g|%|ml))', composition.lower())
-        if match:
-            return match.group(1).strip()
+        ingredient = _composition_ingredient(composition)
+        if ingredient:
+            return ingredient
     
-    # Extract from medicine name
+    # Check if the name contains known active ingredients
     cleaned_name = clean_medicine_name(medicine_name)
-    
-    # Check if it contains known active ingredients
-    for ingredient in MEDICINE_HSN_CODES.keys():
-        if ingredient in cleaned_name:
-            return ingredient
+    hits = find_ingredients(medicine_name, cleaned_name=cleaned_name)
+    if hits:
+        return hits[0].ingredient
     
     return cleaned_name
 
@@ -214,7 +257,13 @@ def get_hsn_from_database(medicine_name: str, composition: str = None, category:
         return MEDICINE_HSN_CODES[cleaned_name]
     
     # Method 2: Extract active ingredient and match
-    active_ingredient = extract_active_ingredient(medicine_name, composition)
+    hits = None
+    active_ingredient = _composition_ingredient(composition) if composition else None
+    if not active_ingredient:
+        # One automaton pass over name + composition also serves method 4
+        hits = find_ingredients(medicine_name, composition, cleaned_name=cleaned_name)
+        name_hits = [hit for hit in hits if hit.field == NAME_FIELD]
+        active_ingredient = name_hits[0].ingredient if name_hits else cleaned_name
     if active_ingredient in MEDICINE_HSN_CODES:
         return MEDICINE_HSN_CODES[active_ingredient]
     
@@ -222,39 +271,74 @@ def get_hsn_from_database(medicine_name: str, composition: str = None, category:
     if category and category in CATEGORY_HSN_MAPPING:
         return CATEGORY_HSN_MAPPING[category]
     
-    # Method 4: Partial matching with known ingredients
-    for ingredient, hsn in MEDICINE_HSN_CODES.items():
-        if ingredient in cleaned_name or (composition and ingredient in composition.lower()):
-            return hsn
+    # Method 4: Known ingredients anywhere in the name or composition
+    if hits is None:
+        hits = find_ingredients(medicine_name, composition, cleaned_name=cleaned_name)
+    if hits:
+        return hits[0].hsn_code
     
     return None
 
+class HSNClient:
+    """
+    Remote HSN lookup. The default client knows nothing; point
+    PHARMACY_HSN_CLIENT at a subclass (or pass one to set_hsn_client, e.g. a
+    fake in tests) to enable an online source.
+    """
+    def lookup(self, medicine_name: str, composition: str = None) -> Optional[Dict[str, Any]]:
+        """Return {'hsn_code': ..., 'confidence': ...} or None"""
+        return None
+
+class HTTPHSNClient(HSNClient):
+    """
+    JSON-over-HTTP lookup: GET <PHARMACY_HSN_API_URL>?medicine=...&composition=...
+    answering {"hsn_code": "...", "confidence": "..."}
+    """
+    def __init__(self, base_url: str = None, timeout=None, session=None):
+        from django.conf import settings
+        self.base_url = base_url or getattr(settings, 'PHARMACY_HSN_API_URL', '')
+        # (connect, read) seconds; the add-medicine form waits on this
+        self.timeout = timeout or getattr(settings, 'PHARMACY_HSN_API_TIMEOUT', (2, 3))
+        self.session = session or requests.Session()
+
+    def lookup(self, medicine_name: str, composition: str = None) -> Optional[Dict[str, Any]]:
+        if not self.base_url:
+            return None
+        response = self.session.get(
+            self.base_url,
+            params={'medicine': medicine_name, 'composition': composition or ''},
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if not data.get('hsn_code'):
+            return None
+        return {'hsn_code': str(data['hsn_code']), 'confidence': data.get('confidence', 'medium')}
+
+_hsn_client = None
+
+def get_hsn_client() -> HSNClient:
+    """The configured remote client (PHARMACY_HSN_CLIENT dotted path), created once"""
+    global _hsn_client
+    if _hsn_client is None:
+        from django.conf import settings
+        from django.utils.module_loading import import_string
+        client_path = getattr(settings, 'PHARMACY_HSN_CLIENT', 'pharmacy.hsn_utils.HSNClient')
+        _hsn_client = import_string(client_path)()
+    return _hsn_client
+
+def set_hsn_client(client: Optional[HSNClient]):
+    """Replace the remote client (None restores the configured one)"""
+    global _hsn_client
+    _hsn_client = client
+
 def fetch_hsn_from_api(medicine_name: str, composition: str = None) -> Optional[Dict[str, Any]]:
     """
-    Attempt to fetch HSN code from online APIs
-    Note: This is a placeholder for actual API integration
+    Attempt to fetch HSN code from the configured remote client
     """
     try:
-        # This is where you would integrate with actual APIs like:
-        # 1. GST HSN Code APIs
-        # 2. Drug information APIs
-        # 3. Pharmaceutical databases
-        
-        # For now, we'll simulate an API response
-        # In production, you might use APIs like:
-        # - India's GST portal API
-        # - OpenFDA API
-        # - DrugBank API
-        # - Custom pharmaceutical databases
-        
-        # Placeholder API call (replace with actual implementation)
-        # response = requests.get(f"https://api.example.com/hsn?medicine={medicine_name}", timeout=5)
-        # if response.status_code == 200:
-        #     data = response.json()
-        #     return data.get('hsn_code')
-        
-        return None
-        
+        return get_hsn_client().lookup(medicine_name, composition)
     except requests.RequestException as e:
         logger.warning(f"API request failed for medicine {medicine_name}: {e}")
         return None
@@ -262,6 +346,36 @@ def fetch_hsn_from_api(medicine_name: str, composition: str = None) -> Optional[
         logger.error(f"Unexpected error fetching HSN for {medicine_name}: {e}")
         return None
 
+def _classify_locally(medicine_name: str, composition: str = None, category: str = None) -> Optional[Dict[str, Any]]:
+    """auto_fetch_hsn_code result from the local database, or None if it has no answer"""
+    hsn_code = get_hsn_from_database(medicine_name, composition, category)
+    if not hsn_code:
+        return None
+    return {
+        'hsn_code': hsn_code,
+        'source': 'database',
+        'confidence': 'high',
+        'suggestions': []
+    }
+
+def _default_result(category: str = None) -> Dict[str, Any]:
+    result = {
+        'hsn_code': '30049099',  # General pharmaceutical preparations
+        'source': 'default',
+        'confidence': 'low',
+        # Add suggestions for manual verification
+        'suggestions': [
+            "Please verify HSN code manually",
+            "HSN codes may vary based on exact composition",
+            "Consult GST guidelines for accurate classification"
+        ]
+    }
+    # Provide default HSN code based on category
+    if category in CATEGORY_HSN_MAPPING:
+        result['hsn_code'] = CATEGORY_HSN_MAPPING[category]
+        result['confidence'] = 'medium'
+    return result
+
 def auto_fetch_hsn_code(medicine_name: str, composition: str = None, category: str = None) -> Dict[str, Any]:
     """
     Automatically fetch HSN code for a medicine
@@ -269,56 +383,60 @@ def auto_fetch_hsn_code(medicine_name: str, composition: str = None, category: s
     Returns:
         Dict with 'hsn_code', 'source', and 'confidence' keys
     """
-    result = {
-        'hsn_code': None,
-        'source': 'none',
-        'confidence': 'low',
-        'suggestions': []
-    }
-    
     if not medicine_name:
-        return result
+        return {
+            'hsn_code': None,
+            'source': 'none',
+            'confidence': 'low',
+            'suggestions': []
+        }
     
     # Try local database first (faster and more reliable)
-    hsn_code = get_hsn_from_database(medicine_name, composition, category)
-    
-    if hsn_code:
-        result.update({
-            'hsn_code': hsn_code,
-            'source': 'database',
-            'confidence': 'high'
-        })
+    result = _classify_locally(medicine_name, composition, category)
+    if result:
         return result
     
     # Try API fetch as fallback
     api_result = fetch_hsn_from_api(medicine_name, composition)
     if api_result:
-        result.update({
+        return {
             'hsn_code': api_result.get('hsn_code'),
             'source': 'api',
-            'confidence': api_result.get('confidence', 'medium')
-        })
-        return result
+            'confidence': api_result.get('confidence', 'medium'),
+            'suggestions': []
+        }
     
-    # Provide default HSN code based on category
-    default_hsn = '30049099'  # General pharmaceutical preparations
-    if category in CATEGORY_HSN_MAPPING:
-        default_hsn = CATEGORY_HSN_MAPPING[category]
-        result['confidence'] = 'medium'
-    
-    result.update({
-        'hsn_code': default_hsn,
-        'source': 'default',
-    })
-    
-    # Add suggestions for manual verification
-    result['suggestions'] = [
-        "Please verify HSN code manually",
-        "HSN codes may vary based on exact composition",
-        "Consult GST guidelines for accurate classification"
-    ]
+    return _default_result(category)
+
+def classify_many(rows: Iterable) -> List[Dict[str, Any]]:
+    """
+    Classify many medicines in one call (bulk imports)
     
-    return result
+    Args:
+        rows: (name, composition, category) tuples or dicts with those keys
+        
+    Returns:
+        list of auto_fetch_hsn_code-style dicts, one per row in the same order.
+        Identical rows are classified once; the remote API is never called.
+    """
+    results = []
+    memo = {}
+    for row in rows:
+        if isinstance(row, dict):
+            key = (row.get('name') or '', row.get('composition') or '', row.get('category') or '')
+        else:
+            name, composition, category = (list(row) + [None, None])[:3]
+            key = (name or '', composition or '', category or '')
+        result = memo.get(key)
+        if result is None:
+            name, composition, category = key
+            if not name:
+                result = auto_fetch_hsn_code(name)
+            else:
+                result = _classify_locally(name, composition or None, category or None) or _default_result(category or None)
+            memo[key] = result
+        results.append(dict(result))
+    return results
 
 def get_composition_suggestions(medicine_name: str) -> list:
     """Get composition suggestions based on medicine name"""
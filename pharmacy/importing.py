@@ -0,0 +1,507 @@
+"""
+Streaming bulk import of medicines from CSV or XLSX files.
+
+Rows are read lazily, validated into typed values and written in batches of
+``PHARMACY_IMPORT_BATCH_SIZE``: one ``bulk_create(update_conflicts=True)``
+per batch upserts on ``medicine_id``, so re-importing a file updates the
+medicines it created instead of duplicating them. Rows without a
+``medicine_id`` are matched to an existing medicine by (name, batch_no), or
+get a new ``#M-XXXXXXXX`` id.
+
+bulk_create sends no post_save, so the index updates don't run per row;
+``medicines_bulk_changed`` is sent once at the end and refreshes the derived
+data in bulk. Stock changes are written to the ledger with each batch
+(receipts for new medicines, adjustments otherwise), quantity increases go
+into the row's batch_no (see pharmacy.batches) and medicines that drop below
+the low-stock threshold are queued for the alert digest (see pharmacy.alerts).
+Bad rows don't stop the import: they are collected in ``ImportReport.errors``
+with their row number.
+"""
+import csv
+import io
+import logging
+import uuid
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .hsn_utils import classify_many
+from . import alerts, batches
+from .ledger import record_many
+from .models import Medicine, StockMovement, normalize_category
+
+logger = logging.getLogger(__name__)
+
+# Model field for each import column
+COLUMNS = {
+    'medicine_id': 'medicine_id',
+    'name': 'name',
+    'weight': 'weight',
+    'quantity': 'quantity',
+    'stock_quantity': 'stock_quantity',
+    'price': 'price',
+    'description': 'description',
+    'composition': 'composition',
+    'hsn_code': 'hsn_code',
+    'batch_no': 'batch_no',
+    'medicine_type': 'medicine_type',
+    'medicine_category': 'medicine_category',
+    'prescription_required': 'Prescription_reqiuired',
+    'expiry_date': 'expiry_date',
+}
+HEADER_ALIASES = {
+    'id': 'medicine_id',
+    'sku': 'medicine_id',
+    'medicine_name': 'name',
+    'batch': 'batch_no',
+    'batch_number': 'batch_no',
+    'category': 'medicine_category',
+    'type': 'medicine_type',
+    'prescription_reqiuired': 'prescription_required',
+    'expiry': 'expiry_date',
+}
+TEXT_LIMITS = {
+    'medicine_id': 200, 'name': 200, 'weight': 200, 'hsn_code': 20, 'batch_no': 100, 'medicine_category': 200,
+    'description': None, 'composition': None,
+}
+MEDICINE_TYPE_ALIASES = {'tablet': 'tablets', 'capsules': 'capsule', 'syrups': 'syrup'}
+YES_NO = {'yes': 'yes', 'y': 'yes', 'true': 'yes', '1': 'yes', 'no': 'no', 'n': 'no', 'false': 'no', '0': 'no'}
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y')
+
+RowError = namedtuple('RowError', 'row column message')
+_Existing = namedtuple('_Existing', 'hsn_code quantity stock_quantity')
+
+
+class MedicineImportError(ValueError):
+    """The file as a whole can't be imported (unknown format, missing columns)"""
+
+
+class ImportReport:
+    """Outcome of an import: counts plus one RowError per rejected row"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    @property
+    def imported(self):
+        return self.created + self.updated
+
+    def add_error(self, row, column, message):
+        self.errors.append(RowError(row, column, message))
+
+    def errors_csv(self):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['row', 'column', 'error'])
+        writer.writerows(self.errors)
+        return output.getvalue()
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows: {self.created} created, {self.updated} updated, "
+            f"{len(self.errors)} rejected"
+        )
+
+
+def normalize_header(header):
+    names = []
+    for raw in header:
+        name = '_'.join(str(raw or '').strip().lower().replace('-', ' ').split())
+        names.append(HEADER_ALIASES.get(name, name))
+    return names
+
+
+def _binary(file):
+    # Django's UploadedFile wraps the real file object in .file
+    return getattr(file, 'file', file)
+
+
+def iter_csv_rows(file):
+    """Return (header, rows) where rows lazily yields (row number, {column: value})"""
+    text = io.TextIOWrapper(_binary(file), encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = normalize_header(next(reader, []))
+
+    def rows():
+        try:
+            for values in reader:
+                if any(value.strip() for value in values):
+                    yield reader.line_num, dict(zip(header, values))
+        finally:
+            # Don't let the wrapper close the caller's file
+            text.detach()
+
+    return header, rows()
+
+
+def iter_xlsx_rows(file):
+    """Same as iter_csv_rows for the first worksheet of an .xlsx workbook"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise MedicineImportError('Excel import needs the openpyxl package; upload a CSV instead.')
+    try:
+        workbook = load_workbook(_binary(file), read_only=True, data_only=True)
+    except Exception as e:
+        raise MedicineImportError(f'Not a readable .xlsx workbook: {e}')
+    sheet_rows = workbook.active.iter_rows(values_only=True)
+    header = normalize_header(next(sheet_rows, ()))
+
+    def rows():
+        try:
+            for number, values in enumerate(sheet_rows, start=2):
+                if any(value not in (None, '') for value in values):
+                    yield number, dict(zip(header, values))
+        finally:
+            workbook.close()
+
+    return header, rows()
+
+
+def read_rows(file, filename):
+    name = (filename or '').lower()
+    if name.endswith('.xlsx'):
+        return iter_xlsx_rows(file)
+    if name.endswith('.csv') or name.endswith('.txt'):
+        return iter_csv_rows(file)
+    raise MedicineImportError('Upload a .csv or .xlsx file.')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _integer(value):
+    text = _text(value)
+    if not text:
+        return 0
+    number = Decimal(text.replace(',', ''))
+    if number != number.to_integral_value() or number < 0:
+        raise ValueError('must be a whole number of 0 or more')
+    return int(number)
+
+
+def _price(value):
+    text = _text(value)
+    if not text:
+        return Decimal('0.00')
+    number = Decimal(text.replace(',', ''))
+    if number < 0 or number >= Decimal('100000000'):
+        raise ValueError('must be between 0 and 99999999.99')
+    return number.quantize(Decimal('0.01'))
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _text(value)
+    if not text:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError('must be a date like 2027-03-31')
+
+
+def _medicine_type(value):
+    text = _text(value).lower()
+    if not text:
+        return None
+    text = MEDICINE_TYPE_ALIASES.get(text, text)
+    if text not in dict(Medicine.MEDICINE_TYPE):
+        raise ValueError(f"must be one of {', '.join(dict(Medicine.MEDICINE_TYPE))}")
+    return text
+
+
+def _yes_no(value):
+    text = _text(value).lower()
+    if not text:
+        return None
+    if text not in YES_NO:
+        raise ValueError('must be yes or no')
+    return YES_NO[text]
+
+
+PARSERS = {
+    'quantity': _integer,
+    'stock_quantity': _integer,
+    'price': _price,
+    'expiry_date': _date,
+    'medicine_type': _medicine_type,
+    'prescription_required': _yes_no,
+}
+
+
+def validate_row(values, columns):
+    """
+    Convert one raw row into model field values
+
+    Returns:
+        (fields, errors): fields maps model field names to typed values,
+        errors is a list of (column, message)
+    """
+    fields = {}
+    errors = []
+    for column in columns:
+        raw = values.get(column)
+        parser = PARSERS.get(column)
+        if parser is not None:
+            try:
+                fields[COLUMNS[column]] = parser(raw)
+            except (ValueError, InvalidOperation) as e:
+                message = str(e) if isinstance(e, ValueError) and str(e) else 'is not a number'
+                errors.append((column, f"{_text(raw)!r} {message}"))
+            continue
+        text = _text(raw)
+        limit = TEXT_LIMITS.get(column)
+        if limit and len(text) > limit:
+            errors.append((column, f"is longer than {limit} characters"))
+            continue
+        fields[COLUMNS[column]] = text or None
+    if 'name' in columns and not fields.get('name') and not any(column == 'name' for column, _ in errors):
+        errors.append(('name', 'is required'))
+    elif not fields.get('name') and not fields.get('medicine_id') and not errors:
+        errors.append(('medicine_id', 'is required when the row has no name'))
+    return fields, errors
+
+
+def _new_medicine_id(taken):
+    while True:
+        medicine_id = f"#M-{str(uuid.uuid4())[:8].upper()}"
+        if medicine_id not in taken:
+            return medicine_id
+
+
+class MedicineImporter:
+    """
+    Validates rows and upserts them batch by batch
+
+        importer = MedicineImporter(columns)
+        for number, values in rows:
+            importer.add(number, values)
+        report = importer.finish()
+    """
+
+    def __init__(self, columns, batch_size=None, user=None):
+        columns = [column for column in columns if column in COLUMNS]
+        if 'name' not in columns and 'medicine_id' not in columns:
+            raise MedicineImportError('The file needs a "name" or "medicine_id" column.')
+        self.columns = columns
+        self.batch_size = batch_size or getattr(settings, 'PHARMACY_IMPORT_BATCH_SIZE', 2000)
+        self.report = ImportReport()
+        self.user = user
+        self.changed_pks = []
+        self._batch = []
+        self._batch_keys = set()
+
+        update_fields = {COLUMNS[column] for column in columns} - {'medicine_id'}
+        if 'medicine_category' in columns:
+            update_fields.add('normalized_category')
+        update_fields.add('hsn_code')
+        self.update_fields = sorted(update_fields)
+
+    def add(self, number, values):
+        self.report.rows += 1
+        fields, errors = validate_row(values, self.columns)
+        if errors:
+            for column, message in errors:
+                self.report.add_error(number, column, message)
+            return
+        if fields.get('medicine_id'):
+            key = fields['medicine_id']
+        elif fields.get('batch_no'):
+            key = (fields['name'], fields['batch_no'])
+        else:
+            key = None
+        # A repeated medicine must see the earlier row's write, as if imported one by one
+        if key is not None and key in self._batch_keys:
+            self.flush()
+        self._batch.append((number, fields))
+        if key is not None:
+            self._batch_keys.add(key)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def _match_existing(self, batch):
+        """medicine_id -> _Existing for the batch's medicines that already exist; fills in missing ids"""
+        by_name = [fields for _, fields in batch if not fields.get('medicine_id')]
+        if by_name:
+            batch_nos = {fields.get('batch_no') for fields in by_name if fields.get('batch_no')}
+            known = {}
+            if batch_nos:
+                for name, batch_no, medicine_id in Medicine.objects.filter(
+                    batch_no__in=batch_nos, name__in={fields['name'] for fields in by_name}
+                ).exclude(medicine_id=None).values_list('name', 'batch_no', 'medicine_id'):
+                    known[(name, batch_no)] = medicine_id
+            for fields in by_name:
+                fields['medicine_id'] = known.get((fields['name'], fields.get('batch_no')))
+
+        ids = [fields['medicine_id'] for _, fields in batch if fields.get('medicine_id')]
+        existing = {
+            medicine_id: _Existing(hsn_code, quantity, stock_quantity)
+            for medicine_id, hsn_code, quantity, stock_quantity in Medicine.objects.select_for_update().filter(
+                medicine_id__in=ids
+            ).values_list('medicine_id', 'hsn_code', 'quantity', 'stock_quantity')
+        }
+        taken = set(existing) | set(ids)
+        for _, fields in batch:
+            if not fields.get('medicine_id'):
+                fields['medicine_id'] = _new_medicine_id(taken)
+                taken.add(fields['medicine_id'])
+        return existing
+
+    def _resolve_hsn_codes(self, batch, existing):
+        for _, fields in batch:
+            if not fields.get('hsn_code') and fields['medicine_id'] in existing:
+                fields['hsn_code'] = existing[fields['medicine_id']].hsn_code
+        unresolved = [fields for _, fields in batch if not fields.get('hsn_code') and fields.get('name')]
+        if not unresolved:
+            return
+        # Local dictionaries only: a remote lookup per unknown row would stall
+        # the import, and caching one-off rows would fill HSNLookup with noise
+        results = classify_many([
+            (fields['name'], fields.get('composition'), fields.get('medicine_category'))
+            for fields in unresolved
+        ])
+        for fields, result in zip(unresolved, results):
+            fields['hsn_code'] = result.get('hsn_code')
+
+    def flush(self):
+        batch, self._batch, self._batch_keys = self._batch, [], set()
+        if not batch:
+            return
+        try:
+            with transaction.atomic():
+                existing = self._match_existing(batch)
+                accepted = []
+                for number, fields in batch:
+                    if fields['medicine_id'] not in existing and not fields.get('name'):
+                        self.report.add_error(number, 'medicine_id', f"{fields['medicine_id']!r} is not an existing medicine and the row has no name")
+                    else:
+                        accepted.append((number, fields))
+                self._resolve_hsn_codes(accepted, existing)
+
+                medicines = []
+                for _, fields in accepted:
+                    medicine = Medicine(**fields)
+                    # Like the old importer: a new medicine's stock follows its
+                    # quantity unless the file says otherwise; existing stock is kept
+                    if fields['medicine_id'] not in existing and 'stock_quantity' not in fields:
+                        medicine.stock_quantity = fields.get('quantity', 0)
+                    medicine.normalized_category = normalize_category(medicine.medicine_category)
+                    medicines.append(medicine)
+                Medicine.objects.bulk_create(
+                    medicines,
+                    update_conflicts=True,
+                    unique_fields=['medicine_id'],
+                    update_fields=self.update_fields,
+                )
+                pks = self._primary_keys(medicines)
+                movements = list(self._movements(medicines, pks, existing))
+                record_many(movements)
+                batches.apply_changes(self._batch_changes(medicines, movements))
+                alerts.queue_low_stock(self._quantity_levels(medicines, movements, existing))
+        except DatabaseError as e:
+            logger.error(f"Medicine import batch of {len(batch)} rows failed: {e}")
+            for number, _ in batch:
+                self.report.add_error(number, '', f"not saved: {e}")
+            return
+
+        updated = sum(1 for _, fields in accepted if fields['medicine_id'] in existing)
+        self.report.updated += updated
+        self.report.created += len(medicines) - updated
+        self.changed_pks.extend(pks.values())
+
+    def _primary_keys(self, medicines):
+        """medicine_id -> pk of the rows just written"""
+        pks = {medicine.medicine_id: medicine.pk for medicine in medicines}
+        if None in pks.values():
+            # Backends that can't return ids from an upsert
+            pks = dict(Medicine.objects.filter(medicine_id__in=list(pks)).values_list('medicine_id', 'serial_number'))
+        return pks
+
+    def _movements(self, medicines, pks, existing):
+        for medicine in medicines:
+            before = existing.get(medicine.medicine_id)
+            if before is None:
+                kind, quantity, stock_quantity = StockMovement.RECEIPT, 0, 0
+            else:
+                kind = StockMovement.ADJUSTMENT
+                quantity, stock_quantity = before.quantity or 0, before.stock_quantity or 0
+            # Columns missing from the file keep their values on update
+            new_quantity = (medicine.quantity or 0) if before is None or 'quantity' in self.update_fields else quantity
+            new_stock = (medicine.stock_quantity or 0) if before is None or 'stock_quantity' in self.update_fields else stock_quantity
+            yield StockMovement(
+                medicine_id=pks[medicine.medicine_id],
+                kind=kind,
+                quantity_change=new_quantity - quantity,
+                stock_change=new_stock - stock_quantity,
+                reference='import',
+                user=self.user,
+            )
+
+    def _batch_changes(self, medicines, movements):
+        """The file's batch_no/expiry_date name the batch a quantity increase went into"""
+        named = 'batch_no' in self.update_fields
+        dated = 'expiry_date' in self.update_fields
+        for medicine, movement in zip(medicines, movements):
+            yield (
+                movement.medicine_id,
+                movement.quantity_change,
+                (medicine.batch_no or '') if named else None,
+                medicine.expiry_date if dated else None,
+            )
+
+    def _quantity_levels(self, medicines, movements, existing):
+        """medicine pk -> (Unit Qty before, after) for the low-stock alerts"""
+        levels = {}
+        for medicine, movement in zip(medicines, movements):
+            before = existing.get(medicine.medicine_id)
+            quantity = None if before is None else (before.quantity or 0)
+            levels[movement.medicine_id] = (quantity, (quantity or 0) + movement.quantity_change)
+        return levels
+
+    def finish(self):
+        from .signals import medicines_bulk_changed
+
+        self.flush()
+        if self.changed_pks:
+            medicines_bulk_changed.send(sender=Medicine, pks=self.changed_pks, fields=self.update_fields)
+        return self.report
+
+
+def import_medicines(file, filename, batch_size=None, user=None):
+    """
+    Import medicines from an uploaded CSV/XLSX file
+
+    Args:
+        file: binary file object (an UploadedFile or an open file)
+        filename: used to pick the format from its extension
+        batch_size: rows per transaction (default PHARMACY_IMPORT_BATCH_SIZE)
+        user: who ran the import, for the stock ledger
+
+    Returns:
+        ImportReport
+
+    Raises:
+        MedicineImportError: the file can't be read at all
+    """
+    columns, rows = read_rows(file, filename)
+    importer = MedicineImporter(columns, batch_size=batch_size, user=user)
+    for number, values in rows:
+        importer.add(number, values)
+    return importer.finish()
@@ -0,0 +1,165 @@
+"""
+Active ingredients parsed from the free-text ``Medicine.composition``.
+
+``parse_composition("Amoxycillin (as Trihydrate) 500mg + Clavulanic Acid 125 mg")``
+gives ``[('amoxicillin', Decimal('500'), 'mg'), ('clavulanic acid', Decimal('125'), 'mg')]``.
+The tokens are stored in ``MedicineIngredient`` on every Medicine save (see
+signals), so "every SKU containing amoxicillin" is an indexed lookup instead
+of a substring scan over composition.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Q
+
+SPLIT_RE = re.compile(r'\s*(?:\+|,|;|&|\band\b|\bwith\b)\s*')
+STRENGTH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|mcg|µg|gm|g|ml|iu|%|units?)(?![a-z])')
+TRAILING_NUMBER_RE = re.compile(r'\s(\d+(?:\.\d+)?)\s*$')
+PHARMACOPOEIA_RE = re.compile(r'\b(?:ip|bp|usp|i\.p\.|b\.p\.)(?=\s|$)')
+
+UNIT_ALIASES = {'gm': 'g', 'µg': 'mcg', 'units': 'unit'}
+# Salt/hydrate forms that don't change which medicine it is
+SALT_SUFFIXES = ('hydrochloride', 'dihydrochloride', 'hcl', 'trihydrate', 'monohydrate', 'dihydrate')
+SYNONYMS = {
+    'amoxycillin': 'amoxicillin',
+    'acetaminophen': 'paracetamol',
+    'cefalexin': 'cephalexin',
+    'salbutamol sulphate': 'salbutamol',
+    'vitamin c': 'ascorbic acid',
+}
+
+
+def normalize_ingredient(name):
+    """Lowercase, drop pharmacopoeia marks, salt forms and 'as ...' clauses, apply synonyms"""
+    name = (name or '').lower().replace('(', ' ').replace(')', ' ')
+    name = name.split(' as ')[0]
+    name = PHARMACOPOEIA_RE.sub(' ', name)
+    name = re.sub(r'[^a-z0-9 ]', ' ', name)
+    words = [word for word in name.split() if word not in SALT_SUFFIXES]
+    name = ' '.join(words)
+    return SYNONYMS.get(name, name)
+
+
+def parse_composition(composition):
+    """Return a list of (ingredient, strength or None, unit) tuples, one per distinct ingredient"""
+    tokens = []
+    seen = set()
+    for part in SPLIT_RE.split((composition or '').lower()):
+        part = part.replace('(', ' ').replace(')', ' ').strip()
+        if not part:
+            continue
+        strength, unit = None, ''
+        match = STRENGTH_RE.search(part)
+        if match:
+            strength, unit, name = match.group(1), match.group(2), part[:match.start()]
+        else:
+            match = TRAILING_NUMBER_RE.search(part)
+            if match:
+                strength, name = match.group(1), part[:match.start()]
+            else:
+                name = part
+        ingredient = normalize_ingredient(name)
+        if not re.search(r'[a-z]', ingredient) or ingredient in seen:
+            continue
+        seen.add(ingredient)
+        try:
+            strength = Decimal(strength) if strength is not None else None
+        except InvalidOperation:
+            strength = None
+        tokens.append((ingredient[:100], strength, UNIT_ALIASES.get(unit, unit)))
+    return tokens
+
+
+def sync_ingredients(medicine):
+    """Rewrite the MedicineIngredient rows of ``medicine`` if its composition parses differently"""
+    from .models import MedicineIngredient
+
+    parsed = parse_composition(medicine.composition)
+    existing = [
+        (ingredient, strength, unit)
+        for ingredient, strength, unit in medicine.ingredients.order_by('pk').values_list('ingredient', 'strength', 'unit')
+    ]
+    if existing == parsed:
+        return
+    medicine.ingredients.all().delete()
+    MedicineIngredient.objects.bulk_create([
+        MedicineIngredient(medicine=medicine, ingredient=ingredient, strength=strength, unit=unit)
+        for ingredient, strength, unit in parsed
+    ])
+
+
+def sync_ingredients_bulk(medicines):
+    """sync_ingredients for many medicines: one read, then one delete and one insert for those that changed"""
+    from .models import MedicineIngredient
+
+    parsed = {medicine.serial_number: parse_composition(medicine.composition) for medicine in medicines}
+    existing = {pk: [] for pk in parsed}
+    for pk, ingredient, strength, unit in MedicineIngredient.objects.filter(
+        medicine__in=list(parsed)
+    ).order_by('pk').values_list('medicine', 'ingredient', 'strength', 'unit'):
+        existing[pk].append((ingredient, strength, unit))
+    changed = [pk for pk, tokens in parsed.items() if existing[pk] != tokens]
+    if not changed:
+        return 0
+    MedicineIngredient.objects.filter(medicine__in=changed).delete()
+    MedicineIngredient.objects.bulk_create([
+        MedicineIngredient(medicine_id=pk, ingredient=ingredient, strength=strength, unit=unit)
+        for pk in changed
+        for ingredient, strength, unit in parsed[pk]
+    ], batch_size=2000)
+    return len(changed)
+
+def medicines_with_ingredients(ingredients, in_stock_only=False, exact=False):
+    """
+    Medicines containing every ingredient in ``ingredients``
+
+    Args:
+        ingredients: ingredient names (normalized here)
+        in_stock_only: only medicines with sellable quantity
+        exact: exclude medicines that contain further ingredients
+
+    Returns:
+        Medicine queryset
+    """
+    from .models import Medicine, MedicineIngredient
+
+    names = {normalize_ingredient(name) for name in ingredients}
+    names.discard('')
+    if not names:
+        return Medicine.objects.none()
+    containing = (
+        MedicineIngredient.objects.filter(ingredient__in=names)
+        .values('medicine')
+        .annotate(matched=Count('ingredient', distinct=True))
+        .filter(matched=len(names))
+        .values('medicine')
+    )
+    medicines = Medicine.objects.filter(serial_number__in=containing)
+    if exact:
+        medicines = medicines.annotate(
+            ingredient_count=Count('ingredients__ingredient', distinct=True)
+        ).filter(ingredient_count=len(names))
+    if in_stock_only:
+        medicines = medicines.filter(quantity__gt=0)
+    return medicines
+
+
+def find_substitutes(medicine, limit=5, in_stock_only=True):
+    """
+    In-stock medicines with the same active ingredients as ``medicine``
+
+    Same strengths rank first, then cheaper.
+    """
+    wanted = {item.ingredient: (item.strength, item.unit) for item in medicine.ingredients.all()}
+    if not wanted:
+        return []
+    same_strength = Q()
+    for ingredient, (strength, unit) in wanted.items():
+        same_strength |= Q(ingredients__ingredient=ingredient, ingredients__strength=strength, ingredients__unit=unit)
+    # Candidates have exactly the wanted ingredients, so more matches means fewer mismatches
+    return list(
+        medicines_with_ingredients(wanted, in_stock_only=in_stock_only, exact=True)
+        .exclude(serial_number=medicine.serial_number)
+        .annotate(same_strengths=Count('ingredients', filter=same_strength, distinct=True))
+        .order_by('-same_strengths', 'price', 'name')[:limit]
+    )
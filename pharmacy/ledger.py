@@ -0,0 +1,224 @@
+"""
+Stock movement ledger.
+
+Every change to a medicine's Unit Qty / Stock Qty is also written as an
+append-only StockMovement (receipt, sale, adjustment, reset, return). The
+``quantity``/``stock_quantity`` columns stay the live balance; the ledger
+gives the history and the balance at any past time.
+
+StockSnapshot rows (``manage.py snapshot_stock``, nightly) hold each
+medicine's balance at ``taken_at`` as computed from the ledger, so a balance
+as of time T is the latest snapshot at or before T plus the movements after
+it - one index lookup and a short range scan on (medicine, created_at) -
+instead of a sum over the whole history.
+
+Snapshots are taken PHARMACY_STOCK_SNAPSHOT_DELAY seconds in the past so that
+movements from transactions still in flight (created_at is set before
+commit) can't fall between a snapshot and its tail.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Medicine, StockMovement, StockSnapshot
+
+# Lower bound for the tail of a medicine that has no snapshot yet
+BEGINNING = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def record(medicine, kind, quantity_change=0, stock_change=0, reference='', user=None):
+    """
+    Write one movement for ``medicine`` (instance or pk)
+
+    Returns:
+        the StockMovement, or None when nothing changed
+    """
+    if not quantity_change and not stock_change:
+        return None
+    return StockMovement.objects.create(
+        medicine_id=getattr(medicine, 'pk', medicine),
+        kind=kind,
+        quantity_change=quantity_change,
+        stock_change=stock_change,
+        reference=reference[:100],
+        user=user if getattr(user, 'is_authenticated', False) else None,
+    )
+
+
+def record_many(movements):
+    """Bulk-insert unsaved StockMovement objects, skipping empty ones"""
+    movements = [m for m in movements if m.quantity_change or m.stock_change]
+    if movements:
+        StockMovement.objects.bulk_create(movements, batch_size=2000)
+    return movements
+
+
+def record_levels(medicine, before, kind, reference='', user=None):
+    """
+    Record the difference between ``before`` and the medicine's current levels
+
+    Args:
+        before: (quantity, stock_quantity) as they were before the change
+    """
+    quantity, stock_quantity = before
+    return record(
+        medicine, kind,
+        quantity_change=(medicine.quantity or 0) - (quantity or 0),
+        stock_change=(medicine.stock_quantity or 0) - (stock_quantity or 0),
+        reference=reference,
+        user=user,
+    )
+
+
+def set_levels(medicine, kind, quantity, stock_quantity, reference='', user=None):
+    """
+    Save new levels on ``medicine`` and record the movement, in one transaction
+
+    ``medicine`` should have been read with select_for_update() in the
+    caller's transaction so the recorded difference matches the row.
+    """
+    before = (medicine.quantity, medicine.stock_quantity)
+    with transaction.atomic():
+        medicine.quantity = quantity
+        medicine.stock_quantity = stock_quantity
+        medicine.save()
+        return record_levels(medicine, before, kind, reference=reference, user=user)
+
+
+def _as_of_queryset(at, medicines=None):
+    """``medicines`` annotated with their latest snapshot by ``at`` and the movement sums after it"""
+    if medicines is None:
+        medicines = Medicine.objects.all()
+    latest = StockSnapshot.objects.filter(medicine=OuterRef('pk'), taken_at__lte=at).order_by('-taken_at', '-id')
+    tail = (
+        StockMovement.objects
+        .filter(medicine=OuterRef('pk'), created_at__gt=OuterRef('snapshot_at'), created_at__lte=at)
+        .order_by()
+        .values('medicine')
+    )
+    return medicines.annotate(
+        snapshot_at=Coalesce(Subquery(latest.values('taken_at')[:1]), Value(BEGINNING, output_field=DateTimeField())),
+        snapshot_quantity=Subquery(latest.values('quantity')[:1]),
+        snapshot_stock_quantity=Subquery(latest.values('stock_quantity')[:1]),
+        tail_quantity=Subquery(tail.annotate(total=Sum('quantity_change')).values('total'), output_field=IntegerField()),
+        tail_stock_quantity=Subquery(tail.annotate(total=Sum('stock_change')).values('total'), output_field=IntegerField()),
+    )
+
+
+LEVEL_COLUMNS = ('snapshot_quantity', 'snapshot_stock_quantity', 'tail_quantity', 'tail_stock_quantity')
+
+
+def _levels(levels):
+    snapshot_quantity, snapshot_stock, tail_quantity, tail_stock = levels
+    return ((snapshot_quantity or 0) + (tail_quantity or 0), (snapshot_stock or 0) + (tail_stock or 0))
+
+
+def iter_stock_as_of(at, medicines=None, fields=('pk',)):
+    """
+    Yield (*fields, quantity, stock_quantity) for ``medicines`` at ``at``
+
+    Medicines with no snapshot or movement by ``at`` are left out.
+    """
+    rows = _as_of_queryset(at, medicines).values_list(*fields, *LEVEL_COLUMNS).iterator(chunk_size=2000)
+    for row in rows:
+        values, levels = row[:len(fields)], row[len(fields):]
+        if all(value is None for value in levels):
+            continue
+        yield (*values, *_levels(levels))
+
+
+def stock_as_of(at, medicine_ids=None):
+    """
+    Ledger balances at ``at`` in one query
+
+    Args:
+        at: aware datetime
+        medicine_ids: limit to these medicine pks (default: all)
+
+    Returns:
+        dict of medicine pk -> (quantity, stock_quantity); medicines with no
+        snapshot or movement by ``at`` are left out
+    """
+    medicines = Medicine.objects.all()
+    if medicine_ids is not None:
+        medicines = medicines.filter(pk__in=medicine_ids)
+    return {pk: (quantity, stock_quantity) for pk, quantity, stock_quantity in iter_stock_as_of(at, medicines)}
+
+
+def balance_as_of(medicine, at):
+    """(quantity, stock_quantity) of one medicine (instance or pk) at ``at``"""
+    pk = getattr(medicine, 'pk', medicine)
+    return stock_as_of(at, [pk]).get(pk, (0, 0))
+
+
+def take_snapshots(at=None):
+    """
+    Write a StockSnapshot at ``at`` for every medicine with movements since its last one
+
+    Balances come from the ledger, not from the Medicine rows, so a snapshot
+    never hides a change that wasn't recorded (see drift()).
+
+    Args:
+        at: snapshot time (default: now - PHARMACY_STOCK_SNAPSHOT_DELAY)
+
+    Returns:
+        number of snapshots written
+    """
+    if at is None:
+        at = timezone.now() - timedelta(seconds=getattr(settings, 'PHARMACY_STOCK_SNAPSHOT_DELAY', 600))
+    movements = StockMovement.objects.filter(created_at__lte=at)
+    # Each run snapshots everything that moved, so only movements since the
+    # previous run can leave a medicine without an up-to-date snapshot
+    since = StockSnapshot.objects.filter(taken_at__lte=at).aggregate(latest=Max('taken_at'))['latest']
+    if since is not None:
+        movements = movements.filter(created_at__gt=since)
+    medicines = Medicine.objects.filter(pk__in=movements.values('medicine'))
+
+    snapshots = [
+        StockSnapshot(medicine_id=pk, taken_at=at, quantity=quantity, stock_quantity=stock_quantity)
+        for pk, quantity, stock_quantity in iter_stock_as_of(at, medicines)
+    ]
+    with transaction.atomic():
+        StockSnapshot.objects.bulk_create(snapshots, batch_size=2000)
+    return len(snapshots)
+
+
+def drift(medicine_ids=None):
+    """
+    Medicines whose live levels differ from the ledger balance
+
+    Returns:
+        list of (pk, name, (quantity, stock_quantity) live, (quantity, stock_quantity) ledger)
+    """
+    medicines = Medicine.objects.order_by('pk')
+    if medicine_ids is not None:
+        medicines = medicines.filter(pk__in=medicine_ids)
+    mismatches = []
+    rows = _as_of_queryset(timezone.now(), medicines).values_list(
+        'pk', 'name', 'quantity', 'stock_quantity', *LEVEL_COLUMNS
+    ).iterator(chunk_size=2000)
+    for pk, name, quantity, stock_quantity, *levels in rows:
+        live = (quantity or 0, stock_quantity or 0)
+        ledger = _levels(levels)
+        if live != ledger:
+            mismatches.append((pk, name, live, ledger))
+    return mismatches
+
+
+def reconcile(mismatches, user=None):
+    """Record an adjustment for each drift() mismatch so the ledger matches the live levels"""
+    return record_many([
+        StockMovement(
+            medicine_id=pk,
+            kind=StockMovement.ADJUSTMENT,
+            quantity_change=live[0] - ledger[0],
+            stock_change=live[1] - ledger[1],
+            reference='reconcile',
+            user=user,
+        )
+        for pk, _, live, ledger in mismatches
+    ])
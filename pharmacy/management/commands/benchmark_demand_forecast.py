@@ -0,0 +1,49 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pharmacy import forecasting
+from pharmacy.benchmarking import make_catalog, temporary_database
+from pharmacy.models import Cart, Medicine
+
+
+class Command(BaseCommand):
+    help = 'Time forecast_demand over a synthetic catalog and sales history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicines', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=730, help='Days of sales history')
+        parser.add_argument('--sales', type=int, default=500000, help='Purchased cart rows')
+
+    def handle(self, *args, **options):
+        from hospital.models import User
+
+        rng = random.Random(42)
+        days = options['days']
+        with temporary_database():
+            Medicine.objects.bulk_create(make_catalog(options['medicines']), batch_size=2000)
+            pks = list(Medicine.objects.values_list('pk', flat=True))
+            # A few fast movers and a long tail, like a real catalog
+            weights = [1 / (rank + 1) for rank in range(len(pks))]
+            user = User.objects.create_user(username='bench-buyer', password='x', is_patient=True)
+
+            start = time.perf_counter()
+            today = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+            per_day = max(options['sales'] // days, 1)
+            for day in range(days):
+                carts = [
+                    Cart(user=user, item_id=pk, quantity=rng.randint(1, 5), purchased=True)
+                    for pk in rng.choices(pks, weights, k=per_day)
+                ]
+                created = Cart.objects.bulk_create(carts, batch_size=2000)
+                # auto_now dates them today; move the day's sales back
+                Cart.objects.filter(pk__in=[cart.pk for cart in created]).update(updated=today - timedelta(days=days - day))
+            self.stdout.write(f"Generated {per_day * days} sales in {time.perf_counter() - start:.1f}s")
+
+            for method in forecasting.METHODS:
+                start = time.perf_counter()
+                written = forecasting.run(method=method, history_days=days)
+                self.stdout.write(f"{method:<4} {written} forecasts from {days} days in {time.perf_counter() - start:6.2f}s")
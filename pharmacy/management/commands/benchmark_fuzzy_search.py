@@ -0,0 +1,73 @@
+import random
+import string
+
+from django.core.management.base import BaseCommand
+
+from pharmacy.benchmarking import temporary_database, make_catalog, measure, summarize
+from pharmacy.fuzzy import FuzzyMedicineMatcher
+from pharmacy.hsn_utils import MEDICINE_HSN_CODES
+from pharmacy.models import Medicine
+
+# Misspellings seen on handwritten prescriptions, with the intended ingredient
+KNOWN_MISSPELLINGS = {
+    'paracetmol': 'paracetamol',
+    'paracitamol': 'paracetamol',
+    'amoxycilin': 'amoxicillin',
+    'amoxicilin': 'amoxicillin',
+    'azithromicin': 'azithromycin',
+    'ibuprofn': 'ibuprofen',
+    'metformine': 'metformin',
+    'cetrizine': 'cetirizine',
+    'omeprazol': 'omeprazole',
+    'pantoprazol': 'pantoprazole',
+    'diclofinac': 'diclofenac',
+    'ciprofloxacine': 'ciprofloxacin',
+}
+
+
+def misspell(word, rng):
+    """Apply one random delete, insert, substitute or transpose to ``word``"""
+    i = rng.randrange(len(word))
+    operation = rng.choice(('delete', 'insert', 'substitute', 'transpose'))
+    if operation == 'delete':
+        return word[:i] + word[i + 1:]
+    if operation == 'insert':
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+    if operation == 'substitute':
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+class Command(BaseCommand):
+    help = 'Measure latency and recall of the fuzzy medicine matcher on a misspelling corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=50000, help='Number of medicines in the synthetic catalog')
+        parser.add_argument('--queries', type=int, default=1000, help='Number of misspelled queries to run')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        rng = random.Random(11)
+        ingredients = [word for word in MEDICINE_HSN_CODES if ' ' not in word and len(word) >= 5]
+        corpus = list(KNOWN_MISSPELLINGS.items())
+        while len(corpus) < options['queries']:
+            intended = rng.choice(ingredients)
+            corpus.append((misspell(intended, rng), intended))
+        corpus = corpus[:options['queries']]
+
+        with temporary_database():
+            Medicine.objects.bulk_create(make_catalog(size), batch_size=2000)
+            matcher = FuzzyMedicineMatcher(ttl=0)
+            build = measure(lambda _: matcher.build(), [None])
+
+            hits = 0
+            for query, intended in corpus:
+                results = matcher.search(query, limit=10)
+                if any(intended in (result['name'] or '').lower() for result in results):
+                    hits += 1
+
+            self.stdout.write(f"Catalog size: {size}, queries: {len(corpus)}")
+            self.stdout.write(f"Index build: {build[0]:.1f}ms")
+            self.stdout.write(f"Recall@10: {hits / len(corpus):.1%}")
+            self.stdout.write(summarize('Fuzzy matcher', measure(lambda q: matcher.search(q[0], limit=10), corpus)))
@@ -0,0 +1,59 @@
+import csv
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from pharmacy.benchmarking import make_catalog, temporary_database
+from pharmacy.importing import import_medicines
+from pharmacy.models import Medicine, MedicineIngredient
+
+HEADER = [
+    'medicine_id', 'name', 'weight', 'quantity', 'price', 'description', 'composition', 'batch_no',
+    'medicine_type', 'medicine_category', 'prescription_required', 'expiry_date',
+]
+
+
+def write_catalog_csv(path, size, invalid_every=0):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADER)
+        for i, medicine in enumerate(make_catalog(size)):
+            quantity = medicine.quantity
+            if invalid_every and i % invalid_every == 0:
+                quantity = 'lots'
+            writer.writerow([
+                medicine.medicine_id, medicine.name, '10 tablets', quantity, medicine.price, medicine.description,
+                medicine.composition, medicine.batch_no, medicine.medicine_type, medicine.medicine_category,
+                'yes' if i % 3 else 'no', medicine.expiry_date.isoformat(),
+            ])
+
+
+class Command(BaseCommand):
+    help = 'Time a cold import and a re-import (all updates) of a synthetic medicine CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Rows in the generated file')
+        parser.add_argument('--invalid-every', type=int, default=1000, help='Make every Nth row invalid (0 = none)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'medicines.csv')
+            write_catalog_csv(path, rows, options['invalid_every'])
+            size_mb = os.path.getsize(path) / 1024 / 1024
+
+            with temporary_database():
+                for label in ('Cold import', 'Re-import'):
+                    start = time.perf_counter()
+                    with open(path, 'rb') as file:
+                        report = import_medicines(file, path)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"{label:<12} {elapsed:7.2f}s  {rows / elapsed:9.0f} rows/s  {report}"
+                    )
+                self.stdout.write(
+                    f"File: {size_mb:.1f} MB, medicines: {Medicine.objects.count()}, "
+                    f"ingredient rows: {MedicineIngredient.objects.count()}"
+                )
@@ -0,0 +1,50 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from pharmacy.benchmarking import temporary_database, make_catalog, measure, summarize
+from pharmacy.models import Medicine
+from pharmacy.search_index import MedicineSearchIndex
+
+
+class Command(BaseCommand):
+    help = 'Compare live-search latency of the in-memory index against the ORM icontains query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=50000, help='Number of medicines in the synthetic catalog')
+        parser.add_argument('--queries', type=int, default=500, help='Number of typeahead queries to run')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        with temporary_database():
+            Medicine.objects.bulk_create(make_catalog(size), batch_size=2000)
+            names = list(Medicine.objects.values_list('name', flat=True)[:2000])
+
+            # Simulate typeahead: every prefix of a random name, plus some mid-word fragments
+            rng = random.Random(7)
+            queries = []
+            while len(queries) < options['queries']:
+                name = rng.choice(names).lower()
+                cut = rng.randint(1, min(len(name), 10))
+                queries.append(name[:cut])
+                start = rng.randint(0, max(0, len(name) - 4))
+                queries.append(name[start:start + 4])
+            queries = queries[:options['queries']]
+
+            def orm_search(query):
+                list(Medicine.objects.filter(
+                    Q(name__icontains=query) |
+                    Q(description__icontains=query) |
+                    Q(medicine_category__icontains=query) |
+                    Q(medicine_type__icontains=query),
+                    quantity__gt=0
+                ).order_by('name')[:10])
+
+            index = MedicineSearchIndex(ttl=0)
+            build = measure(lambda _: index.build(), [None])
+
+            self.stdout.write(f"Catalog size: {size}, queries: {len(queries)}")
+            self.stdout.write(f"Index build: {build[0]:.1f}ms")
+            self.stdout.write(summarize('ORM icontains', measure(orm_search, queries)))
+            self.stdout.write(summarize('In-memory index', measure(lambda q: index.search(q, limit=10), queries)))
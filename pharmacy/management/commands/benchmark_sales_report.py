@@ -0,0 +1,108 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+
+from pharmacy import sales
+from pharmacy.benchmarking import make_catalog, temporary_database
+from pharmacy.models import Cart, Medicine, Order
+from pharmacy.utils import keyset_paginate
+
+
+class Command(BaseCommand):
+    help = 'Time the pharmacist sales report aggregates over a synthetic order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicines', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=1000000, help='Purchased cart rows')
+        parser.add_argument('--days', type=int, default=365, help='Days of order history')
+        parser.add_argument('--pages', type=int, default=200, help='Depth of the deep-page timing')
+        parser.add_argument('--compare', action='store_true', help='Also time the per-order Python loop on the last 30 days')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            start = time.perf_counter()
+            self.generate(options['medicines'], options['lines'], options['days'])
+            self.stdout.write(f"Generated {Cart.objects.count()} lines in {Order.objects.count()} orders "
+                              f"in {time.perf_counter() - start:.1f}s")
+
+            today = timezone.localdate()
+            ranges = [('all', None, None), ('30 days', today - timedelta(days=30), today)]
+            for label, start_date, end_date in ranges:
+                orders = sales.placed_orders(start_date, end_date)
+                self.time(f"{label:<8} summary", lambda: sales.summary(orders))
+                self.time(f"{label:<8} top items", lambda: sales.top_items(orders))
+                listing = orders.select_related('user').annotate(amount=sales.order_subtotal())
+                self.time(f"{label:<8} first page", lambda: keyset_paginate(listing, ('-created', '-id'), page_size=50))
+
+            listing = sales.placed_orders().select_related('user').annotate(amount=sales.order_subtotal())
+            cursor = None
+            for _ in range(options['pages']):
+                _, cursor = keyset_paginate(listing, ('-created', '-id'), cursor=cursor, page_size=50)
+            self.time(f"page {options['pages'] + 1}", lambda: keyset_paginate(listing, ('-created', '-id'), cursor=cursor, page_size=50))
+
+            self.time('rebuild daily rollup', sales.rebuild_rollup)
+            self.time('30 days  rollup totals', lambda: sales.daily_totals(today - timedelta(days=30), today))
+
+            if options['compare']:
+                recent = Order.objects.filter(ordered=True, created__date__gte=today - timedelta(days=30))
+                self.time('30 days  Python loop', lambda: sum(float(o.compute_totals()[0]) for o in recent))
+                self.time('30 days  user_id__in top items', lambda: list(
+                    Cart.objects.filter(purchased=True, user_id__in=list(recent.values_list('user_id', flat=True)))
+                    .values('item__name').annotate(total_qty=Sum('quantity')).order_by('-total_qty')[:10]
+                ))
+
+    def time(self, label, func):
+        start = time.perf_counter()
+        func()
+        self.stdout.write(f"{label:<32} {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    def generate(self, medicine_count, line_count, days):
+        from hospital.models import User
+
+        rng = random.Random(42)
+        Medicine.objects.bulk_create(make_catalog(medicine_count), batch_size=2000)
+        prices = dict(Medicine.objects.values_list('pk', 'price'))
+        pks = list(prices)
+        weights = [1 / (rank + 1) for rank in range(len(pks))]
+        users = User.objects.bulk_create([
+            User(username=f'bench-buyer-{i}', is_patient=True) for i in range(200)
+        ])
+        Through = Order.orderitems.through
+        now = timezone.now()
+        per_day = max(line_count // days, 1)
+
+        for day in range(days):
+            placed = now - timedelta(days=days - day, minutes=rng.randint(0, 600))
+            lines, orders, sizes = [], [], []
+            while len(lines) < per_day:
+                user = rng.choice(users)
+                size = rng.randint(1, 5)
+                order_lines = [
+                    Cart(user=user, item_id=pk, quantity=rng.randint(1, 5), purchased=True, unit_price=prices[pk])
+                    for pk in rng.choices(pks, weights, k=size)
+                ]
+                subtotal = sum(line.quantity * line.unit_price for line in order_lines)
+                gst = (subtotal * Order.GST_RATE).quantize(Decimal('0.01'))
+                order = Order(user=user, ordered=True, payment_status='paid', delivery_method='pickup')
+                # A few orders from before totals were stored
+                if rng.random() < 0.95:
+                    order.subtotal, order.gst_amount = subtotal, gst
+                    order.delivery_fee, order.grand_total = Decimal('0'), subtotal + gst
+                lines.extend(order_lines)
+                orders.append(order)
+                sizes.append(size)
+            Cart.objects.bulk_create(lines, batch_size=2000)
+            Order.objects.bulk_create(orders, batch_size=2000)
+            links, position = [], 0
+            for order, size in zip(orders, sizes):
+                links.extend(Through(order_id=order.pk, cart_id=line.pk) for line in lines[position:position + size])
+                position += size
+            Through.objects.bulk_create(links, batch_size=2000)
+            # auto_now dates them now; move the day's orders back
+            Order.objects.filter(pk__in=[order.pk for order in orders]).update(created=placed)
+            Cart.objects.filter(pk__in=[line.pk for line in lines]).update(updated=placed)
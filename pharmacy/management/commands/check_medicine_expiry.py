@@ -1,8 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.core.mail import send_mail
 from django.conf import settings
-from datetime import date, timedelta
-from pharmacy.models import Medicine
+from datetime import date
+from pharmacy.batches import expiring_batches
 from hospital.models import User
 
 
@@ -10,12 +10,8 @@ class Command(BaseCommand):
     help = 'Check for medicines expiring in 3 months and send notifications to admin'
     
     def handle(self, *args, **options):
-        # Get medicines expiring in the next 90 days
-        expiry_threshold = date.today() + timedelta(days=90)
-        expiring_medicines = Medicine.objects.filter(
-            expiry_date__lte=expiry_threshold,
-            expiry_date__gte=date.today()
-        ).order_by('expiry_date')
+        # Get batches in stock expiring in the next 90 days
+        expiring_medicines = list(expiring_batches(90).filter(expiry_date__gte=date.today()))
         
         if not expiring_medicines:
             self.stdout.write('No medicines expiring in the next 3 months.')
@@ -32,12 +28,12 @@ class Command(BaseCommand):
         # Prepare email content
         message_lines = ['MEDICINE EXPIRY ALERT - 3 MONTH NOTICE', '=' * 50, '']
         
-        for medicine in expiring_medicines:
-            days_left = (medicine.expiry_date - date.today()).days
+        for batch in expiring_medicines:
+            days_left = (batch.expiry_date - date.today()).days
             message_lines.append(
-                f"• {medicine.name} ({medicine.medicine_id}) - "
-                f"Expires: {medicine.expiry_date} ({days_left} days left) - "
-                f"Stock: {medicine.stock_quantity}"
+                f"• {batch.medicine.name} ({batch.medicine.medicine_id}) batch {batch.batch_no or '-'} - "
+                f"Expires: {batch.expiry_date} ({days_left} days left) - "
+                f"Stock: {batch.quantity} units"
             )
         
         message_lines.extend(['', 'Please take necessary action to replace expiring stock.'])
@@ -53,7 +49,7 @@ class Command(BaseCommand):
             )
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Expiry notification sent to {len(admin_emails)} admins for {len(expiring_medicines)} medicines.'
+                    f'Expiry notification sent to {len(admin_emails)} admins for {len(expiring_medicines)} batches.'
                 )
             )
         except Exception as e:
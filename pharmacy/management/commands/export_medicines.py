@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from pharmacy.exporting import FORMATS, MedicineExportError, medicines_for_export, parse_filters, write_export
+
+
+class Command(BaseCommand):
+    help = 'Export the medicine catalog with stock levels as CSV, XLSX or Parquet (e.g. for nightly dumps)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write (default: medicines-YYYYMMDD.<format> in the current directory)')
+        parser.add_argument('--category', help='Only this category (shop tab key or category name)')
+        parser.add_argument('--low-stock', nargs='?', const='true', help='Only medicines below this quantity (default threshold if no number)')
+        parser.add_argument('--expiring-before', help='Only medicines expiring before this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        export_format = options['format']
+        output = options['output'] or f"medicines-{timezone.localdate():%Y%m%d}.{export_format}"
+        # Write next to the target and rename, so a reader never sees half a dump
+        partial = f"{output}.partial"
+        try:
+            medicines = medicines_for_export(**parse_filters(options))
+            with open(partial, 'wb') as file:
+                write_export(medicines, export_format, file)
+            os.replace(partial, output)
+        except MedicineExportError as e:
+            raise CommandError(str(e))
+        except OSError as e:
+            raise CommandError(f"Could not write {output}: {e}")
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.stdout.write(self.style.SUCCESS(f"Exported {medicines.count()} medicines to {output}"))
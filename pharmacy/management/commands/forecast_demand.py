@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pharmacy import forecasting
+
+
+class Command(BaseCommand):
+    help = 'Forecast daily demand per medicine from the sales history and update the reorder table (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=forecasting.METHODS, default='ema',
+                            help='ema: exponential smoothing, ma: moving average')
+        parser.add_argument('--history-days', type=int, help='Days of sales to read (default PHARMACY_FORECAST_HISTORY_DAYS)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        written = forecasting.run(method=options['method'], history_days=options['history_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} medicine forecasts in {time.perf_counter() - start:.2f}s'
+        ))
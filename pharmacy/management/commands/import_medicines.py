@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy.importing import MedicineImportError, import_medicines
+
+
+class Command(BaseCommand):
+    help = 'Import or update medicines from a CSV or .xlsx file (same format as Bulk Medicine Management)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or .xlsx file')
+        parser.add_argument('--errors', help='Write the rejected rows report to this CSV file')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as file:
+                report = import_medicines(file, path, batch_size=options['batch_size'])
+        except (OSError, MedicineImportError) as e:
+            raise CommandError(str(e))
+
+        if options['errors'] and report.errors:
+            with open(options['errors'], 'w', newline='') as output:
+                output.write(report.errors_csv())
+        for error in report.errors[:20]:
+            self.stderr.write(f"row {error.row} {error.column}: {error.message}")
+        if len(report.errors) > 20:
+            self.stderr.write(f"... and {len(report.errors) - 20} more")
+        self.stdout.write(self.style.SUCCESS(f'Imported {path}: {report}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.fulltext import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for the medicine catalog'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {backend.name} index for {count} medicines.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy import reservations
+
+
+class Command(BaseCommand):
+    help = 'Release expired cart stock reservations (run every minute) and fix reserved counters that drifted'
+
+    def handle(self, *args, **options):
+        released = reservations.release_expired()
+        fixed = reservations.recount()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
+        if fixed:
+            self.stdout.write(self.style.WARNING(f'Corrected the reserved count of {fixed} medicines'))
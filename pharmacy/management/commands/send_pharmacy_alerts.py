@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy import alerts
+
+
+class Command(BaseCommand):
+    help = 'Mail admins and pharmacists one digest of the pending low-stock and expiry alerts (run from cron every few minutes)'
+
+    def handle(self, *args, **options):
+        sent = alerts.send_digest()
+        if sent:
+            self.stdout.write(self.style.SUCCESS(f'Sent a digest of {sent} pharmacy alerts'))
+        else:
+            self.stdout.write('No pharmacy alerts sent')
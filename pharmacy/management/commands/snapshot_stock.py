@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from pharmacy import ledger
+
+
+class Command(BaseCommand):
+    help = 'Write stock ledger snapshots (run nightly) and check the ledger against live stock levels'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='Snapshot time, ISO format (default: now minus PHARMACY_STOCK_SNAPSHOT_DELAY)')
+        parser.add_argument('--check', action='store_true', help='List medicines whose live levels differ from the ledger')
+        parser.add_argument('--reconcile', action='store_true', help='Record adjustments so the ledger matches the live levels')
+
+    def handle(self, *args, **options):
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError(f"--at must be a datetime like 2026-10-01T00:00:00+05:30, got {options['at']!r}")
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+
+        if options['check'] or options['reconcile']:
+            mismatches = ledger.drift()
+            for pk, name, live, balance in mismatches[:50]:
+                self.stdout.write(f"#{pk} {name}: live {live[0]}/{live[1]}, ledger {balance[0]}/{balance[1]}")
+            if len(mismatches) > 50:
+                self.stdout.write(f"... and {len(mismatches) - 50} more")
+            if options['reconcile'] and mismatches:
+                ledger.reconcile(mismatches)
+                self.stdout.write(self.style.WARNING(f"Recorded {len(mismatches)} reconciling adjustments"))
+            elif not mismatches:
+                self.stdout.write('Ledger matches live stock levels')
+
+        written = ledger.take_snapshots(at=at)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} stock snapshots'))
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS pharmacy_medicine_fts USING fts5(
+    name, composition, description, medicine_category, medicine_type,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+SQLITE_POPULATE = """
+INSERT INTO pharmacy_medicine_fts (rowid, name, composition, description, medicine_category, medicine_type)
+SELECT serial_number, coalesce(name, ''), coalesce(composition, ''), coalesce(description, ''),
+       coalesce(medicine_category, ''), coalesce(medicine_type, '')
+FROM pharmacy_medicine
+"""
+
+POSTGRES_CREATE = """
+CREATE INDEX IF NOT EXISTS pharmacy_medicine_search_gin ON pharmacy_medicine USING GIN (
+    to_tsvector('simple',
+        coalesce(name, '') || ' ' || coalesce(composition, '') || ' ' || coalesce(description, '') || ' ' ||
+        coalesce(medicine_category, '') || ' ' || coalesce(medicine_type, ''))
+)
+"""
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_POPULATE)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_CREATE)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS pharmacy_medicine_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS pharmacy_medicine_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pharmacy", "0015_medicine_batch_no"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
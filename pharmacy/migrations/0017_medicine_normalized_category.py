@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:58
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of pharmacy.models.normalize_category and its tabs as of this migration
+SHOP_CATEGORY_KEYS = (
+    'fever', 'pain', 'cough', 'cold', 'flu', 'allergy', 'infection', 'stomach',
+    'hypertension', 'diabetes', 'skin', 'vitamins', 'eye', 'respiratory', 'urinary', 'firstaid',
+)
+SHOP_CATEGORY_ALIASES = {
+    'heart': 'hypertension',
+}
+
+
+def normalize_category(raw_category):
+    normalized = re.sub(r'[^a-z0-9]', '', (raw_category or '').lower())
+    if not normalized or normalized in SHOP_CATEGORY_KEYS:
+        return normalized
+    for alias, tab in SHOP_CATEGORY_ALIASES.items():
+        if alias in normalized:
+            return tab
+    for tab in SHOP_CATEGORY_KEYS:
+        if tab in normalized:
+            return tab
+    return normalized
+
+
+def backfill_normalized_category(apps, schema_editor):
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    batch = []
+    for medicine in Medicine.objects.only('serial_number', 'medicine_category').iterator(chunk_size=2000):
+        medicine.normalized_category = normalize_category(medicine.medicine_category)
+        batch.append(medicine)
+        if len(batch) == 2000:
+            Medicine.objects.bulk_update(batch, ['normalized_category'])
+            batch = []
+    Medicine.objects.bulk_update(batch, ['normalized_category'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0016_medicine_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='normalized_category',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Shop tab derived from medicine_category on save', max_length=200),
+        ),
+        migrations.RunPython(backfill_normalized_category, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='medicine',
+            name='expiry_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['name', 'serial_number'], name='medicine_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['normalized_category', 'name', 'serial_number'], name='medicine_category_name_idx'),
+        ),
+    ]
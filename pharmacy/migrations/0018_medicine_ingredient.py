@@ -0,0 +1,99 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:07
+
+import re
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of pharmacy.ingredients.parse_composition as of this migration,
+# so later changes to the parser don't change what the backfill writes
+SPLIT_RE = re.compile(r'\s*(?:\+|,|;|&|\band\b|\bwith\b)\s*')
+STRENGTH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|mcg|µg|gm|g|ml|iu|%|units?)(?![a-z])')
+TRAILING_NUMBER_RE = re.compile(r'\s(\d+(?:\.\d+)?)\s*$')
+PHARMACOPOEIA_RE = re.compile(r'\b(?:ip|bp|usp|i\.p\.|b\.p\.)(?=\s|$)')
+UNIT_ALIASES = {'gm': 'g', 'µg': 'mcg', 'units': 'unit'}
+SALT_SUFFIXES = ('hydrochloride', 'dihydrochloride', 'hcl', 'trihydrate', 'monohydrate', 'dihydrate')
+SYNONYMS = {
+    'amoxycillin': 'amoxicillin',
+    'acetaminophen': 'paracetamol',
+    'cefalexin': 'cephalexin',
+    'salbutamol sulphate': 'salbutamol',
+    'vitamin c': 'ascorbic acid',
+}
+
+
+def normalize_ingredient(name):
+    name = (name or '').lower().replace('(', ' ').replace(')', ' ')
+    name = name.split(' as ')[0]
+    name = PHARMACOPOEIA_RE.sub(' ', name)
+    name = re.sub(r'[^a-z0-9 ]', ' ', name)
+    words = [word for word in name.split() if word not in SALT_SUFFIXES]
+    name = ' '.join(words)
+    return SYNONYMS.get(name, name)
+
+
+def parse_composition(composition):
+    tokens = []
+    seen = set()
+    for part in SPLIT_RE.split((composition or '').lower()):
+        part = part.replace('(', ' ').replace(')', ' ').strip()
+        if not part:
+            continue
+        strength, unit = None, ''
+        match = STRENGTH_RE.search(part)
+        if match:
+            strength, unit, name = match.group(1), match.group(2), part[:match.start()]
+        else:
+            match = TRAILING_NUMBER_RE.search(part)
+            if match:
+                strength, name = match.group(1), part[:match.start()]
+            else:
+                name = part
+        ingredient = normalize_ingredient(name)
+        if not re.search(r'[a-z]', ingredient) or ingredient in seen:
+            continue
+        seen.add(ingredient)
+        try:
+            strength = Decimal(strength) if strength is not None else None
+        except InvalidOperation:
+            strength = None
+        tokens.append((ingredient[:100], strength, UNIT_ALIASES.get(unit, unit)))
+    return tokens
+
+
+def backfill_ingredients(apps, schema_editor):
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    MedicineIngredient = apps.get_model('pharmacy', 'MedicineIngredient')
+    batch = []
+    for serial_number, composition in Medicine.objects.values_list('serial_number', 'composition').iterator(chunk_size=2000):
+        for ingredient, strength, unit in parse_composition(composition):
+            batch.append(MedicineIngredient(medicine_id=serial_number, ingredient=ingredient, strength=strength, unit=unit))
+        if len(batch) >= 2000:
+            MedicineIngredient.objects.bulk_create(batch)
+            batch = []
+    MedicineIngredient.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0017_medicine_normalized_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ingredient', models.CharField(help_text="Normalized ingredient name, e.g. 'amoxicillin'", max_length=100)),
+                ('strength', models.DecimalField(blank=True, decimal_places=3, max_digits=12, null=True)),
+                ('unit', models.CharField(blank=True, default='', max_length=20)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredients', to='pharmacy.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ingredient', 'medicine'], name='medicine_ingredient_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0018_medicine_ingredient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HSNLookup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='SHA-256 of the normalized inputs and dictionary version', max_length=64, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('composition', models.TextField(blank=True, default='')),
+                ('category', models.CharField(blank=True, default='', max_length=200)),
+                ('hsn_code', models.CharField(blank=True, max_length=20, null=True)),
+                ('source', models.CharField(max_length=20)),
+                ('confidence', models.CharField(max_length=20)),
+                ('suggestions', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
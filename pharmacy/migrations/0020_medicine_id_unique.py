@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:15
+
+from django.db import migrations, models
+
+
+def deduplicate_medicine_ids(apps, schema_editor):
+    """Blank ids become NULL; repeated ids get a -2, -3, ... suffix so the unique index can be built"""
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    Medicine.objects.filter(medicine_id='').update(medicine_id=None)
+    seen = set(Medicine.objects.exclude(medicine_id=None).values_list('medicine_id', flat=True).distinct())
+    duplicates = (
+        Medicine.objects.exclude(medicine_id=None)
+        .values('medicine_id')
+        .annotate(count=models.Count('serial_number'))
+        .filter(count__gt=1)
+        .values_list('medicine_id', flat=True)
+    )
+    for medicine_id in list(duplicates):
+        rows = Medicine.objects.filter(medicine_id=medicine_id).order_by('serial_number')
+        for medicine in rows[1:]:
+            suffix = 2
+            while f"{medicine_id}-{suffix}" in seen:
+                suffix += 1
+            medicine.medicine_id = f"{medicine_id}-{suffix}"
+            seen.add(medicine.medicine_id)
+            medicine.save(update_fields=['medicine_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0019_hsn_lookup'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_medicine_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='medicine',
+            name='medicine_id',
+            field=models.CharField(blank=True, help_text='SKU code; bulk imports upsert on it', max_length=200, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_snapshots(apps, schema_editor):
+    """The ledger starts from each medicine's current levels"""
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    StockSnapshot = apps.get_model('pharmacy', 'StockSnapshot')
+    now = django.utils.timezone.now()
+    snapshots = [
+        StockSnapshot(medicine_id=pk, taken_at=now, quantity=quantity or 0, stock_quantity=stock_quantity or 0)
+        for pk, quantity, stock_quantity in Medicine.objects.values_list('serial_number', 'quantity', 'stock_quantity').iterator()
+    ]
+    StockSnapshot.objects.bulk_create(snapshots, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0020_medicine_id_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('adjustment', 'Adjustment'), ('reset', 'Stock unit opened'), ('return', 'Return')], max_length=20)),
+                ('quantity_change', models.IntegerField(default=0, help_text='Change in Unit Qty')),
+                ('stock_change', models.IntegerField(default=0, help_text='Change in Stock Qty')),
+                ('reference', models.CharField(blank=True, default='', help_text="What caused it, e.g. 'order:42' or 'import'", max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='pharmacy.medicine')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medicine', 'created_at'], name='stock_movement_medicine_idx'), models.Index(fields=['created_at'], name='stock_movement_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('stock_quantity', models.IntegerField()),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='pharmacy.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medicine', 'taken_at'], name='stock_snapshot_medicine_idx')],
+            },
+        ),
+        migrations.RunPython(opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def opening_batches(apps, schema_editor):
+    """One batch per medicine from its current batch_no, expiry_date and Unit Qty"""
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    MedicineBatch = apps.get_model('pharmacy', 'MedicineBatch')
+    batches = [
+        MedicineBatch(medicine_id=pk, batch_no=batch_no or '', expiry_date=expiry_date, quantity=max(quantity or 0, 0))
+        for pk, batch_no, expiry_date, quantity in Medicine.objects.values_list(
+            'serial_number', 'batch_no', 'expiry_date', 'quantity'
+        ).iterator()
+    ]
+    MedicineBatch.objects.bulk_create(batches, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0021_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_no', models.CharField(blank=True, default='', help_text='Manufacturing batch number', max_length=100)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.IntegerField(default=0, help_text='Units of this batch on hand')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='pharmacy.medicine')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BatchAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_allocations', to='pharmacy.order')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='pharmacy.medicinebatch')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(fields=['medicine', 'expiry_date'], name='medicine_batch_fefo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(fields=['expiry_date'], name='medicine_batch_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='medicinebatch',
+            constraint=models.UniqueConstraint(fields=('medicine', 'batch_no'), name='unique_medicine_batch'),
+        ),
+        migrations.RunPython(opening_batches, migrations.RunPython.noop),
+    ]
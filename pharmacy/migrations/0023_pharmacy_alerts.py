@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0022_medicine_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PharmacyAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low_stock', 'Low stock'), ('expiring', 'Expiring soon')], max_length=20)),
+                ('quantity', models.IntegerField(blank=True, help_text='Unit Qty when the alert was raised', null=True)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='pharmacy.medicinebatch')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='pharmacy.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sent_at', 'created_at'], name='pharmacy_alert_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('batch', 'kind', 'expiry_date'), name='unique_batch_alert')],
+            },
+        ),
+    ]
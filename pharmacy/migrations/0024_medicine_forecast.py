@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0023_pharmacy_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineForecast',
+            fields=[
+                ('medicine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='pharmacy.medicine')),
+                ('daily_demand', models.FloatField(default=0, help_text='Forecast units sold per day')),
+                ('demand_std', models.FloatField(default=0, help_text='Standard deviation of units sold per day')),
+                ('reorder_point', models.IntegerField(default=0, help_text='Reorder when Unit Qty falls to this level')),
+                ('order_up_to', models.IntegerField(default=0, help_text='Unit Qty an order should bring stock up to')),
+                ('suggested_order', models.IntegerField(default=0, help_text='Units to order, as of computed_at')),
+                ('days_of_stock', models.FloatField(blank=True, help_text='Days the Unit Qty lasts at the forecast demand, as of computed_at', null=True)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['days_of_stock'], name='medicine_forecast_cover_idx')],
+            },
+        ),
+    ]
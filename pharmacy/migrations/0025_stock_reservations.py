@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0024_medicine_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='reserved_quantity',
+            field=models.IntegerField(default=0, editable=False, help_text="Units held by patients' carts (see pharmacy.reservations)"),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('cart', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='pharmacy.cart')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='pharmacy.medicine')),
+            ],
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:30
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+
+
+def freeze_placed_orders(apps, schema_editor):
+    """Snapshot line prices and totals of the orders already placed, at today's prices (same as Order.freeze_totals)"""
+    Cart = apps.get_model('pharmacy', 'Cart')
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    Order = apps.get_model('pharmacy', 'Order')
+    Cart.objects.filter(order__ordered=True, unit_price__isnull=True).update(
+        unit_price=Subquery(Medicine.objects.filter(pk=OuterRef('item_id')).values('price')[:1])
+    )
+    subtotals = dict(
+        Cart.objects.filter(order__ordered=True).order_by().values('order')
+        .annotate(total=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=12, decimal_places=2))))
+        .values_list('order', 'total')
+    )
+    cent = Decimal('0.01')
+    orders = list(Order.objects.filter(ordered=True, grand_total__isnull=True).only('pk', 'delivery_method'))
+    for order in orders:
+        subtotal = Decimal(subtotals.get(order.pk) or 0).quantize(cent)
+        gst = (subtotal * Decimal('0.05')).quantize(cent)
+        placed = subtotal + gst > 0
+        order.subtotal, order.gst_amount = subtotal, gst
+        order.delivery_fee = Decimal('40') if placed and order.delivery_method == 'delivery' else Decimal('0')
+        order.grand_total = subtotal + gst + order.delivery_fee if placed else Decimal('0')
+    Order.objects.bulk_update(orders, ['subtotal', 'gst_amount', 'delivery_fee', 'grand_total'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0025_stock_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Medicine price when the order was placed', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_fee',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='grand_total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='gst_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(freeze_placed_orders, migrations.RunPython.noop),
+    ]
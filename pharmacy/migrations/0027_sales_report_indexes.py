@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0026_order_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('purchased', True)), fields=['updated'], name='cart_purchased_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', True)), fields=['created', 'id'], name='order_placed_created_idx'),
+        ),
+    ]
@@ -1,9 +1,30 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
 from django.conf import settings
+from django.utils import timezone
+import re
 import uuid
 from hospital.models import User, Patient
 
 
+class QuerysetManagedFieldsMixin:
+    """
+    Leaves ``queryset_managed_fields`` out of the UPDATE of a plain save()
+
+    Those columns only move through conditional queryset updates, so an
+    instance loaded before one of them changed mustn't write its old value
+    back. Inserts, and saves given update_fields, write columns as usual.
+    """
+    queryset_managed_fields = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None and not self._state.adding:
+            values = [value for value in values if value[0].name not in self.queryset_managed_fields]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+
 class Pharmacist(models.Model):
     pharmacist_id = models.AutoField(primary_key=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='pharmacist')
@@ -23,7 +44,50 @@ class Pharmacist(models.Model):
         return f"Pharmacist #{self.pharmacist_id}"
 
 
-class Medicine(models.Model):
+# Category tabs on the pharmacy shop page, in display order
+SHOP_CATEGORY_TABS = (
+    ('fever', 'Fever'),
+    ('pain', 'Pain'),
+    ('cough', 'Cough'),
+    ('cold', 'Cold'),
+    ('flu', 'Flu'),
+    ('allergy', 'Allergy'),
+    ('infection', 'Infection'),
+    ('stomach', 'Stomach'),
+    ('hypertension', 'Heart'),
+    ('diabetes', 'Diabetes'),
+    ('skin', 'Skin'),
+    ('vitamins', 'Vitamins'),
+    ('eye', 'Eye/Ear/Nose'),
+    ('respiratory', 'Respiratory'),
+    ('urinary', 'Urinary'),
+    ('firstaid', 'First Aid'),
+)
+SHOP_CATEGORY_KEYS = tuple(key for key, _ in SHOP_CATEGORY_TABS)
+SHOP_CATEGORY_ALIASES = {
+    'heart': 'hypertension',
+}
+
+
+def normalize_category(raw_category):
+    """Map a free-text medicine category onto the shop tab it belongs to"""
+    normalized = re.sub(r'[^a-z0-9]', '', (raw_category or '').lower())
+    if not normalized or normalized in SHOP_CATEGORY_KEYS:
+        return normalized
+    for alias, tab in SHOP_CATEGORY_ALIASES.items():
+        if alias in normalized:
+            return tab
+    for tab in SHOP_CATEGORY_KEYS:
+        if tab in normalized:
+            return tab
+    return normalized
+
+
+class Medicine(QuerysetManagedFieldsMixin, models.Model):
+    EXPIRY_WARNING_DAYS = 90
+    # Moved by pharmacy.reservations
+    queryset_managed_fields = ('reserved_quantity',)
+
     MEDICINE_TYPE = (
         ('tablets', 'tablets'),
         ('syrup', 'syrup'),
@@ -55,7 +119,7 @@ class Medicine(models.Model):
     )
 
     serial_number = models.AutoField(primary_key=True)
-    medicine_id = models.CharField(max_length=200, null=True, blank=True)
+    medicine_id = models.CharField(max_length=200, unique=True, null=True, blank=True, help_text="SKU code; bulk imports upsert on it")
     name = models.CharField(max_length=200, null=True, blank=True)
     composition = models.TextField(null=True, blank=True, help_text="Active ingredients and their quantities")
     hsn_code = models.CharField(max_length=20, null=True, blank=True, help_text="HSN code for tax classification")
@@ -66,9 +130,11 @@ class Medicine(models.Model):
     description = models.TextField(null=True, blank=True)
     medicine_type = models.CharField(max_length=200, choices=MEDICINE_TYPE, null=True, blank=True)
     medicine_category = models.CharField(max_length=200, choices=MEDICINE_CATEGORY, null=True, blank=True)
+    normalized_category = models.CharField(max_length=200, blank=True, default='', editable=False, help_text="Shop tab derived from medicine_category on save")
 
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, default=0.00)
     stock_quantity = models.IntegerField(null=True, blank=True, default=0)
+    reserved_quantity = models.IntegerField(default=0, editable=False, help_text="Units held by patients' carts (see pharmacy.reservations)")
 
     def get_medicine_image(self):
         """Get the appropriate image for the medicine (uploaded or default based on type)"""
@@ -106,16 +172,41 @@ class Medicine(models.Model):
             medicine_type = medicine_type.lower()
         return type_images.get(medicine_type, type_images['general'])
     Prescription_reqiuired = models.CharField(max_length=200, choices=REQUIREMENT_TYPE, null=True, blank=True)
-    expiry_date = models.DateField(null=True, blank=True)
+    expiry_date = models.DateField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'serial_number'], name='medicine_name_idx'),
+            models.Index(fields=['normalized_category', 'name', 'serial_number'], name='medicine_category_name_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Unit Qty as loaded, so a save can tell whether it crossed the low-stock threshold
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.normalized_category = normalize_category(self.medicine_category)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'medicine_category' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_category'}
+        super().save(*args, **kwargs)
 
     @property
     def is_expiring_soon(self):
         from datetime import date, timedelta
         if self.expiry_date:
             # Notify 3 months (90 days) before expiry
-            return self.expiry_date <= date.today() + timedelta(days=90)
+            return self.expiry_date <= date.today() + timedelta(days=self.EXPIRY_WARNING_DAYS)
         return False
 
+    @property
+    def available_quantity(self):
+        """Unit Qty not held by carts"""
+        return max((self.quantity or 0) - (self.reserved_quantity or 0), 0)
+
     @property
     def days_until_expiry(self):
         from datetime import date
@@ -132,6 +223,182 @@ class Medicine(models.Model):
             return f"Medicine #{self.serial_number}"
 
 
+class MedicineBatch(models.Model):
+    """
+    One received batch of a medicine, with its own expiry and units on hand
+
+    Sales take units first-expiry-first-out (see pharmacy.batches); the
+    Medicine's batch_no / expiry_date mirror its earliest-expiring batch in stock.
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='batches')
+    batch_no = models.CharField(max_length=100, blank=True, default='', help_text="Manufacturing batch number")
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.IntegerField(default=0, help_text="Units of this batch on hand")
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'batch_no'], name='unique_medicine_batch'),
+        ]
+        indexes = [
+            models.Index(fields=['medicine', 'expiry_date'], name='medicine_batch_fefo_idx'),
+            models.Index(fields=['expiry_date'], name='medicine_batch_expiry_idx'),
+        ]
+
+    @property
+    def is_expired(self):
+        return self.expiry_date is not None and self.expiry_date < timezone.localdate()
+
+    def __str__(self):
+        return f"{self.medicine_id} batch {self.batch_no or '-'} (exp {self.expiry_date or '-'}): {self.quantity}"
+
+
+class MedicineIngredient(models.Model):
+    """Active ingredient parsed from Medicine.composition (see pharmacy.ingredients)"""
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='ingredients')
+    ingredient = models.CharField(max_length=100, help_text="Normalized ingredient name, e.g. 'amoxicillin'")
+    strength = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True)
+    unit = models.CharField(max_length=20, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ingredient', 'medicine'], name='medicine_ingredient_idx'),
+        ]
+
+    def __str__(self):
+        strength = f" {self.strength.normalize():f}{self.unit}" if self.strength is not None else ''
+        return f"{self.ingredient}{strength}"
+
+
+class HSNLookup(models.Model):
+    """Persisted auto_fetch_hsn_code result (second tier of pharmacy.hsn_cache)"""
+    key = models.CharField(max_length=64, unique=True, help_text="SHA-256 of the normalized inputs and dictionary version")
+    name = models.CharField(max_length=200)
+    composition = models.TextField(blank=True, default='')
+    category = models.CharField(max_length=200, blank=True, default='')
+    hsn_code = models.CharField(max_length=20, null=True, blank=True)
+    source = models.CharField(max_length=20)
+    confidence = models.CharField(max_length=20)
+    suggestions = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.name} -> {self.hsn_code} ({self.source})"
+
+
+
+class StockMovement(models.Model):
+    """
+    Append-only record of one change to a medicine's Unit Qty / Stock Qty
+    (see pharmacy.ledger). Rows are never updated or deleted.
+    """
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    ADJUSTMENT = 'adjustment'
+    RESET = 'reset'
+    RETURN = 'return'
+    KIND_CHOICES = (
+        (RECEIPT, 'Receipt'),
+        (SALE, 'Sale'),
+        (ADJUSTMENT, 'Adjustment'),
+        (RESET, 'Stock unit opened'),
+        (RETURN, 'Return'),
+    )
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity_change = models.IntegerField(default=0, help_text="Change in Unit Qty")
+    stock_change = models.IntegerField(default=0, help_text="Change in Stock Qty")
+    reference = models.CharField(max_length=100, blank=True, default='', help_text="What caused it, e.g. 'order:42' or 'import'")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medicine', 'created_at'], name='stock_movement_medicine_idx'),
+            models.Index(fields=['created_at'], name='stock_movement_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Stock movements are append-only")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.medicine_id}: {self.quantity_change:+d} units, {self.stock_change:+d} stock"
+
+
+class StockSnapshot(models.Model):
+    """Ledger balance of one medicine, covering its movements up to ``taken_at``"""
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='stock_snapshots')
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+    stock_quantity = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medicine', 'taken_at'], name='stock_snapshot_medicine_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id} @ {self.taken_at:%Y-%m-%d %H:%M}: {self.quantity} units, {self.stock_quantity} stock"
+
+class PharmacyAlert(models.Model):
+    """
+    A queued stock or expiry alert, mailed in the next digest (see pharmacy.alerts)
+    """
+    LOW_STOCK = 'low_stock'
+    EXPIRING = 'expiring'
+    KIND_CHOICES = (
+        (LOW_STOCK, 'Low stock'),
+        (EXPIRING, 'Expiring soon'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='alerts')
+    batch = models.ForeignKey(MedicineBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='alerts')
+    quantity = models.IntegerField(null=True, blank=True, help_text="Unit Qty when the alert was raised")
+    expiry_date = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # An expiring batch is reported once per expiry date
+            models.UniqueConstraint(fields=['batch', 'kind', 'expiry_date'], name='unique_batch_alert'),
+        ]
+        indexes = [
+            models.Index(fields=['sent_at', 'created_at'], name='pharmacy_alert_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.medicine_id} ({'sent' if self.sent_at else 'pending'})"
+
+
+class MedicineForecast(models.Model):
+    """
+    Forecast daily demand and reorder levels of one medicine, written by
+    ``manage.py forecast_demand`` (see pharmacy.forecasting)
+    """
+    medicine = models.OneToOneField(Medicine, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    daily_demand = models.FloatField(default=0, help_text="Forecast units sold per day")
+    demand_std = models.FloatField(default=0, help_text="Standard deviation of units sold per day")
+    reorder_point = models.IntegerField(default=0, help_text="Reorder when Unit Qty falls to this level")
+    order_up_to = models.IntegerField(default=0, help_text="Unit Qty an order should bring stock up to")
+    suggested_order = models.IntegerField(default=0, help_text="Units to order, as of computed_at")
+    days_of_stock = models.FloatField(null=True, blank=True, help_text="Days the Unit Qty lasts at the forecast demand, as of computed_at")
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['days_of_stock'], name='medicine_forecast_cover_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id}: {self.daily_demand:.2f}/day, reorder at {self.reorder_point}"
+
+
 class Cart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart')
     item = models.ForeignKey(Medicine, on_delete=models.CASCADE)
@@ -139,16 +406,47 @@ class Cart(models.Model):
     purchased = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Medicine price when the order was placed")
+
+    class Meta:
+        indexes = [
+            # Sales history by date (forecasting, purchase history); partial like Order's
+            models.Index(fields=['updated'], condition=models.Q(purchased=True), name='cart_purchased_updated_idx'),
+        ]
 
     def __str__(self):
         return f'{self.quantity} X {self.item}'
 
+    # Price per unit: the one paid once the order is placed, else the current one
+    def get_unit_price(self):
+        price = self.unit_price if self.unit_price is not None else self.item.price
+        return price or 0
+
     # Each product total
     def get_total(self):
-        return self.item.price * self.quantity
+        return self.get_unit_price() * self.quantity
 
 
-class Order(models.Model):
+class StockReservation(models.Model):
+    """
+    Units of a medicine held for a cart line until ``expires_at``
+
+    Medicine.reserved_quantity is the running total of these rows; both are
+    only changed together by pharmacy.reservations.
+    """
+    cart = models.OneToOneField(Cart, on_delete=models.CASCADE, related_name='reservation')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.medicine_id} for cart {self.cart_id} until {self.expires_at:%Y-%m-%d %H:%M}"
+
+
+class Order(QuerysetManagedFieldsMixin, models.Model):
+    # Moved by the sales rollup (pharmacy.sales)
+    queryset_managed_fields = ('in_sales_rollup',)
+
     DELIVERY_CHOICES = (
         ('pickup', 'Pickup at Pharmacy'),
         ('delivery', 'Home Delivery'),
@@ -186,12 +484,72 @@ class Order(models.Model):
     payment_session_id = models.CharField(max_length=255, blank=True, null=True)  # PayMongo source ID
     payment_id = models.CharField(max_length=255, blank=True, null=True)  # PayMongo payment ID
 
+    # Totals, frozen by freeze_totals() when the order is placed; NULL while it's a cart
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    gst_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    grand_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    # Counted in DailyPharmacySales (placed and not cancelled since)
+    in_sales_rollup = models.BooleanField(default=False, editable=False)
+
+    GST_RATE = Decimal('0.05')
+    DELIVERY_FEE = Decimal('40')
+
+    class Meta:
+        indexes = [
+            # Placed orders by date. Partial because SQLite can't seek on a bare
+            # boolean term (Django renders ordered=True as WHERE "ordered")
+            models.Index(fields=['created', 'id'], condition=models.Q(ordered=True), name='order_placed_created_idx'),
+        ]
+
+    @property
+    def totals_frozen(self):
+        return self.grand_total is not None
+
+    def compute_totals(self):
+        """
+        (subtotal, GST, delivery fee, grand total) as Decimals, from one
+        aggregate over the lines (snapshotted prices where set)
+        """
+        from django.db.models.functions import Coalesce
+
+        price = Coalesce('unit_price', 'item__price', Value(Decimal('0')), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+        subtotal = self.orderitems.aggregate(
+            total=Sum(ExpressionWrapper(F('quantity') * price, output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+        )['total'] or Decimal('0')
+        subtotal = Decimal(subtotal).quantize(Decimal('0.01'))
+        gst = (subtotal * self.GST_RATE).quantize(Decimal('0.01'))
+        # Same rules as before: nothing to pay, nothing to deliver
+        delivery_fee = self.DELIVERY_FEE if subtotal + gst > 0 and self.delivery_method == 'delivery' else Decimal('0')
+        grand_total = subtotal + gst + delivery_fee if subtotal + gst > 0 else Decimal('0')
+        return subtotal, gst, delivery_fee, grand_total
+
+    def freeze_totals(self):
+        """
+        Snapshot each line's unit price and store the order's totals (call when the order is placed)
+
+        Later price changes don't change what the order cost. The order is
+        also counted in the daily sales rollup.
+        """
+        from .sales import record_order
+
+        unit_price = Subquery(Medicine.objects.filter(pk=OuterRef('item_id')).values('price')[:1])
+        Cart.objects.filter(pk__in=self.orderitems.values('pk'), unit_price__isnull=True).update(unit_price=unit_price)
+        self.subtotal, self.gst_amount, self.delivery_fee, self.grand_total = self.compute_totals()
+        if self.pk:
+            Order.objects.filter(pk=self.pk).update(
+                subtotal=self.subtotal, gst_amount=self.gst_amount, delivery_fee=self.delivery_fee, grand_total=self.grand_total,
+            )
+            record_order(self)
+
+    def _totals(self):
+        if self.totals_frozen:
+            return self.subtotal, self.gst_amount, self.delivery_fee, self.grand_total
+        return self.compute_totals()
+
     # Subtotal
     def get_totals(self):
-        total = 0
-        for order_item in self.orderitems.all():
-            total += float(order_item.get_total())
-        return total
+        return float(self._totals()[0])
 
     # Count Cart Items
     def count_cart_items(self):
@@ -199,73 +557,92 @@ class Order(models.Model):
 
     # Stock Calculation
     def stock_quantity_decrease(self):
-        """Decrease unit quantity for all items in this order with reset logic"""
-        from .utils import check_and_reset_medicine_quantity
-        
-        for order_item in self.orderitems.all():
-            medicine = order_item.item
-            required_quantity = order_item.quantity
-            
-            # Check current availability
-            if medicine.quantity < required_quantity:
-                # Try to reset if quantity is 0
-                was_reset, new_quantity, new_stock = check_and_reset_medicine_quantity(medicine)
-                
-                # If still insufficient after reset, raise error
-                if new_quantity < required_quantity:
-                    raise ValueError(
-                        f"Insufficient stock for {medicine.name}. "
-                        f"Available: {new_quantity}, Required: {required_quantity}"
-                    )
-            
-            # Now we have sufficient quantity, proceed with deduction
-            medicine.quantity -= required_quantity
-            # Keep stock_quantity in sync as a total available snapshot
-            if medicine.stock_quantity is not None:
-                medicine.stock_quantity = max(0, (medicine.stock_quantity or 0) - required_quantity)
-            medicine.save()
-            
-            # Check if we need another reset after deduction
-            if medicine.quantity <= 0:
-                check_and_reset_medicine_quantity(medicine)
-    
+        """
+        Take every item of this order out of stock in one transaction
+
+        Raises:
+            InsufficientStock (a ValueError) listing every short item; nothing is deducted then
+        """
+        from .utils import decrement_stock
+
+        return decrement_stock(
+            self.orderitems.values_list('item', 'quantity'), reference=f"order:{self.id}", user=self.user_id, order=self
+        )
+
+    def stock_quantity_restore(self, user=None):
+        """Put every item of this order back into stock (cancellation), recorded as returns, and take it out of the daily sales"""
+        from django.db import transaction
+        from .sales import unrecord_order
+        from .utils import restore_stock
+
+        with transaction.atomic():
+            unrecord_order(self)
+            return restore_stock(
+                self.orderitems.values_list('item', 'quantity'), reference=f"order:{self.id}", user=user, order=self
+            )
+
     def check_stock_availability(self):
         """Check if all items in the order have sufficient unit quantity with reset consideration"""
-        from .utils import check_and_reset_medicine_quantity
-        
-        for order_item in self.orderitems.all():
-            medicine = order_item.item
-            required_quantity = order_item.quantity
-            
-            # Check current availability
-            if medicine.quantity < required_quantity:
-                # Try to reset if quantity is 0
-                was_reset, new_quantity, new_stock = check_and_reset_medicine_quantity(medicine)
-                
-                # Check if we have enough after potential reset
-                if new_quantity < required_quantity:
-                    return False, medicine.name
-        
+        from .reservations import held_by
+        from .utils import stock_shortfalls
+
+        shortfalls = stock_shortfalls(self.orderitems.values_list('item', 'quantity'), held_by(self))
+        if shortfalls:
+            return False, shortfalls[0].name
         return True, None
 
     # GST amount (5%)
     def get_gst_amount(self):
-        subtotal = self.get_totals()
-        return subtotal * 0.05 if subtotal > 0 else 0
+        return float(self._totals()[1])
     
     # Cart total (subtotal + GST, without delivery)
     def get_cart_total(self):
-        subtotal = self.get_totals()
-        gst = self.get_gst_amount()
-        return subtotal + gst
+        subtotal, gst, _, _ = self._totals()
+        return float(subtotal + gst)
+
+    def get_delivery_fee(self):
+        return float(self._totals()[2])
     
     # Final Bill with delivery and GST
     def final_bill(self):
-        cart_total = self.get_cart_total()
-        if cart_total > 0:
-            delivery_fee = 40 if self.delivery_method == 'delivery' else 0
-            return cart_total + delivery_fee
-        return 0
+        return float(self._totals()[3])
+
+
+class DailyPharmacySales(models.Model):
+    """
+    Pharmacy sales of one local day, per medicine category
+
+    The ALL_CATEGORIES row holds the day's totals (an order with medicines of
+    several categories counts once there, and once in each category's row).
+    Kept up to date as orders are placed and cancelled (see pharmacy.sales);
+    ``manage.py rebuild_daily_sales`` recomputes it from the orders.
+    """
+    ALL_CATEGORIES = '_all'
+
+    date = models.DateField()
+    category = models.CharField(max_length=100, blank=True, default='', help_text="Normalized medicine category")
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Subtotal before GST")
+    gst = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_daily_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.category or 'uncategorized'}: {self.orders} orders, {self.revenue}"
+
+
+class BatchAllocation(models.Model):
+    """Units of an order taken from one batch, for batch numbers on the invoice and returns"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='batch_allocations')
+    batch = models.ForeignKey(MedicineBatch, on_delete=models.CASCADE, related_name='allocations')
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.quantity} from {self.batch}"
 
 
 class PrescriptionUpload(models.Model):
@@ -0,0 +1,148 @@
+"""
+Sections of the pharmacist order board and purchase history, paginated.
+
+Each section is a filter, a keyset ordering ending in the primary key, and
+the partial template one row is rendered with. Pages are read with
+keyset_paginate, so a page costs the same however long the history is: the
+page views render the first page of every section and the rest is loaded
+over JSON (``pharmacist_order_board_section``) as the pharmacist scrolls.
+
+Section counts come from one aggregate per model and are cached for
+PHARMACY_ORDER_BOARD_COUNTS_TTL seconds; saving an order, cart or
+prescription upload drops them (see pharmacy.signals).
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
+
+from .models import Cart, Order, PrescriptionUpload
+from .utils import keyset_paginate
+
+COUNTS_CACHE_KEY = 'pharmacy:order-board-counts'
+
+# Orders that no longer need the pharmacist
+DONE_STATUSES = ['delivered', 'completed', 'cancelled']
+COD_STATUSES = ['cod', 'cash_on_delivery', 'cod_pending']
+SETTLED_STATUSES = ['paid', 'cod', 'cash_on_delivery']
+
+Section = namedtuple('Section', ['model', 'condition', 'ordering', 'template', 'name', 'extra'])
+
+ORDER_CARD = 'hospital_admin/partials/order_card.html'
+PRESCRIPTION_CARD = 'hospital_admin/partials/prescription_card.html'
+
+SECTIONS = {
+    # Order management board
+    'online': Section(
+        Order, Q(ordered=True, payment_status='paid') & ~Q(order_status__in=DONE_STATUSES),
+        ('-created', '-id'), ORDER_CARD, 'order', {'payment_type': 'online'},
+    ),
+    'cod': Section(
+        Order, Q(ordered=True, payment_status__in=COD_STATUSES) & ~Q(order_status__in=DONE_STATUSES),
+        ('-created', '-id'), ORDER_CARD, 'order', {'payment_type': 'cod'},
+    ),
+    'failed': Section(
+        Order, Q(ordered=False, payment_status__in=['failed', 'pending']),
+        ('-created', '-id'), ORDER_CARD, 'order', {'payment_type': 'failed'},
+    ),
+    'ready': Section(
+        Order, Q(ordered=True, order_status='ready', payment_status__in=SETTLED_STATUSES),
+        ('created', 'id'), ORDER_CARD, 'order', {'payment_type': 'pickup'},
+    ),
+    'delivery': Section(
+        Order, Q(ordered=True, order_status='out_for_delivery', delivery_method='delivery'),
+        ('created', 'id'), ORDER_CARD, 'order', {'payment_type': 'delivery'},
+    ),
+    'pending_prescriptions': Section(
+        PrescriptionUpload, Q(status='pending'),
+        ('-uploaded_at', '-upload_id'), PRESCRIPTION_CARD, 'prescription', {'section': 'pending'},
+    ),
+    'approved_prescriptions': Section(
+        PrescriptionUpload, Q(status='approved', related_order__isnull=True),
+        ('-reviewed_at', '-upload_id'), PRESCRIPTION_CARD, 'prescription', {'section': 'approved'},
+    ),
+    'paid_pending_prescriptions': Section(
+        PrescriptionUpload, Q(status='paid_pending'),
+        ('-updated_at', '-upload_id'), PRESCRIPTION_CARD, 'prescription', {'section': 'paid_pending'},
+    ),
+    'fulfilled_prescriptions': Section(
+        PrescriptionUpload, Q(status='fulfilled'),
+        ('-updated_at', '-upload_id'), PRESCRIPTION_CARD, 'prescription', {'section': 'fulfilled'},
+    ),
+    'rejected_prescriptions': Section(
+        PrescriptionUpload, Q(status='rejected'),
+        ('-reviewed_at', '-upload_id'), PRESCRIPTION_CARD, 'prescription', {'section': 'rejected'},
+    ),
+    # Purchase history
+    'completed_orders': Section(
+        Order, Q(ordered=True, payment_status__in=SETTLED_STATUSES),
+        ('-created', '-id'), 'hospital_admin/partials/purchase_order_row.html', 'order', {},
+    ),
+    'purchased_items': Section(
+        Cart, Q(purchased=True),
+        ('-updated', '-id'), 'hospital_admin/partials/purchase_item_row.html', 'c', {},
+    ),
+}
+
+BOARD_SECTIONS = [
+    'online', 'cod', 'failed', 'ready', 'delivery', 'pending_prescriptions', 'approved_prescriptions',
+    'paid_pending_prescriptions', 'fulfilled_prescriptions', 'rejected_prescriptions',
+]
+HISTORY_SECTIONS = ['completed_orders', 'purchased_items']
+
+
+def page_size():
+    return getattr(settings, 'PHARMACY_ORDER_BOARD_PAGE_SIZE', 20)
+
+
+def _rows(section):
+    """The section's queryset with what its template reads loaded up front"""
+    queryset = section.model.objects.filter(section.condition)
+    if section.model is Order:
+        return queryset.select_related('user__patient').prefetch_related('orderitems__item')
+    if section.model is PrescriptionUpload:
+        return queryset.select_related('patient', 'pharmacist', 'related_order').annotate(medicine_count=Count('medicines'))
+    return queryset.select_related('item', 'user')
+
+
+def get_page(name, cursor=None):
+    """
+    One page of a section
+
+    Raises:
+        KeyError for an unknown section
+
+    Returns:
+        tuple: (list of rows, next_cursor or None on the last page)
+    """
+    section = SECTIONS[name]
+    return keyset_paginate(_rows(section), section.ordering, cursor=cursor, page_size=page_size())
+
+
+def render_rows(name, rows, request=None):
+    """HTML of ``rows`` of a section, one partial per row"""
+    section = SECTIONS[name]
+    return ''.join(
+        render_to_string(section.template, {section.name: row, **section.extra}, request=request)
+        for row in rows
+    )
+
+
+def get_counts():
+    """Rows in every section, cached for PHARMACY_ORDER_BOARD_COUNTS_TTL seconds"""
+    def load():
+        counts = {}
+        for model in (Order, PrescriptionUpload, Cart):
+            names = [name for name, section in SECTIONS.items() if section.model is model]
+            counts.update(model.objects.aggregate(**{
+                name: Count('pk', filter=SECTIONS[name].condition) for name in names
+            }))
+        return counts
+
+    return cache.get_or_set(COUNTS_CACHE_KEY, load, getattr(settings, 'PHARMACY_ORDER_BOARD_COUNTS_TTL', 60))
+
+
+def invalidate_counts():
+    cache.delete(COUNTS_CACHE_KEY)
@@ -0,0 +1,136 @@
+"""
+Soft stock reservations for cart lines.
+
+Adding a medicine to the cart holds the units for PHARMACY_CART_RESERVATION_TTL
+seconds (a StockReservation per cart line), and starting payment extends the
+hold by PHARMACY_PAYMENT_RESERVATION_TTL. Medicine.reserved_quantity is the
+running total of the holds, so available-to-sell is ``quantity -
+reserved_quantity`` without a SUM over reservations. A hold is taken with
+one conditional UPDATE of that counter (``WHERE quantity >= reserved + n``),
+so two patients can't both hold the last strip.
+
+Placing the order converts the holds: decrement_stock takes the units out of
+stock and out of the counter in the same UPDATE and deletes the rows (see
+Order.stock_quantity_decrease). ``manage.py release_stock_reservations``
+(cron, every minute) drops expired holds; stale holds of a medicine are also
+dropped before anyone tries to hold it.
+
+Every write changes the counter before the rows, so each transaction takes
+its write lock first (SQLite can't upgrade a read lock under contention).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Medicine, StockReservation
+
+
+def _ttl(name, default):
+    return timedelta(seconds=getattr(settings, name, default))
+
+
+def cart_ttl():
+    return _ttl('PHARMACY_CART_RESERVATION_TTL', 30 * 60)
+
+
+def payment_ttl():
+    return _ttl('PHARMACY_PAYMENT_RESERVATION_TTL', 15 * 60)
+
+
+def _held_sum(reservations):
+    """Per-medicine SUM(quantity) of ``reservations`` as a subquery on the outer Medicine"""
+    return Coalesce(Subquery(
+        reservations.filter(medicine=OuterRef('pk')).order_by().values('medicine')
+        .annotate(total=Sum('quantity')).values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def hold(cart, quantity, ttl=None):
+    """
+    Hold ``quantity`` units of cart.item for ``cart`` (the line's new total)
+
+    Growing a hold only succeeds while the medicine has the extra units
+    available; shrinking always does. The expiry is pushed out either way.
+
+    Returns:
+        True if the cart now holds ``quantity`` units
+    """
+    release_expired(medicine_ids=[cart.item_id])
+    current = StockReservation.objects.filter(cart=cart).values_list('quantity', flat=True).first() or 0
+    change = quantity - current
+    expires_at = timezone.now() + (ttl or cart_ttl())
+    with transaction.atomic():
+        counter = Medicine.objects.filter(pk=cart.item_id)
+        if change > 0:
+            counter = counter.filter(quantity__gte=F('reserved_quantity') + change)
+        if change and not counter.update(reserved_quantity=Greatest(F('reserved_quantity') + change, Value(0))):
+            return False
+        if quantity <= 0:
+            StockReservation.objects.filter(cart=cart).delete()
+        elif not StockReservation.objects.filter(cart=cart).update(quantity=quantity, expires_at=expires_at):
+            StockReservation.objects.create(cart=cart, medicine_id=cart.item_id, quantity=quantity, expires_at=expires_at)
+    return True
+
+
+def release(cart):
+    """Drop the cart line's hold (removed from the cart)"""
+    return hold(cart, 0)
+
+
+def hold_order(order, ttl=None):
+    """
+    Make sure every line of an unpaid order is held, for the payment window
+
+    Lines whose hold expired are held again if the units are still there.
+
+    Returns:
+        list of the Cart lines that couldn't be held
+    """
+    ttl = ttl or payment_ttl()
+    return [cart for cart in order.orderitems.select_related('item') if not hold(cart, cart.quantity, ttl)]
+
+
+def held_by(order):
+    """medicine pk -> units held by the order's cart lines"""
+    return dict(
+        StockReservation.objects.filter(cart__order=order).order_by().values('medicine')
+        .annotate(total=Sum('quantity')).values_list('medicine', 'total')
+    )
+
+
+def release_expired(now=None, medicine_ids=None):
+    """
+    Drop expired holds and take them off the medicines' counters
+
+    Returns:
+        number of holds released
+    """
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now)
+    if medicine_ids is not None:
+        expired = expired.filter(medicine_id__in=medicine_ids)
+    with transaction.atomic():
+        Medicine.objects.filter(pk__in=expired.values('medicine')).update(
+            reserved_quantity=Greatest(F('reserved_quantity') - _held_sum(expired), Value(0))
+        )
+        released, _ = expired.delete()
+    return released
+
+
+def recount():
+    """
+    Reset counters that don't match their holds (e.g. a cart deleted
+    without release()); returns the number of medicines fixed
+    """
+    held = _held_sum(StockReservation.objects.all())
+    with transaction.atomic():
+        return (
+            Medicine.objects.alias(held=held)
+            .exclude(reserved_quantity=F('held'))
+            .update(reserved_quantity=held)
+        )
@@ -0,0 +1,219 @@
+"""
+Sales report aggregates, computed in the database.
+
+Revenue is the orders' stored subtotal (frozen when the order is placed, see
+Order.freeze_totals); an order placed without stored totals falls back to
+SUM(quantity x unit price) over its lines, in the same query. Top sellers
+are grouped per medicine over the lines of the selected orders, joined
+through the order rather than matched by buyer and date.
+
+Date ranges are turned into ``created`` bounds in the site's time zone, so
+the filter is a range scan on the (ordered, created) index instead of a
+DATE() of every row.
+
+Dashboard KPIs read the DailyPharmacySales rollup instead: an order is added
+to its day's rows when it is placed (Order.freeze_totals) and taken out when
+it is cancelled (Order.stock_quantity_restore), so a date range is a sum
+over one row per day. Order.in_sales_rollup makes both idempotent.
+``manage.py rebuild_daily_sales`` recomputes days from the orders.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Cart, DailyPharmacySales, Order
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def line_amount():
+    """quantity x unit price of a Cart line (price paid if snapshotted, else the current price)"""
+    price = Coalesce('unit_price', 'item__price', Value(Decimal('0')), output_field=MONEY)
+    return ExpressionWrapper(F('quantity') * price, output_field=MONEY)
+
+
+def order_subtotal():
+    """Expression for an Order's subtotal: the stored one, else the sum over its lines"""
+    lines = (
+        Cart.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        .annotate(total=Sum(line_amount())).values('total')
+    )
+    return Coalesce('subtotal', Subquery(lines, output_field=MONEY), Value(Decimal('0')), output_field=MONEY)
+
+
+def placed_orders(start=None, end=None):
+    """
+    Placed orders created between the ``start`` and ``end`` dates (inclusive, local days)
+
+    Args:
+        start, end: datetime.date or None for an open end
+    """
+    orders = Order.objects.filter(ordered=True)
+    tz = timezone.get_current_timezone()
+    if start:
+        orders = orders.filter(created__gte=timezone.make_aware(datetime.combine(start, time.min), tz))
+    if end:
+        orders = orders.filter(created__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz))
+    return orders
+
+
+def summary(orders):
+    """Revenue and order count of ``orders`` in one query"""
+    totals = orders.order_by().aggregate(revenue=Sum(order_subtotal()), orders=Count('pk'))
+    return {'revenue': totals['revenue'] or Decimal('0'), 'orders': totals['orders']}
+
+
+def top_items(orders, limit=10):
+    """Best sellers in ``orders`` by units: dicts of item, item__name, total_qty and revenue"""
+    return list(
+        Cart.objects.filter(order__in=orders.order_by().values('pk'))
+        .values('item', 'item__name')
+        .annotate(total_qty=Sum('quantity'), revenue=Sum(line_amount()))
+        .order_by('-total_qty', 'item')[:limit]
+    )
+
+
+def order_gst():
+    """Expression for an Order's GST: the stored one, else computed from order_subtotal()"""
+    computed = ExpressionWrapper(order_subtotal() * Value(Order.GST_RATE), output_field=MONEY)
+    return Coalesce('gst_amount', computed, output_field=MONEY)
+
+
+def _local_date(moment):
+    return timezone.localtime(moment).date()
+
+
+def _rollup_rows(orders):
+    """
+    DailyPharmacySales values of ``orders``
+
+    Returns:
+        dict of (date, category) -> [orders, units, revenue, gst]
+    """
+    cent = Decimal('0.01')
+    rows = defaultdict(lambda: [0, 0, Decimal('0'), Decimal('0')])
+    placed = {}
+    for pk, created, subtotal, gst in orders.order_by().values_list('pk', 'created', order_subtotal(), order_gst()):
+        day = _local_date(created)
+        placed[pk] = day
+        row = rows[(day, DailyPharmacySales.ALL_CATEGORIES)]
+        row[0] += 1
+        row[2] += Decimal(subtotal).quantize(cent)
+        row[3] += Decimal(gst).quantize(cent)
+
+    lines = (
+        Cart.objects.filter(order__in=orders.order_by().values('pk')).order_by()
+        .values_list('order', 'item__normalized_category')
+        .annotate(units=Sum('quantity'), revenue=Sum(line_amount()))
+    ) if placed else []
+    for pk, category, units, revenue in lines:
+        day = placed.get(pk)
+        if day is None:
+            # Placed after the orders were read
+            continue
+        revenue = Decimal(revenue or 0).quantize(cent)
+        rows[(day, DailyPharmacySales.ALL_CATEGORIES)][1] += units or 0
+        row = rows[(day, category or '')]
+        row[0] += 1
+        row[1] += units or 0
+        row[2] += revenue
+        row[3] += (revenue * Order.GST_RATE).quantize(cent)
+    return rows
+
+
+def _add(rows, sign=1):
+    """Add (or with ``sign=-1`` subtract) _rollup_rows() values to the stored days"""
+    for (day, category), (orders, units, revenue, gst) in rows.items():
+        changes = {
+            'orders': F('orders') + sign * orders,
+            'units': F('units') + sign * units,
+            'revenue': F('revenue') + sign * revenue,
+            'gst': F('gst') + sign * gst,
+        }
+        if DailyPharmacySales.objects.filter(date=day, category=category).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                DailyPharmacySales.objects.create(
+                    date=day, category=category, orders=sign * orders, units=sign * units,
+                    revenue=sign * revenue, gst=sign * gst,
+                )
+        except IntegrityError:
+            # Created by a concurrent order since the update
+            DailyPharmacySales.objects.filter(date=day, category=category).update(**changes)
+
+
+def record_order(order):
+    """
+    Add a placed order to the daily sales; does nothing if it is already counted
+
+    Returns:
+        True if the order was added
+    """
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, in_sales_rollup=False).update(in_sales_rollup=True):
+            return False
+        _add(_rollup_rows(Order.objects.filter(pk=order.pk)))
+    order.in_sales_rollup = True
+    return True
+
+
+def unrecord_order(order):
+    """
+    Take a cancelled order out of the daily sales; does nothing if it isn't counted
+
+    Returns:
+        True if the order was taken out
+    """
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, in_sales_rollup=True).update(in_sales_rollup=False):
+            return False
+        _add(_rollup_rows(Order.objects.filter(pk=order.pk)), sign=-1)
+    order.in_sales_rollup = False
+    return True
+
+
+def rebuild_rollup(start=None, end=None):
+    """
+    Recompute the daily sales of the days from ``start`` to ``end`` (inclusive,
+    open-ended if None) from the placed, not cancelled, orders of those days
+
+    Returns:
+        number of days written
+    """
+    orders = placed_orders(start, end)
+    counted = orders.exclude(order_status='cancelled')
+    with transaction.atomic():
+        stale = DailyPharmacySales.objects.all()
+        if start:
+            stale = stale.filter(date__gte=start)
+        if end:
+            stale = stale.filter(date__lte=end)
+        stale.delete()
+        orders.filter(order_status='cancelled').update(in_sales_rollup=False)
+        counted.update(in_sales_rollup=True)
+        rows = _rollup_rows(counted)
+        DailyPharmacySales.objects.bulk_create([
+            DailyPharmacySales(date=day, category=category, orders=count, units=units, revenue=revenue, gst=gst)
+            for (day, category), (count, units, revenue, gst) in rows.items()
+        ], batch_size=2000)
+    return len({day for day, _ in rows})
+
+
+def daily_totals(start, end=None, category=DailyPharmacySales.ALL_CATEGORIES):
+    """Orders, units, revenue and GST from ``start`` to ``end`` (inclusive, default today) from the rollup"""
+    end = end or timezone.localdate()
+    totals = DailyPharmacySales.objects.filter(date__gte=start, date__lte=end, category=category).aggregate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'), gst=Sum('gst'),
+    )
+    return {
+        'orders': totals['orders'] or 0,
+        'units': totals['units'] or 0,
+        'revenue': totals['revenue'] or Decimal('0'),
+        'gst': totals['gst'] or Decimal('0'),
+    }
@@ -0,0 +1,311 @@
+"""
+In-memory typeahead index for the Medicine catalog.
+
+The live search box fires a request on every keystroke. Running a four-way
+``icontains`` OR against the database for each of them is a full table scan,
+so each worker process keeps its own index built from prefix and trigram
+postings and answers those queries from memory.
+
+Ranking (lower is better):
+    0 - name equals the query
+    1 - name starts with the query
+    2 - a word in the name starts with the query
+    3 - query appears inside the name
+    4 - query appears in the category or type
+    5 - query appears in the description
+"""
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+
+MAX_PREFIX_LENGTH = 12
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def _normalize(value):
+    return (value or '').lower()
+
+
+def _words(value):
+    return WORD_RE.findall(value)
+
+
+def _trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class _Entry:
+    __slots__ = ('pk', 'name', 'category', 'medicine_type', 'description', 'name_words', 'quantity', 'payload')
+
+    def __init__(self, medicine):
+        self.pk = medicine.serial_number
+        self.name = _normalize(medicine.name)
+        self.category = _normalize(medicine.medicine_category)
+        self.medicine_type = _normalize(medicine.medicine_type)
+        self.description = _normalize(medicine.description)
+        self.name_words = _words(self.name)
+        self.quantity = medicine.quantity or 0
+        self.payload = {
+            'id': medicine.serial_number,
+            'name': medicine.name,
+            'price': float(medicine.price) if medicine.price else 0.0,
+            'description': medicine.description or '',
+            'category': medicine.medicine_category or '',
+            'type': medicine.medicine_type or '',
+            'stock': medicine.quantity,
+            'image_url': medicine.get_medicine_image(),
+        }
+
+    @staticmethod
+    def _prefixes(words):
+        keys = set()
+        for word in words:
+            for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                keys.add(word[:length])
+        return keys
+
+    def name_prefix_keys(self):
+        return self._prefixes(self.name_words)
+
+    def field_prefix_keys(self):
+        return self._prefixes(_words(self.category) + _words(self.medicine_type))
+
+    def trigram_keys(self):
+        keys = set()
+        for field in (self.name, self.category, self.medicine_type, self.description):
+            keys |= _trigrams(field)
+        return keys
+
+    def score(self, query):
+        """Return the rank of this entry for ``query`` or None if it does not match"""
+        if self.name == query:
+            return 0
+        if self.name.startswith(query):
+            return 1
+        if any(word.startswith(query) for word in self.name_words):
+            return 2
+        if query in self.name:
+            return 3
+        if query in self.category or query in self.medicine_type:
+            return 4
+        if query in self.description:
+            return 5
+        return None
+
+
+class MedicineSearchIndex:
+    """Prefix + trigram postings over the Medicine catalog, local to this process"""
+
+    # Candidate sets larger than this are resolved by walking the name-ordered
+    # list with an early exit instead of sorting the whole set.
+    SORT_THRESHOLD = 512
+
+    def __init__(self, ttl=None):
+        self._lock = threading.RLock()
+        self._ttl = ttl
+        self._entries = {}
+        self._order = []
+        self._name_prefix = {}
+        self._prefix = {}
+        self._trigram = {}
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _expired(self):
+        ttl = self._ttl if self._ttl is not None else getattr(settings, 'PHARMACY_SEARCH_INDEX_TTL', 300)
+        return ttl and (time.monotonic() - self._built_at) > ttl
+
+    def build(self, medicines=None):
+        """(Re)build the whole index from the given iterable or the full catalog"""
+        if medicines is None:
+            from .models import Medicine
+            medicines = Medicine.objects.only(
+                'serial_number', 'name', 'description', 'medicine_category', 'medicine_type',
+                'quantity', 'price', 'featured_image',
+            ).iterator(chunk_size=2000)
+
+        entries, name_prefix, prefix, trigram = {}, {}, {}, {}
+        for medicine in medicines:
+            entry = _Entry(medicine)
+            entries[entry.pk] = entry
+            self._link(entry, name_prefix, prefix, trigram)
+
+        with self._lock:
+            self._entries = entries
+            self._order = sorted((entry.name, pk) for pk, entry in entries.items())
+            self._name_prefix, self._prefix, self._trigram = name_prefix, prefix, trigram
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        if not self.is_built or self._expired():
+            self.build()
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._order = {}, []
+            self._name_prefix, self._prefix, self._trigram = {}, {}, {}
+            self._built_at = None
+
+    @staticmethod
+    def _link(entry, name_prefix, prefix, trigram):
+        for key in entry.name_prefix_keys():
+            name_prefix.setdefault(key, set()).add(entry.pk)
+        for key in entry.field_prefix_keys():
+            prefix.setdefault(key, set()).add(entry.pk)
+        for key in entry.trigram_keys():
+            trigram.setdefault(key, set()).add(entry.pk)
+
+    def _unlink(self, entry):
+        for postings_map, keys in (
+            (self._name_prefix, entry.name_prefix_keys()),
+            (self._prefix, entry.field_prefix_keys()),
+            (self._trigram, entry.trigram_keys()),
+        ):
+            for key in keys:
+                postings = postings_map.get(key)
+                if postings is not None:
+                    postings.discard(entry.pk)
+                    if not postings:
+                        del postings_map[key]
+        position = bisect.bisect_left(self._order, (entry.name, entry.pk))
+        if position < len(self._order) and self._order[position] == (entry.name, entry.pk):
+            del self._order[position]
+
+    def update(self, medicine):
+        """Insert or replace a single medicine. No-op until the index has been built."""
+        if not self.is_built:
+            return
+        entry = _Entry(medicine)
+        with self._lock:
+            old = self._entries.get(entry.pk)
+            if old is not None:
+                self._unlink(old)
+            self._entries[entry.pk] = entry
+            self._link(entry, self._name_prefix, self._prefix, self._trigram)
+            bisect.insort(self._order, (entry.name, entry.pk))
+
+    def remove(self, pk):
+        if not self.is_built:
+            return
+        with self._lock:
+            old = self._entries.pop(pk, None)
+            if old is not None:
+                self._unlink(old)
+
+    def refresh(self, pks):
+        """Reload the given medicines from the database (for writes that bypass post_save)"""
+        if not self.is_built:
+            return
+        from .models import Medicine
+        pks = set(pks)
+        found = set()
+        for medicine in Medicine.objects.filter(serial_number__in=pks):
+            self.update(medicine)
+            found.add(medicine.serial_number)
+        for pk in pks - found:
+            self.remove(pk)
+
+    def _trigram_candidates(self, query):
+        if len(query) < 3:
+            return set()
+        postings = [self._trigram.get(key) for key in _trigrams(query)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def _in_stock(self, pk, in_stock_only):
+        return not in_stock_only or self._entries[pk].quantity > 0
+
+    def _take_prefix_range(self, query, need, in_stock_only):
+        """Ranks 0 and 1: names starting with the query are contiguous in ``_order``"""
+        exact, starts = [], []
+        position = bisect.bisect_left(self._order, (query,))
+        for name, pk in self._order[position:]:
+            if not name.startswith(query):
+                break
+            if not self._in_stock(pk, in_stock_only):
+                continue
+            if name == query:
+                exact.append(pk)
+            elif len(starts) < need:
+                starts.append(pk)
+            if len(exact) >= need:
+                break
+        return (exact + starts)[:need]
+
+    def _take(self, candidates, predicate, need, in_stock_only):
+        """Collect up to ``need`` pks from ``candidates`` matching ``predicate``, in name order"""
+        taken = []
+        if len(candidates) <= self.SORT_THRESHOLD:
+            pks = sorted(candidates, key=lambda pk: (self._entries[pk].name, pk))
+        else:
+            pks = (pk for _, pk in self._order if pk in candidates)
+        for pk in pks:
+            if self._in_stock(pk, in_stock_only) and predicate(self._entries[pk]):
+                taken.append(pk)
+                if len(taken) == need:
+                    break
+        return taken
+
+    def search(self, query, limit=10, in_stock_only=True):
+        """Return up to ``limit`` ranked payload dicts for ``query``"""
+        query = _normalize(query).strip()
+        if not query:
+            return []
+        self.ensure_built()
+
+        def word_prefix(entry):
+            return not entry.name.startswith(query) and any(w.startswith(query) for w in entry.name_words)
+
+        def in_name(entry):
+            return query in entry.name and not entry.name.startswith(query) and not word_prefix(entry)
+
+        def in_fields(entry):
+            return query not in entry.name and (query in entry.category or query in entry.medicine_type)
+
+        def in_description(entry):
+            return entry.score(query) == 5
+
+        with self._lock:
+            results = self._take_prefix_range(query, limit, in_stock_only)
+
+            tiers = []
+            prefix_indexed = WORD_RE.fullmatch(query) and len(query) <= MAX_PREFIX_LENGTH
+            if prefix_indexed:
+                tiers.append((self._name_prefix.get(query, set()), word_prefix))
+            if len(query) >= 3:
+                trigram_candidates = self._trigram_candidates(query)
+                if not prefix_indexed:
+                    # Longer than the indexed prefixes: find word prefixes by trigrams
+                    tiers.append((trigram_candidates, word_prefix))
+                tiers += [
+                    (trigram_candidates, in_name),
+                    (trigram_candidates, in_fields),
+                    (trigram_candidates, in_description),
+                ]
+            else:
+                # Too short for trigrams: scan the entries
+                everything = self._entries.keys()
+                tiers += [
+                    (everything, in_name),
+                    (everything, in_fields),
+                    (everything, in_description),
+                ]
+
+            for candidates, predicate in tiers:
+                need = limit - len(results)
+                if need <= 0:
+                    break
+                results.extend(self._take(candidates, predicate, need, in_stock_only))
+
+            return [self._entries[pk].payload for pk in results]
+
+
+medicine_index = MedicineSearchIndex()
@@ -1,59 +1,168 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.core.mail import send_mail, BadHeaderError
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
 from django.conf import settings
+from django.db import DatabaseError, transaction
+import logging
 
-from .models import Medicine
+from .models import Cart, Medicine, MedicineBatch, Order, PrescriptionUpload, StockMovement
+from . import alerts, ledger, order_board
+from .search_index import medicine_index
+from .fuzzy import fuzzy_matcher
+from . import fulltext
+from . import catalog_snapshot
+from .ingredients import sync_ingredients, sync_ingredients_bulk
 from hospital.models import User
 
-LOW_STOCK_THRESHOLD = 15
-EXPIRY_DAYS_THRESHOLD = 30
+logger = logging.getLogger(__name__)
 
-
-def get_recipients():
-    emails = list(User.objects.filter(is_hospital_admin=True).values_list('email', flat=True))
-    emails += list(User.objects.filter(is_pharmacist=True).values_list('email', flat=True))
-    # Filter out empty emails
-    return [e for e in emails if e]
+# Sent by code that writes medicines without post_save (bulk_create,
+# queryset.update) with the affected primary keys and, optionally, the
+# fields that changed, so the derived indexes catch up in one pass.
+medicines_bulk_changed = Signal()
 
 
 @receiver(post_save, sender=Medicine)
-def medicine_alerts(sender, instance: Medicine, created, **kwargs):
-    recipients = get_recipients()
-    if not recipients:
+def queue_medicine_alerts(sender, instance: Medicine, created, raw=False, update_fields=None, **kwargs):
+    # Queued for the digest (send_pharmacy_alerts), only when the save crossed the threshold
+    if raw or (update_fields is not None and 'quantity' not in update_fields):
         return
+    before = None if created else getattr(instance, '_loaded_quantity', None)
+    alerts.queue_low_stock({instance.pk: (before, instance.quantity)})
+    instance._loaded_quantity = instance.quantity
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=PrescriptionUpload)
+@receiver(post_delete, sender=PrescriptionUpload)
+@receiver(post_save, sender=Cart)
+def invalidate_order_board_counts(sender, instance, **kwargs):
+    # Carts only count once purchased; adding to a cart doesn't change the board
+    if sender is Cart and not instance.purchased:
+        return
+    order_board.invalidate_counts()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_alert_recipients(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only; they don't change who gets the alerts
+    if update_fields is not None and not set(update_fields) & {'email', 'is_hospital_admin', 'is_pharmacist'}:
+        return
+    alerts.invalidate_recipients()
+
+
+@receiver(post_save, sender=Medicine)
+def record_opening_stock(sender, instance: Medicine, created, raw=False, **kwargs):
+    # However a medicine is created, its first levels are a receipt in the ledger
+    if created and not raw:
+        ledger.record(
+            instance, StockMovement.RECEIPT,
+            quantity_change=instance.quantity or 0,
+            stock_change=instance.stock_quantity or 0,
+            reference='opening',
+        )
+
+
+@receiver(post_save, sender=Medicine)
+def create_opening_batch(sender, instance: Medicine, created, raw=False, **kwargs):
+    # A new medicine's stock is its first batch
+    if created and not raw:
+        MedicineBatch.objects.create(
+            medicine=instance,
+            batch_no=instance.batch_no or '',
+            expiry_date=instance.expiry_date,
+            quantity=max(instance.quantity or 0, 0),
+        )
+
+
+@receiver(post_save, sender=Medicine)
+def update_search_index(sender, instance: Medicine, **kwargs):
+    medicine_index.update(instance)
+
 
-    alerts = []
+@receiver(post_delete, sender=Medicine)
+def remove_from_search_index(sender, instance: Medicine, **kwargs):
+    medicine_index.remove(instance.serial_number)
 
-    # Low stock alert
+
+@receiver(post_save, sender=Medicine)
+def update_fuzzy_matcher(sender, instance: Medicine, **kwargs):
+    fuzzy_matcher.update(instance)
+
+
+@receiver(post_delete, sender=Medicine)
+def remove_from_fuzzy_matcher(sender, instance: Medicine, **kwargs):
+    fuzzy_matcher.remove(instance.serial_number)
+
+
+@receiver(post_save, sender=Medicine)
+def update_fulltext_index(sender, instance: Medicine, **kwargs):
     try:
-        qty = int(instance.quantity or 0)
-    except Exception:
-        qty = 0
-    if qty < LOW_STOCK_THRESHOLD:
-        alerts.append(f"Low stock: {instance.name} has only {qty} units left.")
+        # Savepoint: a failed index write mustn't abort the caller's transaction
+        with transaction.atomic():
+            fulltext.get_backend().index([instance])
+    except DatabaseError as e:
+        logger.warning(f"Full-text index update failed for medicine {instance.serial_number}: {e}")
 
-    # Expiring soon alert
+
+@receiver(post_delete, sender=Medicine)
+def remove_from_fulltext_index(sender, instance: Medicine, **kwargs):
     try:
-        if getattr(instance, 'is_expiring_soon', False):
-            alerts.append(f"Expiring soon: {instance.name} expires on {instance.expiry_date}.")
-    except Exception:
-        pass
+        with transaction.atomic():
+            fulltext.get_backend().remove([instance.serial_number])
+    except DatabaseError as e:
+        logger.warning(f"Full-text index delete failed for medicine {instance.serial_number}: {e}")
+
 
-    if not alerts:
+@receiver(post_save, sender=Medicine)
+def update_medicine_ingredients(sender, instance: Medicine, update_fields=None, **kwargs):
+    if update_fields is not None and 'composition' not in update_fields:
         return
+    sync_ingredients(instance)
 
-    subject = "Pharmacy Alert: " + ("; ".join([a.split(':')[0] for a in alerts]))
-    context = {
-        'medicine': instance,
-        'alerts': alerts,
-    }
-    html_message = render_to_string('pharmacy_mail_alert.html', context)
-    plain_message = strip_tags(html_message)
-    try:
-        send_mail(subject, plain_message, getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'), recipients, html_message=html_message, fail_silently=True)
-    except BadHeaderError:
-        pass
 
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def invalidate_catalog_snapshot(sender, instance: Medicine, **kwargs):
+    catalog_snapshot.invalidate()
+
+
+@receiver(medicines_bulk_changed)
+def refresh_after_bulk_change(sender, pks, fields=None, **kwargs):
+    pks = list(pks)
+    if not pks:
+        return
+    # Past this size patching the indexes one medicine at a time costs more
+    # than rebuilding them (lazily, for the in-process ones)
+    large = len(pks) > getattr(settings, 'PHARMACY_BULK_REFRESH_LIMIT', 2000)
+    if large:
+        medicine_index.clear()
+        fuzzy_matcher.clear()
+    else:
+        medicine_index.refresh(pks)
+        fuzzy_matcher.refresh(pks)
+
+    reindex = fields is None or bool(set(fields) & set(fulltext.FTS_COLUMNS))
+    reparse = fields is None or 'composition' in fields
+    backend = fulltext.get_backend()
+    if reindex and large:
+        try:
+            with transaction.atomic():
+                backend.rebuild()
+        except DatabaseError as e:
+            logger.warning(f"Full-text index rebuild failed: {e}")
+    if (reindex and not large) or reparse:
+        for start in range(0, len(pks), 2000):
+            chunk = pks[start:start + 2000]
+            medicines = list(Medicine.objects.filter(serial_number__in=chunk))
+            if reindex and not large:
+                try:
+                    with transaction.atomic():
+                        backend.index(medicines)
+                except DatabaseError as e:
+                    logger.warning(f"Full-text index update failed for {len(medicines)} medicines: {e}")
+            if reparse:
+                sync_ingredients_bulk(medicines)
+
+    catalog_snapshot.invalidate()
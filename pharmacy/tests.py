@@ -1,3 +1,1320 @@
-from django.test import TestCase
+import gzip
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import HSNLookup, Medicine, PharmacyAlert, normalize_category
+from .utils import keyset_paginate
+from .search_index import medicine_index
+from .fuzzy import fuzzy_matcher
+from .ingredients import parse_composition, medicines_with_ingredients, find_substitutes
+from .aho_corasick import AhoCorasick
+from .hsn_utils import (
+    MEDICINE_HSN_CODES, HSNClient, HTTPHSNClient, auto_fetch_hsn_code, classify_many, find_ingredients, get_hsn_from_database,
+    set_hsn_client,
+)
+from . import hsn_cache
+from . import fulltext
+from . import alerts, batches, ledger, reservations
+
+
+class MedicineSearchIndexTestCase(TestCase):
+    def setUp(self):
+        medicine_index.clear()
+        self.dolo = Medicine.objects.create(name='Dolo 650', description='Paracetamol tablet', medicine_category='fever', quantity=10)
+        self.paracip = Medicine.objects.create(name='Paracip', description='Fever tablet', medicine_category='fever', quantity=5)
+        self.crocin = Medicine.objects.create(name='Crocin Para Plus', description='For fever', medicine_category='fever', quantity=5)
+        self.empty = Medicine.objects.create(name='Paracetamol', medicine_category='fever', quantity=0)
+
+    def tearDown(self):
+        medicine_index.clear()
+
+    def names(self, query):
+        return [m['name'] for m in medicine_index.search(query)]
+
+    def test_prefix_matches_rank_above_substring_matches(self):
+        self.assertEqual(self.names('para'), ['Paracip', 'Crocin Para Plus', 'Dolo 650'])
+
+    def test_out_of_stock_medicines_are_hidden(self):
+        self.assertNotIn('Paracetamol', self.names('paracetamol'))
+        self.assertIn('Paracetamol', [m['name'] for m in medicine_index.search('paracetamol', in_stock_only=False)])
+
+    def test_index_follows_model_signals(self):
+        self.names('para')  # build the index
+        self.paracip.name = 'Calpol'
+        self.paracip.save()
+        self.assertEqual(self.names('calp'), ['Calpol'])
+        self.assertNotIn('Paracip', self.names('para'))
+
+        self.crocin.delete()
+        self.assertEqual(self.names('crocin'), [])
+
+    def test_long_queries_match_word_prefixes(self):
+        Medicine.objects.create(name='Tab Hydrochlorothiazide 25', quantity=3)
+        Medicine.objects.create(name='Chlorothiazide', description='Not hydrochlorothiazide', quantity=3)
+        self.assertEqual(self.names('hydrochlorothi'), ['Tab Hydrochlorothiazide 25', 'Chlorothiazide'])
+
+    def test_short_queries_match_inside_names(self):
+        self.assertEqual(self.names('ol'), ['Dolo 650'])
+        self.assertEqual(self.names('pl'), ['Crocin Para Plus'])
+        self.assertEqual(self.names('fe'), ['Crocin Para Plus', 'Dolo 650', 'Paracip'])
+
+
+class FullTextSearchTestCase(TestCase):
+    def setUp(self):
+        fulltext.reset_backend()
+        Medicine.objects.create(name='Dolo 650', composition='Paracetamol 650mg', description='Fever tablet', quantity=10)
+        Medicine.objects.create(name='Paracip', composition='Paracetamol 500mg', description='Paracetamol for fever and pain', quantity=5)
+        Medicine.objects.create(name='Azithral', composition='Azithromycin 500mg', description='Antibiotic', quantity=5)
+        for name in ('Pan 40', 'Cetzine', 'Glycomet', 'Amlong', 'Montair', 'Shelcal'):
+            Medicine.objects.create(name=name, quantity=5)
+
+    def test_name_matches_rank_first(self):
+        Medicine.objects.create(name='Paracetamol IP', composition='Paracetamol 500mg', quantity=5)
+        names = [m.name for m in fulltext.search(Medicine.objects.all(), 'paracetamol')]
+        self.assertEqual(names[0], 'Paracetamol IP')
+        self.assertEqual(set(names[1:]), {'Paracip', 'Dolo 650'})
+
+    def test_prefix_terms_and_field_restriction(self):
+        self.assertEqual([m.name for m in fulltext.search(Medicine.objects.all(), 'azith')], ['Azithral'])
+        self.assertEqual(list(fulltext.search(Medicine.objects.all(), 'paracetamol', fields=('name',))), [])
+
+    def test_index_follows_model_signals(self):
+        medicine = Medicine.objects.get(name='Azithral')
+        medicine.description = 'Macrolide antibiotic'
+        medicine.save()
+        self.assertEqual([m.name for m in fulltext.search(Medicine.objects.all(), 'macrolide')], ['Azithral'])
+        medicine.delete()
+        self.assertEqual(list(fulltext.search(Medicine.objects.all(), 'macrolide')), [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(list(fulltext.search(Medicine.objects.all(), '" OR * NEAR(')), [])
+
+    def test_match_runs_once_per_query(self):
+        results = fulltext.search(Medicine.objects.filter(quantity=5), 'fever')
+        self.assertEqual(str(results.query).count('MATCH'), 1)
+        self.assertEqual([m.name for m in results], ['Paracip'])
+        self.assertEqual(results.count(), 1)
+
+    def test_index_writes_run_in_a_savepoint(self):
+        from unittest import mock
+        from django.db import DatabaseError, connection, transaction
+
+        savepoints = []
+
+        def fail(*args):
+            # Rolling back to this savepoint keeps PostgreSQL's outer transaction usable
+            savepoints.append(len(connection.savepoint_ids))
+            raise DatabaseError('locked')
+
+        from . import signals
+
+        medicine = Medicine.objects.get(name='Azithral')
+        with transaction.atomic():
+            outer = len(connection.savepoint_ids)
+            with mock.patch.object(fulltext.SQLiteFTSBackend, 'index', side_effect=fail), \
+                    mock.patch.object(fulltext.SQLiteFTSBackend, 'remove', side_effect=fail):
+                signals.update_fulltext_index(Medicine, medicine)
+                signals.remove_from_fulltext_index(Medicine, medicine)
+            self.assertEqual(Medicine.objects.filter(name='Azithral').count(), 1)
+        self.assertEqual(savepoints, [outer + 1, outer + 1])
+
+
+class ShopPaginationTestCase(TestCase):
+    def setUp(self):
+        for i, category in enumerate(['Fever', 'Heart Disease', 'Eye/Ear/Nose', 'Pain', 'Fever']):
+            Medicine.objects.create(name=f"Med {i}", medicine_category=category, quantity=5)
+        Medicine.objects.create(name=None, medicine_category='Pain', quantity=5)
+
+    def test_category_normalized_on_save(self):
+        self.assertEqual(normalize_category('Eye/Ear/Nose'), 'eye')
+        self.assertEqual(normalize_category('Heart Disease'), 'hypertension')
+        self.assertEqual(Medicine.objects.filter(normalized_category='fever').count(), 2)
+
+    def test_keyset_pages_cover_catalog_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_paginate(Medicine.objects.all(), ('name', 'serial_number'), cursor, page_size=2)
+            seen += [m.serial_number for m in page]
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(Medicine.objects.values_list('serial_number', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_descending_keyset_and_bad_cursor(self):
+        everything = list(Medicine.objects.all())
+        page, cursor = keyset_paginate(Medicine.objects.all(), ('-name', 'serial_number'), page_size=5)
+        rest, _ = keyset_paginate(Medicine.objects.all(), ('-name', 'serial_number'), cursor, page_size=5)
+        self.assertEqual(len(page) + len(rest), len(everything))
+        self.assertIsNone(rest[-1].name)
+        page, _ = keyset_paginate(Medicine.objects.all(), ('name', 'serial_number'), 'not-a-cursor', page_size=10)
+        self.assertEqual(len(page), len(everything))
+
+
+class CatalogSnapshotTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        cache.clear()
+        self.user = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        self.client.force_login(self.user)
+        Medicine.objects.create(name='Paracetamol', quantity=10, price=12)
+
+    def test_gzip_body_and_not_modified(self):
+        response = self.client.get(reverse('catalog-snapshot'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        catalog = json.loads(gzip.decompress(response.content))
+        self.assertEqual(catalog[0]['name'], 'Paracetamol')
+
+        again = self.client.get(reverse('catalog-snapshot'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_medicine_save_changes_version(self):
+        etag = self.client.get(reverse('catalog-snapshot'))['ETag']
+        Medicine.objects.create(name='Ibuprofen', quantity=5, price=20)
+        response = self.client.get(reverse('catalog-snapshot'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_patients_are_rejected(self):
+        from hospital.models import User
+        self.client.force_login(User.objects.create_user(username='pat', password='x', is_patient=True))
+        self.assertEqual(self.client.get(reverse('catalog-snapshot')).status_code, 403)
+
+
+class FuzzyMedicineMatcherTestCase(TestCase):
+    def setUp(self):
+        fuzzy_matcher.clear()
+        self.paracetamol = Medicine.objects.create(name='Paracetamol 500mg', composition='Paracetamol 500mg', quantity=10)
+        self.dolo = Medicine.objects.create(name='Dolo 650', composition='Paracetamol 650mg', quantity=10)
+        Medicine.objects.create(name='Amoxicillin 250mg', composition='Amoxicillin 250mg', quantity=10)
+
+    def tearDown(self):
+        fuzzy_matcher.clear()
+
+    def test_single_misspelling_found_name_match_first(self):
+        results = fuzzy_matcher.search('paracetmol')
+        self.assertEqual([r['id'] for r in results], [self.paracetamol.serial_number, self.dolo.serial_number])
+        self.assertEqual(results[0]['distance'], 1)
+
+    def test_too_distant_words_do_not_match(self):
+        self.assertEqual(fuzzy_matcher.search('paxacxtxmol'), [])
+
+    def test_follows_catalog_changes(self):
+        fuzzy_matcher.search('amoxicilin')
+        medicine = Medicine.objects.create(name='Azithromycin 500mg', quantity=5)
+        self.assertEqual(fuzzy_matcher.search('azithromicin')[0]['id'], medicine.serial_number)
+        medicine.delete()
+        self.assertEqual(fuzzy_matcher.search('azithromicin'), [])
+
+    def test_search_endpoint_falls_back_to_fuzzy(self):
+        from hospital.models import User
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+        response = self.client.get(reverse('search-medicines-ajax'), {'q': 'amoxicilin'})
+        self.assertEqual(response.json()['results'][0]['name'], 'Amoxicillin 250mg')
+
+
+class MedicineIngredientTestCase(TestCase):
+    def setUp(self):
+        self.augmentin = Medicine.objects.create(
+            name='Augmentin 625', composition='Amoxycillin (as Trihydrate) 500mg + Clavulanic Acid IP 125 mg',
+            quantity=0, price=200,
+        )
+        self.moxikind = Medicine.objects.create(
+            name='Moxikind CV 625', composition='Amoxicillin 500 mg, Clavulanic Acid 125mg', quantity=20, price=150,
+        )
+        self.clavam = Medicine.objects.create(
+            name='Clavam 375', composition='Amoxicillin 250mg + Clavulanic Acid 125mg', quantity=20, price=90,
+        )
+        self.mox = Medicine.objects.create(name='Mox 500', composition='Amoxicillin 500mg', quantity=20, price=60)
+
+    def test_parse_composition(self):
+        self.assertEqual(
+            [(i, str(s), u) for i, s, u in parse_composition('Paracetamol IP 325 mg + Tramadol Hydrochloride (37.5mg)')],
+            [('paracetamol', '325', 'mg'), ('tramadol', '37.5', 'mg')],
+        )
+        self.assertEqual(
+            sorted(self.augmentin.ingredients.values_list('ingredient', flat=True)),
+            ['amoxicillin', 'clavulanic acid'],
+        )
+
+    def test_lookup_by_ingredients(self):
+        self.assertEqual(medicines_with_ingredients(['amoxicillin']).count(), 4)
+        self.assertEqual(
+            set(medicines_with_ingredients(['Amoxicillin', 'clavulanic acid'], in_stock_only=True)),
+            {self.moxikind, self.clavam},
+        )
+
+    def test_substitutes_prefer_same_strength_and_follow_edits(self):
+        self.assertEqual(find_substitutes(self.augmentin), [self.moxikind, self.clavam])
+        self.moxikind.composition = 'Amoxicillin 500mg'
+        self.moxikind.save()
+        self.assertEqual(find_substitutes(self.augmentin), [self.clavam])
+
+    def test_same_strength_substitutes_beat_any_number_of_cheaper_ones(self):
+        from .ingredients import sync_ingredients_bulk
+
+        cheaper = Medicine.objects.bulk_create(
+            Medicine(name=f'Cheap CV {i}', composition='Amoxicillin 250mg + Clavulanic Acid 125mg', quantity=5, price=10)
+            for i in range(60)
+        )
+        sync_ingredients_bulk(cheaper)
+        self.assertEqual(find_substitutes(self.augmentin, limit=1), [self.moxikind])
+        augmentin = Medicine.objects.get(pk=self.augmentin.pk)
+        with self.assertNumQueries(2):  # the medicine's ingredients, the ranked candidates
+            find_substitutes(augmentin)
+
+    def test_ingredient_lookup_is_for_staff(self):
+        from hospital.models import User
+
+        url = reverse('medicines-by-ingredients')
+        self.client.force_login(User.objects.create_user(username='pat', password='x', is_patient=True))
+        self.assertEqual(self.client.get(url, {'ingredients': 'amoxicillin'}).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+        self.assertEqual(len(self.client.get(url, {'ingredients': 'amoxicillin'}).json()['results']), 4)
+
+
+class HSNClassificationTestCase(TestCase):
+    def test_automaton_reports_overlapping_matches(self):
+        automaton = AhoCorasick({'he': 1, 'she': 2, 'his': 3, 'hers': 4})
+        self.assertEqual(
+            sorted((start, pattern) for start, end, pattern, value in automaton.iter_matches('ushers')),
+            [(1, 'she'), (2, 'he'), (2, 'hers')],
+        )
+        self.assertEqual([m[2] for m in automaton.longest_matches('ushers')], ['she', 'hers'])
+
+    def test_longest_ingredient_wins(self):
+        hits = find_ingredients('Cifran 500', 'Ciprofloxacin 500mg')
+        self.assertEqual([hit.ingredient for hit in hits], ['ciprofloxacin'])
+        self.assertEqual(get_hsn_from_database('Nexpro', 'esomeprazole magnesium'), MEDICINE_HSN_CODES['esomeprazole'])
+
+    def test_classify_many_matches_auto_fetch(self):
+        rows = [
+            ('Crocin Advance', 'Paracetamol 500mg', 'Fever'),
+            {'name': 'Mystery Tonic', 'composition': '', 'category': 'Unknown'},
+            ('Crocin Advance', 'Paracetamol 500mg', 'Fever'),
+            ('', None, None),
+        ]
+        results = classify_many(rows)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0], auto_fetch_hsn_code('Crocin Advance', 'Paracetamol 500mg', 'Fever'))
+        self.assertEqual(results[1]['source'], 'default')
+        self.assertIsNone(results[3]['hsn_code'])
+
+
+class FakeHSNClient(HSNClient):
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def lookup(self, medicine_name, composition=None):
+        self.calls.append(medicine_name)
+        hsn_code = self.answers.get(medicine_name)
+        return {'hsn_code': hsn_code, 'confidence': 'medium'} if hsn_code else None
+
+
+class HSNCacheTestCase(TestCase):
+    def setUp(self):
+        hsn_cache.lru.clear()
+        self.client_fake = FakeHSNClient({'Qwerty Tonic': '30045039'})
+        set_hsn_client(self.client_fake)
+
+    def tearDown(self):
+        set_hsn_client(None)
+        hsn_cache.lru.clear()
+
+    def test_lookup_is_persisted_and_reused(self):
+        first = hsn_cache.lookup('Qwerty Tonic', 'herbal blend', None)
+        self.assertEqual((first['hsn_code'], first['source']), ('30045039', 'api'))
+        self.assertEqual(HSNLookup.objects.count(), 1)
+
+        hsn_cache.lru.clear()  # a different worker: only the table is warm
+        second = hsn_cache.lookup('Qwerty Tonic', 'herbal blend', None)
+        self.assertEqual(second, first)
+        self.assertEqual(self.client_fake.calls, ['Qwerty Tonic'])
+
+    def test_expired_rows_are_recomputed(self):
+        hsn_cache.lookup('Qwerty Tonic', 'herbal blend', None)
+        HSNLookup.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        hsn_cache.lru.clear()
+        hsn_cache.lookup('Qwerty Tonic', 'herbal blend', None)
+        self.assertEqual(len(self.client_fake.calls), 2)
+        self.assertEqual(HSNLookup.objects.count(), 1)
+
+    def test_batch_endpoint(self):
+        from hospital.models import User
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+        payload = {'medicines': [
+            {'name': 'Crocin', 'composition': 'Paracetamol 500mg'},
+            {'name': 'Qwerty Tonic', 'composition': ''},
+            {'name': 'Crocin', 'composition': 'Paracetamol 500mg'},
+        ]}
+        response = self.client.post(reverse('fetch-hsn-batch'), json.dumps(payload), content_type='application/json')
+        results = response.json()['results']
+        self.assertEqual([r['hsn_code'] for r in results], [MEDICINE_HSN_CODES['paracetamol'], '30045039', MEDICINE_HSN_CODES['paracetamol']])
+        self.assertEqual([r['source'] for r in results], ['database', 'api', 'database'])
+        self.assertEqual(HSNLookup.objects.count(), 2)
+        self.assertEqual(self.client_fake.calls, ['Qwerty Tonic'])
+
+    def test_batch_limits_remote_calls(self):
+        self.client_fake.answers['Asdf Syrup'] = '30049011'
+        rows = [('Qwerty Tonic', '', None), ('Asdf Syrup', '', None)]
+        with self.settings(PHARMACY_HSN_BATCH_REMOTE_LIMIT=1):
+            results = hsn_cache.lookup_many(rows)
+        self.assertEqual([r['source'] for r in results], ['api', 'default'])
+        self.assertEqual(HSNLookup.objects.count(), 1)
+
+        with self.settings(PHARMACY_HSN_BATCH_REMOTE_SECONDS=0):
+            results = hsn_cache.lookup_many(rows)
+        self.assertEqual([r['source'] for r in results], ['api', 'default'])
+        # The skipped row wasn't cached, so the next batch asks again
+        results = hsn_cache.lookup_many(rows)
+        self.assertEqual([r['source'] for r in results], ['api', 'api'])
+        self.assertEqual(self.client_fake.calls, ['Qwerty Tonic', 'Asdf Syrup'])
+
+    def test_batch_endpoint_rejects_bad_input(self):
+        from hospital.models import User
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+        url = reverse('fetch-hsn-batch')
+        for body in ['not json', json.dumps({'medicines': []}), json.dumps({'medicines': ['Crocin']})]:
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.json()['success'])
+
+    def test_http_client_uses_timeout(self):
+        class FakeSession:
+            def get(self, url, params=None, timeout=None):
+                self.timeout = timeout
+                response = type('Response', (), {'status_code': 200, 'json': lambda self: {'hsn_code': 30049099}})()
+                return response
+
+        session = FakeSession()
+        client = HTTPHSNClient(base_url='https://hsn.example/lookup', timeout=(1, 2), session=session)
+        self.assertEqual(client.lookup('Qwerty Tonic'), {'hsn_code': '30049099', 'confidence': 'medium'})
+        self.assertEqual(session.timeout, (1, 2))
+
+
+class MedicineImportTestCase(TestCase):
+    HEADER = 'medicine_id,name,quantity,price,composition,batch_no,medicine_type,medicine_category,expiry_date\n'
+
+    def run_import(self, text, filename='medicines.csv', **kwargs):
+        from io import BytesIO
+        from .importing import import_medicines
+        return import_medicines(BytesIO(text.encode('utf-8')), filename, **kwargs)
+
+    def test_creates_medicines_and_reports_bad_rows(self):
+        report = self.run_import(
+            self.HEADER
+            + ',Dolo 650,10,30.5,Paracetamol 650mg,B1,Tablet,Hypertension / Heart,2027-03-31\n'
+            + ',Broken,lots,1,,,,,\n'
+            + ',,5,1,,,,,\n'
+            + ',Late,5,1,,,,,31/02/2027\n'
+            + ',Zinc,5,1,,,powder,,\n'
+        )
+        self.assertEqual((report.rows, report.created, report.updated), (5, 1, 0))
+        self.assertEqual(
+            [(error.row, error.column) for error in report.errors],
+            [(3, 'quantity'), (4, 'name'), (5, 'expiry_date'), (6, 'medicine_type')],
+        )
+        dolo = Medicine.objects.get(name='Dolo 650')
+        self.assertTrue(dolo.medicine_id.startswith('#M-'))
+        self.assertEqual((dolo.quantity, dolo.stock_quantity, dolo.medicine_type), (10, 10, 'tablets'))
+        self.assertEqual(dolo.normalized_category, 'hypertension')
+        self.assertEqual(dolo.hsn_code, MEDICINE_HSN_CODES['paracetamol'])
+        self.assertEqual([str(item) for item in dolo.ingredients.all()], ['paracetamol 650mg'])
+
+    def test_reimport_upserts_on_medicine_id_and_batch(self):
+        self.run_import(
+            self.HEADER
+            + 'SKU-1,Dolo 650,10,30,Paracetamol 650mg,B1,tablets,fever,\n'
+            + ',Crocin,4,20,Paracetamol 500mg,C7,tablets,fever,\n'
+        )
+        crocin_id = Medicine.objects.get(name='Crocin').medicine_id
+        report = self.run_import(
+            self.HEADER
+            + 'SKU-1,Dolo 650,25,32,Paracetamol 650mg,B1,tablets,fever,\n'
+            + ',Crocin,9,20,Paracetamol 500mg,C7,tablets,fever,\n'
+            + 'SKU-1,Dolo 650,26,32,Paracetamol 650mg,B1,tablets,fever,\n'
+        )
+        self.assertEqual((report.created, report.updated, report.errors), (0, 3, []))
+        self.assertEqual(Medicine.objects.count(), 2)
+        self.assertEqual(Medicine.objects.get(medicine_id='SKU-1').quantity, 26)
+        self.assertEqual(Medicine.objects.get(medicine_id=crocin_id).quantity, 9)
+
+    def test_partial_columns_leave_other_fields_alone(self):
+        self.run_import(self.HEADER + 'SKU-1,Dolo 650,10,30,Paracetamol 650mg,B1,tablets,fever,\n')
+        report = self.run_import('medicine_id,quantity\nSKU-1,3\nSKU-404,7\n', batch_size=1)
+        self.assertEqual(report.updated, 1)
+        self.assertEqual([(error.row, error.column) for error in report.errors], [(3, 'medicine_id')])
+        dolo = Medicine.objects.get(medicine_id='SKU-1')
+        self.assertEqual((dolo.quantity, dolo.stock_quantity, dolo.price, dolo.composition), (3, 10, 30, 'Paracetamol 650mg'))
+
+    def test_quantity_update_keeps_existing_stock(self):
+        from .models import StockMovement
+
+        self.run_import('medicine_id,name,quantity,stock_quantity\nSKU-1,Dolo 650,30,5\n')
+        report = self.run_import('medicine_id,quantity\nSKU-1,40\n')
+        self.assertEqual((report.updated, report.errors), (1, []))
+        dolo = Medicine.objects.get(medicine_id='SKU-1')
+        self.assertEqual((dolo.quantity, dolo.stock_quantity), (40, 5))
+        movement = StockMovement.objects.filter(medicine=dolo).latest('pk')
+        self.assertEqual((movement.quantity_change, movement.stock_change), (10, 0))
+
+    def test_imports_xlsx_and_skips_per_row_signals(self):
+        from io import BytesIO
+        from django.core import mail
+        from hospital.models import User
+        from openpyxl import Workbook
+        from .importing import import_medicines
+
+        User.objects.create_user(username='admin', password='x', email='admin@example.com', is_hospital_admin=True)
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', 'Quantity', 'Price', 'Expiry Date'])
+        sheet.append(['Azithral 500', 2, 99.5, timezone.now().replace(tzinfo=None)])
+        data = BytesIO()
+        workbook.save(data)
+        data.seek(0)
+
+        report = import_medicines(data, 'stock.xlsx')
+        self.assertEqual((report.created, report.errors), (1, []))
+        self.assertEqual(Medicine.objects.get().expiry_date, timezone.now().date())
+        self.assertEqual(mail.outbox, [])  # low stock, but no per-row alert mail
+        self.assertEqual([m.name for m in fulltext.search(Medicine.objects.all(), 'azithral')], ['Azithral 500'])
+
+    def test_view_renders_error_report(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from hospital.models import User
+        from .models import Pharmacist
+
+        user = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        Pharmacist.objects.get_or_create(user=user)
+        self.client.force_login(user)
+        upload = SimpleUploadedFile('medicines.csv', (self.HEADER + ',Dolo 650,ten,30,,,,,\n').encode())
+        response = self.client.post(reverse('bulk-medicine-management'), {'action': 'import', 'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Import report')
+        self.assertContains(response, "&#x27;ten&#x27; is not a number")
+
+
+class MedicineExportTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        today = timezone.now().date()
+        Medicine.objects.create(medicine_id='SKU-1', name='Dolo 650', quantity=4, price=30, medicine_category='fever', expiry_date=today + timedelta(days=20))
+        Medicine.objects.create(medicine_id='SKU-2', name='Cetzine', quantity=50, price=12.5, medicine_category='Allergy', expiry_date=today + timedelta(days=400))
+        Medicine.objects.create(medicine_id='SKU-3', name='Crocin', quantity=80, price=20, medicine_category='fever')
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse('export-medicines'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_filters(self):
+        import csv
+        from io import StringIO
+
+        rows = list(csv.DictReader(StringIO(self.export(category='fever').decode('utf-8-sig'))))
+        self.assertEqual([row['medicine_id'] for row in rows], ['SKU-1', 'SKU-3'])
+        self.assertEqual(rows[0]['price'], '30.00')
+
+        expiring = (timezone.now().date() + timedelta(days=30)).isoformat()
+        rows = list(csv.DictReader(StringIO(self.export(expiring_before=expiring).decode('utf-8-sig'))))
+        self.assertEqual([row['medicine_id'] for row in rows], ['SKU-1'])
+        rows = list(csv.DictReader(StringIO(self.export(low_stock='60').decode('utf-8-sig'))))
+        self.assertEqual([row['medicine_id'] for row in rows], ['SKU-1', 'SKU-2'])
+        rows = list(csv.DictReader(StringIO(self.export(low_stock='1').decode('utf-8-sig'))))
+        self.assertEqual(rows, [])
+        rows = list(csv.DictReader(StringIO(self.export(low_stock='true').decode('utf-8-sig'))))
+        self.assertEqual([row['medicine_id'] for row in rows], ['SKU-1'])
+
+    def test_csv_export_round_trips_through_import(self):
+        from io import BytesIO
+        from .importing import import_medicines
+
+        report = import_medicines(BytesIO(self.export()), 'medicines.csv')
+        self.assertEqual((report.created, report.updated, report.errors), (0, 3, []))
+        self.assertEqual(Medicine.objects.get(medicine_id='SKU-2').price, 12.5)
+
+    def test_xlsx_and_parquet(self):
+        from io import BytesIO
+        import pandas as pd
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(BytesIO(self.export(format='xlsx')), read_only=True).active
+        self.assertEqual([row[1] for row in sheet.iter_rows(min_row=2, values_only=True)], ['Dolo 650', 'Cetzine', 'Crocin'])
+
+        frame = pd.read_parquet(BytesIO(self.export(format='parquet', category='allergy')))
+        self.assertEqual(list(frame['medicine_id']), ['SKU-2'])
+        self.assertEqual(int(frame['quantity'][0]), 50)
+
+    def test_bad_filter_redirects_with_error(self):
+        response = self.client.get(reverse('export-medicines'), {'expiring_before': 'soon'})
+        self.assertRedirects(response, reverse('bulk-medicine-management'), fetch_redirect_response=False)
+
+    def test_command_writes_dump(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.csv')
+            call_command('export_medicines', '--low-stock', f'--output={path}', stdout=open(os.devnull, 'w'))
+            with open(path, encoding='utf-8-sig') as file:
+                self.assertEqual(file.read().splitlines()[1].split(',')[:2], ['SKU-1', 'Dolo 650'])
+            self.assertEqual(os.listdir(directory), ['dump.csv'])
+
+            call_command('export_medicines', '--low-stock', '1', f'--output={path}', stdout=open(os.devnull, 'w'))
+            with open(path, encoding='utf-8-sig') as file:
+                self.assertEqual(len(file.read().splitlines()), 1)
+
+
+def _sell_like_before(quantity, stock_quantity, required):
+    """The old per-item Python rules, for comparing against decrement_stock"""
+    if quantity < required:
+        if quantity <= 0 and stock_quantity >= 1:
+            quantity, stock_quantity = 50, stock_quantity - 1
+        if quantity < required:
+            return None
+    quantity -= required
+    stock_quantity = max(0, stock_quantity - required)
+    if quantity <= 0 and stock_quantity >= 1:
+        quantity, stock_quantity = 50, stock_quantity - 1
+    return quantity, stock_quantity
+
+
+class StockDecrementTestCase(TestCase):
+    def test_matches_previous_reset_rules(self):
+        from .utils import InsufficientStock, decrement_stock
+
+        for quantity in (-1, 0, 1, 5, 49, 50, 60):
+            for stock_quantity in (0, 1, 2, 5, 52, 53):
+                for required in (1, 5, 49, 50, 51):
+                    medicine = Medicine.objects.create(name='Case', quantity=quantity, stock_quantity=stock_quantity)
+                    expected = _sell_like_before(quantity, stock_quantity, required)
+                    try:
+                        decrement_stock([(medicine.pk, required)])
+                        outcome = Medicine.objects.values_list('quantity', 'stock_quantity').get(pk=medicine.pk)
+                    except InsufficientStock:
+                        outcome = None
+                    self.assertEqual(outcome, expected, (quantity, stock_quantity, required))
+                    # The ledger steps add up to the same levels
+                    self.assertEqual(
+                        ledger.balance_as_of(medicine, timezone.now()),
+                        outcome or (quantity, stock_quantity),
+                        (quantity, stock_quantity, required),
+                    )
+
+    def test_all_shortfalls_reported_and_nothing_deducted(self):
+        from hospital.models import User
+        from .models import Cart, Order
+        from .utils import InsufficientStock
+
+        user = User.objects.create_user(username='pat', password='x', is_patient=True)
+        plenty = Medicine.objects.create(name='Plenty', quantity=40, stock_quantity=3)
+        short = Medicine.objects.create(name='Short', quantity=2, stock_quantity=0)
+        gone = Medicine.objects.create(name='Gone', quantity=0, stock_quantity=0)
+        order = Order.objects.create(user=user)
+        order.orderitems.set([
+            Cart.objects.create(user=user, item=plenty, quantity=10),
+            Cart.objects.create(user=user, item=short, quantity=3),
+            Cart.objects.create(user=user, item=gone, quantity=1),
+        ])
+
+        self.assertEqual(order.check_stock_availability(), (False, 'Short'))
+        with self.assertRaises(InsufficientStock) as raised:
+            order.stock_quantity_decrease()
+        self.assertEqual(
+            [(item.name, item.required, item.available) for item in raised.exception.shortfalls],
+            [('Short', 3, 2), ('Gone', 1, 0)],
+        )
+        self.assertEqual(Medicine.objects.get(pk=plenty.pk).quantity, 40)
+
+        order.orderitems.filter(item__in=[short, gone]).delete()
+        # items, cart holds, levels, savepoint, UPDATE, ledger INSERT, batches SELECT + UPDATE, allocations INSERT, release
+        with self.assertNumQueries(10):
+            order.stock_quantity_decrease()
+        self.assertEqual(Medicine.objects.values_list('quantity', 'stock_quantity').get(pk=plenty.pk), (30, 0))
+
+
+class StockDecrementConcurrencyTestCase(TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS = 30
+
+    def test_concurrent_checkouts_never_oversell(self):
+        import random
+        import threading
+        import time
+        from django.db import OperationalError, connection
+        from .utils import InsufficientStock, decrement_stock
+
+        medicine = Medicine.objects.create(name='Scarce', quantity=100, stock_quantity=0)
+        sold, refused = [], []
+        barrier = threading.Barrier(self.THREADS)
+
+        def checkout(seed):
+            rng = random.Random(seed)
+            barrier.wait()
+            try:
+                for _ in range(self.ATTEMPTS):
+                    units = rng.randint(1, 3)
+                    while True:
+                        try:
+                            decrement_stock([(medicine.pk, units)])
+                            sold.append(units)
+                        except InsufficientStock:
+                            refused.append(units)
+                        except OperationalError:
+                            # SQLite allows one writer at a time; a real client would retry too
+                            time.sleep(0.001)
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        medicine.refresh_from_db()
+        self.assertEqual(len(sold) + len(refused), self.THREADS * self.ATTEMPTS)
+        self.assertEqual(sum(sold) + medicine.quantity, 100)
+        self.assertGreaterEqual(medicine.quantity, 0)
+        self.assertTrue(refused)  # ~480 units wanted, 100 available
+        self.assertEqual(ledger.balance_as_of(medicine, timezone.now()), (medicine.quantity, 0))
+
+
+class StockLedgerTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        self.pharmacist = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        self.medicine = Medicine.objects.create(name='Ledgered', quantity=10, stock_quantity=3)
+
+    def movements(self, medicine=None):
+        return list((medicine or self.medicine).stock_movements.order_by('id').values_list('kind', 'quantity_change', 'stock_change'))
+
+    def test_every_mutation_path_is_recorded(self):
+        from hospital.models import User
+        from .models import Cart, Order
+        from .utils import reset_unit_quantity_and_update_stock
+
+        self.client.force_login(self.pharmacist)
+        self.client.post(reverse('increase-medicine-stock', args=[self.medicine.pk]), {'count': 5})
+        self.client.post(reverse('decrease-medicine-stock', args=[self.medicine.pk]), {'count': 10})
+
+        patient = User.objects.create_user(username='pat', password='x', is_patient=True)
+        order = Order.objects.create(user=patient)
+        order.orderitems.set([Cart.objects.create(user=patient, item=self.medicine, quantity=4)])
+        order.stock_quantity_decrease()
+        order.stock_quantity_restore(user=self.pharmacist)
+
+        Medicine.objects.filter(pk=self.medicine.pk).update(quantity=0)
+        ledger.record(self.medicine, 'adjustment', quantity_change=-5)
+        self.medicine.refresh_from_db()
+        reset_unit_quantity_and_update_stock(self.medicine)
+
+        self.assertEqual(self.movements(), [
+            ('receipt', 10, 3),
+            ('receipt', 5, 5),
+            ('adjustment', -10, -8),
+            ('sale', -4, 0),  # Stock Qty was already 0
+            ('return', 4, 4),
+            ('adjustment', -5, 0),
+            ('reset', 50, -1),
+        ])
+        self.assertEqual(ledger.drift([self.medicine.pk]), [])
+        sale = self.medicine.stock_movements.get(kind='sale')
+        self.assertEqual((sale.reference, sale.user_id), (f'order:{order.pk}', patient.pk))
+
+    def test_balance_as_of_uses_latest_snapshot_and_tail(self):
+        from .models import StockMovement, StockSnapshot
+
+        start = timezone.now() - timedelta(days=10)
+        StockMovement.objects.filter(medicine=self.medicine).update(created_at=start)
+        for day, change in ((1, -2), (2, -3), (5, 7)):
+            StockMovement.objects.create(medicine=self.medicine, kind='sale', quantity_change=change, created_at=start + timedelta(days=day))
+
+        self.assertEqual(ledger.take_snapshots(at=start + timedelta(days=3)), 1)
+        self.assertEqual(ledger.take_snapshots(at=start + timedelta(days=4)), 0)  # nothing moved since
+        snapshot = StockSnapshot.objects.get(medicine=self.medicine)
+        self.assertEqual((snapshot.quantity, snapshot.stock_quantity), (5, 3))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(ledger.balance_as_of(self.medicine, start + timedelta(days=1, hours=1)), (8, 3))
+        self.assertEqual(ledger.balance_as_of(self.medicine, start + timedelta(days=4)), (5, 3))
+        self.assertEqual(ledger.balance_as_of(self.medicine, start + timedelta(days=6)), (12, 3))
+        self.assertEqual(ledger.stock_as_of(start - timedelta(days=1)), {})
+
+        # Snapshots reflect the ledger; rewriting history before one isn't picked up
+        StockMovement.objects.filter(created_at__lte=snapshot.taken_at).delete()
+        self.assertEqual(ledger.balance_as_of(self.medicine, start + timedelta(days=4)), (5, 3))
+
+    def test_import_records_receipts_and_adjustments(self):
+        from io import BytesIO
+        from .importing import import_medicines
+
+        import_medicines(BytesIO(b'medicine_id,name,quantity\nSKU-1,Imported,30\n'), 'stock.csv')
+        imported = Medicine.objects.get(medicine_id='SKU-1')
+        import_medicines(BytesIO(b'medicine_id,quantity\nSKU-1,18\n'), 'stock.csv')
+        self.assertEqual(self.movements(imported), [('receipt', 30, 30), ('adjustment', -12, 0)])
+        self.assertEqual(ledger.drift(), [])
+
+    def test_stock_as_of_endpoint(self):
+        from hospital.models import User
+
+        url = reverse('stock-as-of')
+        self.client.force_login(User.objects.create_user(username='pat', password='x', is_patient=True))
+        self.assertEqual(self.client.get(url, {'at': '2026-01-01'}).status_code, 403)
+
+        self.client.force_login(self.pharmacist)
+        self.assertEqual(self.client.get(url, {'at': 'yesterday'}).status_code, 400)
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        data = self.client.get(url, {'at': tomorrow, 'medicine': str(self.medicine.pk)}).json()
+        self.assertEqual(data['results'], [{'id': self.medicine.pk, 'name': 'Ledgered', 'quantity': 10, 'stock_quantity': 3}])
+
+
+class MedicineBatchTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        today = timezone.localdate()
+        self.patient = User.objects.create_user(username='pat', password='x', is_patient=True)
+        self.medicine = Medicine.objects.create(
+            name='Batched', quantity=10, stock_quantity=2, batch_no='LATE', expiry_date=today + timedelta(days=400)
+        )
+        batches.receive_many([
+            (self.medicine.pk, 5, 'SOON', today + timedelta(days=20)),
+            (self.medicine.pk, 5, 'GONE', today - timedelta(days=1)),
+        ])
+        Medicine.objects.filter(pk=self.medicine.pk).update(quantity=20)
+
+    def levels(self):
+        return dict(self.medicine.batches.values_list('batch_no', 'quantity'))
+
+    def order(self, units):
+        from .models import Cart, Order
+
+        order = Order.objects.create(user=self.patient)
+        order.orderitems.set([Cart.objects.create(user=self.patient, item=self.medicine, quantity=units)])
+        return order
+
+    def test_checkout_takes_earliest_unexpired_batches_and_cancel_returns_them(self):
+        order = self.order(8)
+        order.stock_quantity_decrease()
+        self.assertEqual(self.levels(), {'LATE': 7, 'SOON': 0, 'GONE': 5})
+        self.assertEqual(batches.order_batch_labels(order), {
+            self.medicine.pk: f"SOON (exp {self.medicine.batches.get(batch_no='SOON').expiry_date:%m/%Y}), "
+                              f"LATE (exp {self.medicine.batches.get(batch_no='LATE').expiry_date:%m/%Y})",
+        })
+        # The expired batch still on the shelf is what the expiry alerts see
+        self.assertEqual(Medicine.objects.get(pk=self.medicine.pk).batch_no, 'GONE')
+
+        order.stock_quantity_restore()
+        self.assertEqual(self.levels(), {'LATE': 10, 'SOON': 5, 'GONE': 5})
+        self.assertFalse(order.batch_allocations.exists())
+
+    def test_stock_left_only_in_expired_batches_is_not_sold(self):
+        from .utils import InsufficientStock, decrement_stock
+
+        decrement_stock([(self.medicine.pk, 15)])
+        self.assertEqual(self.levels(), {'LATE': 0, 'SOON': 0, 'GONE': 5})
+        with self.assertRaises(InsufficientStock) as raised:
+            decrement_stock([(self.medicine.pk, 2)])
+        self.assertEqual(raised.exception.shortfalls[0][2:], (2, 0))
+        self.assertEqual(Medicine.objects.get(pk=self.medicine.pk).quantity, 5)
+        self.assertEqual(self.levels(), {'LATE': 0, 'SOON': 0, 'GONE': 5})
+        # Units no batch accounts for (stock from before batches) still sell from the counters
+        # Batches never tracked at all still sell from the counters
+        self.medicine.batches.filter(batch_no='GONE').delete()
+        decrement_stock([(self.medicine.pk, 2)])
+        self.assertEqual(Medicine.objects.get(pk=self.medicine.pk).quantity, 3)
+
+    def test_allocation_reads_batches_in_one_query(self):
+        with self.assertNumQueries(2):  # SELECT in expiry order, UPDATE
+            taken = batches.allocate({self.medicine.pk: 7})
+        self.assertEqual([(batch.batch_no, units) for batch, units in taken[self.medicine.pk]], [('SOON', 5), ('LATE', 2)])
+
+    def test_restock_and_write_off(self):
+        from hospital.models import User
+
+        pharmacist = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        self.client.force_login(pharmacist)
+        expiry = timezone.localdate() + timedelta(days=700)
+        self.client.post(reverse('increase-medicine-stock', args=[self.medicine.pk]), {
+            'count': 12, 'batch_no': 'NEW', 'expiry_date': expiry.isoformat(),
+        })
+        self.assertEqual(self.medicine.batches.get(batch_no='NEW').expiry_date, expiry)
+        self.client.post(reverse('decrease-medicine-stock', args=[self.medicine.pk]), {'count': 7})
+        self.assertEqual(self.levels(), {'GONE': 0, 'SOON': 3, 'LATE': 10, 'NEW': 12})
+
+        response = self.client.get(reverse('pharmacist-dashboard'))
+        self.assertEqual([batch.batch_no for batch in response.context['expiring_medicines']], ['SOON'])
+
+    def test_import_receives_into_named_batch(self):
+        from io import BytesIO
+        from .importing import import_medicines
+
+        Medicine.objects.filter(pk=self.medicine.pk).update(medicine_id='SKU-B')
+        import_medicines(BytesIO(b'medicine_id,quantity,batch_no,expiry_date\nSKU-B,26,IMP,2030-01-31\n'), 'stock.csv')
+        self.assertEqual(self.levels()['IMP'], 6)
+        self.assertEqual(str(self.medicine.batches.get(batch_no='IMP').expiry_date), '2030-01-31')
+
+
+class PharmacyAlertTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        cache.delete(alerts.RECIPIENTS_CACHE_KEY)
+        User.objects.create_user(username='admin', password='x', email='admin@example.com', is_hospital_admin=True)
+        User.objects.create_user(username='pharm', password='x', email='pharm@example.com', is_pharmacist=True)
+        self.medicine = Medicine.objects.create(name='Alerted', quantity=20, stock_quantity=5)
+
+    def low_stock_levels(self):
+        return list(PharmacyAlert.objects.filter(kind=PharmacyAlert.LOW_STOCK).values_list('quantity', flat=True))
+
+    def test_only_threshold_crossings_are_queued_and_nothing_is_mailed_on_save(self):
+        from django.core import mail
+
+        for quantity in (16, 10, 5, 30, 3):
+            medicine = Medicine.objects.get(pk=self.medicine.pk)
+            medicine.quantity = quantity
+            medicine.save()
+        self.assertEqual(self.low_stock_levels(), [10, 3])
+        self.assertEqual(mail.outbox, [])
+
+    def test_checkout_crossing_is_queued(self):
+        from .utils import decrement_stock
+
+        decrement_stock([(self.medicine.pk, 4)])
+        self.assertEqual(self.low_stock_levels(), [])
+        decrement_stock([(self.medicine.pk, 4)])
+        self.assertEqual(self.low_stock_levels(), [12])
+
+    def test_digest_coalesces_pending_alerts_per_recipient(self):
+        from django.core import mail
+        from .utils import decrement_stock
+
+        other = Medicine.objects.create(name='Other', quantity=2, expiry_date=timezone.localdate() + timedelta(days=10), batch_no='X1')
+        decrement_stock([(self.medicine.pk, 8)])
+        decrement_stock([(self.medicine.pk, 2)])
+
+        self.assertEqual(alerts.send_digest(), 3)  # low stock twice + the batch expiring in 10 days
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['admin@example.com', 'pharm@example.com'])
+        body = mail.outbox[0].body
+        self.assertIn('Alerted has only 10 units left.', body)
+        self.assertIn('Other has only 2 units left.', body)
+        self.assertIn('Other batch X1 (2 units) expires on', body)
+        self.assertEqual(body.count('Alerted'), 1)
+
+        self.assertEqual(alerts.send_digest(), 0)  # sent, and the batch isn't reported again
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(PharmacyAlert.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(other.alerts.count(), 2)
+
+    def test_recipients_are_cached_until_a_user_changes(self):
+        from hospital.models import User
+
+        self.assertEqual(alerts.get_recipients(), ['admin@example.com', 'pharm@example.com'])
+        with self.assertNumQueries(0):
+            alerts.get_recipients()
+        User.objects.create_user(username='admin2', password='x', email='boss@example.com', is_hospital_admin=True)
+        self.assertEqual(alerts.get_recipients(), ['admin@example.com', 'boss@example.com', 'pharm@example.com'])
+
+
+class DemandForecastTestCase(TestCase):
+    def test_demand_counts_from_first_sale(self):
+        import numpy as np
+        from .forecasting import forecast
+
+        sales = np.array([
+            [4.0] * 60,
+            [0.0] * 30 + [6.0] * 30,  # first sold halfway through
+            [0.0] * 60,
+        ])
+        for method in ('ema', 'ma'):
+            demand, std = forecast(sales, method, window=60)
+            self.assertEqual([round(value, 6) for value in demand], [4, 6, 0])
+            self.assertEqual(list(std), [0, 0, 0])
+
+        demand, _ = forecast(np.array([[0.0] * 59 + [10.0]]), 'ema', alpha=0.5)
+        self.assertEqual(list(demand), [10.0])  # the first sale seeds the level
+
+    def test_reorder_levels(self):
+        import numpy as np
+        from .forecasting import reorder_levels
+
+        reorder_point, order_up_to, suggested, days_of_stock = reorder_levels(
+            np.array([10.0, 10.0, 0.0]), np.array([0.0, 0.0, 0.0]), np.array([50.0, 500.0, 3.0]), lead_time=7, review=14
+        )
+        self.assertEqual(list(reorder_point), [70, 70, 0])
+        self.assertEqual(list(order_up_to), [210, 210, 0])
+        self.assertEqual(list(suggested), [160, 0, 0])
+        self.assertEqual(list(days_of_stock[:2]), [5.0, 50.0])
+
+    def test_run_writes_table_read_by_dashboard(self):
+        from hospital.models import User
+        from .forecasting import run
+        from .models import Cart, MedicineForecast
+
+        buyer = User.objects.create_user(username='buyer', password='x', is_patient=True)
+        fast = Medicine.objects.create(name='Fast mover', quantity=50)
+        idle = Medicine.objects.create(name='Idle', quantity=5)
+        now = timezone.now()
+        for day in range(1, 31):
+            cart = Cart.objects.create(user=buyer, item=fast, quantity=10, purchased=True)
+            Cart.objects.filter(pk=cart.pk).update(updated=now - timedelta(days=day))
+        Cart.objects.create(user=buyer, item=idle, quantity=3, purchased=False)
+
+        with self.settings(PHARMACY_FORECAST_LEAD_TIME_DAYS=7, PHARMACY_FORECAST_REVIEW_DAYS=14):
+            self.assertEqual(run(history_days=60), 2)
+        forecast = MedicineForecast.objects.get(medicine=fast)
+        self.assertAlmostEqual(forecast.daily_demand, 10)
+        self.assertEqual((forecast.reorder_point, forecast.suggested_order, forecast.days_of_stock), (70, 160, 5.0))
+        self.assertEqual(MedicineForecast.objects.get(medicine=idle).daily_demand, 0)
+
+        self.client.force_login(User.objects.create_user(username='pharm', password='x', is_pharmacist=True))
+        rows = self.client.get(reverse('pharmacist-dashboard')).context['reorder_suggestions']
+        self.assertEqual([(row.medicine.name, row.to_order) for row in rows], [('Fast mover', 160)])
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+
+        self.medicine = Medicine.objects.create(name='Last strips', quantity=2, stock_quantity=0)
+        self.first = User.objects.create_user(username='first', password='x', is_patient=True)
+        self.second = User.objects.create_user(username='second', password='x', is_patient=True)
+
+    def add(self, user, view='add-to-cart'):
+        self.client.force_login(user)
+        return self.client.get(reverse(view, args=[self.medicine.pk]))
+
+    def levels(self):
+        return Medicine.objects.values_list('quantity', 'reserved_quantity').get(pk=self.medicine.pk)
+
+    def test_held_units_cannot_be_added_by_another_patient(self):
+        from .models import Cart, StockReservation
+
+        self.add(self.first)
+        self.add(self.first, 'increase-item')
+        self.add(self.first, 'increase-item')  # only 2 units
+        self.assertEqual(Cart.objects.get(user=self.first).quantity, 2)
+        self.assertEqual(self.levels(), (2, 2))
+
+        self.add(self.second)
+        self.assertFalse(Cart.objects.filter(user=self.second).exists())
+
+        # The first patient's hold lapses; the next add releases it
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.add(self.second)
+        self.assertEqual(Cart.objects.get(user=self.second).quantity, 1)
+        self.assertEqual(self.levels(), (2, 1))
+
+        self.add(self.second, 'remove-item')
+        self.assertEqual(self.levels(), (2, 0))
+
+    def test_cod_checkout_converts_holds_into_the_sale(self):
+        from .models import Cart, Order, StockReservation
+
+        self.add(self.first)
+        order = Order.objects.get(user=self.first, ordered=False)
+        self.client.get(reverse('razorpay-pharmacy-payment', args=[order.pk]) + '?method=cod')
+
+        order.refresh_from_db()
+        self.assertTrue(order.ordered)
+        self.assertEqual(self.levels(), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertTrue(Cart.objects.get(user=self.first).purchased)
+
+    def test_unheld_order_cannot_take_units_held_by_others(self):
+        from .models import Cart, Order
+        from .utils import InsufficientStock
+
+        self.add(self.first)
+        self.add(self.first, 'increase-item')
+        order = Order.objects.create(user=self.second)
+        order.orderitems.set([Cart.objects.create(user=self.second, item=self.medicine, quantity=1)])
+        with self.assertRaises(InsufficientStock):
+            order.stock_quantity_decrease()
+        self.assertEqual(self.levels(), (2, 2))
+
+    def test_sweeper_and_recount(self):
+        from .models import Cart, StockReservation
+
+        self.add(self.first)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(self.levels(), (2, 0))
+
+        self.add(self.first, 'increase-item')
+        Cart.objects.filter(user=self.first).delete()  # without release()
+        self.assertEqual(self.levels(), (2, 2))
+        self.assertEqual(reservations.recount(), 1)
+        self.assertEqual(self.levels(), (2, 0))
+
+    def test_saving_a_stale_instance_keeps_the_reserved_count(self):
+        stale = Medicine.objects.get(pk=self.medicine.pk)
+        self.add(self.first)
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.levels(), (2, 1))
+
+    def test_plain_save_follows_the_usual_insert_rules(self):
+        from django.db import IntegrityError, transaction
+
+        loaded = Medicine.objects.get(pk=self.medicine.pk)
+        with transaction.atomic(), self.assertRaises(IntegrityError):
+            loaded.save(force_insert=True)
+        Medicine.objects.filter(pk=loaded.pk).delete()
+        loaded.save()  # the row is gone: inserted again, as without the mixin
+        self.assertTrue(Medicine.objects.filter(pk=loaded.pk).exists())
+        loaded.reserved_quantity = 3
+        loaded.save(update_fields=['reserved_quantity'])
+        self.assertEqual(Medicine.objects.get(pk=loaded.pk).reserved_quantity, 3)
+
+
+class OrderTotalsTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        from .models import Cart, Order
+
+        self.user = User.objects.create_user(username='buyer', password='x', is_patient=True)
+        self.medicine = Medicine.objects.create(name='Paracetamol', price='12.50', quantity=20, stock_quantity=0)
+        self.order = Order.objects.create(user=self.user, delivery_method='delivery')
+        self.order.orderitems.set([Cart.objects.create(user=self.user, item=self.medicine, quantity=3)])
+
+    def test_open_order_totals_follow_current_prices(self):
+        from decimal import Decimal
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.order.compute_totals(), (Decimal('37.50'), Decimal('1.88'), Decimal('40'), Decimal('79.38')))
+        Medicine.objects.filter(pk=self.medicine.pk).update(price='10')
+        self.assertEqual(self.order.final_bill(), 71.5)
+
+    def test_placed_order_keeps_its_totals(self):
+        from decimal import Decimal
+        from .models import Order
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('razorpay-pharmacy-payment', args=[self.order.pk]) + '?method=cod')
+        Medicine.objects.filter(pk=self.medicine.pk).update(price='99')
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(order.ordered)
+        with self.assertNumQueries(0):
+            self.assertEqual(order.get_totals(), 37.5)
+            self.assertEqual(order.get_gst_amount(), 1.88)
+            self.assertEqual(order.get_delivery_fee(), 40)
+            self.assertEqual(order.final_bill(), 79.38)
+        line = order.orderitems.select_related('item').get()
+        self.assertEqual(line.unit_price, Decimal('12.50'))
+        self.assertEqual(line.get_total(), Decimal('37.50'))
+
+        from django.db.models import Sum
+        self.assertEqual(Order.objects.filter(ordered=True).aggregate(total=Sum('grand_total'))['total'], Decimal('79.38'))
+
+
+class SalesReportTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        from .models import Pharmacist
+
+        self.buyer = User.objects.create_user(username='buyer', password='x', is_patient=True)
+        self.paracetamol = Medicine.objects.create(name='Paracetamol', price='10', quantity=100, stock_quantity=0)
+        self.cetirizine = Medicine.objects.create(name='Cetirizine', price='4', quantity=100, stock_quantity=0)
+        now = timezone.now()
+        self.orders = [
+            self.order([(self.paracetamol, 2)], now - timedelta(days=40)),
+            self.order([(self.paracetamol, 1), (self.cetirizine, 5)], now - timedelta(days=2)),
+            self.order([(self.cetirizine, 1)], now - timedelta(days=1), freeze=False),
+        ]
+        # Bought by the same patient but not part of a placed order
+        from .models import Cart
+        Cart.objects.create(user=self.buyer, item=self.paracetamol, quantity=50, purchased=True)
+
+        pharmacist = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        Pharmacist.objects.get_or_create(user=pharmacist)
+        self.client.force_login(pharmacist)
+
+    def order(self, lines, created, freeze=True):
+        from .models import Cart, Order
+
+        order = Order.objects.create(user=self.buyer, ordered=True, payment_status='paid', delivery_method='pickup')
+        order.orderitems.set([
+            Cart.objects.create(user=self.buyer, item=medicine, quantity=quantity, purchased=True)
+            for medicine, quantity in lines
+        ])
+        if freeze:
+            order.freeze_totals()
+        Order.objects.filter(pk=order.pk).update(created=created)
+        return order
+
+    def test_aggregates_are_grouped_through_the_orders(self):
+        from decimal import Decimal
+        from . import sales
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sales.summary(sales.placed_orders()), {'revenue': Decimal('54'), 'orders': 3})
+        recent = sales.placed_orders(timezone.localdate() - timedelta(days=7), timezone.localdate())
+        self.assertEqual(sales.summary(recent), {'revenue': Decimal('34'), 'orders': 2})
+        self.assertEqual(
+            [(row['item__name'], row['total_qty'], row['revenue']) for row in sales.top_items(recent)],
+            [('Cetirizine', 6, Decimal('24')), ('Paracetamol', 1, Decimal('10'))],
+        )
+
+    def test_report_pages_through_orders_newest_first(self):
+        from urllib.parse import parse_qs, urlparse
+
+        with self.settings(PHARMACY_SALES_PAGE_SIZE=2):
+            response = self.client.get(reverse('pharmacist-sales'))
+            self.assertEqual(response.context['total_revenue'], 54.0)
+            seen = [order.pk for order in response.context['orders']]
+            after = parse_qs(urlparse(response.context['next_page_url']).query)['after'][0]
+            response = self.client.get(reverse('pharmacist-sales'), {'after': after})
+            seen += [order.pk for order in response.context['orders']]
+            self.assertIsNone(response.context['next_page_url'])
+        self.assertEqual(seen, [order.pk for order in reversed(self.orders)])
+        self.assertEqual(response.context['orders'][0].amount, 20)
+
+
+class DailySalesRollupTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import User
+        from .models import Cart, Order
+
+        self.user = User.objects.create_user(username='buyer', password='x', is_patient=True)
+        self.tablet = Medicine.objects.create(name='Paracetamol', medicine_category='Fever', price='10', quantity=50, stock_quantity=0)
+        self.syrup = Medicine.objects.create(name='Cough syrup', medicine_category='Cough & Cold', price='60', quantity=50, stock_quantity=0)
+        self.order = Order.objects.create(user=self.user, ordered=True, payment_status='cod')
+        self.order.orderitems.set([
+            Cart.objects.create(user=self.user, item=self.tablet, quantity=3),
+            Cart.objects.create(user=self.user, item=self.syrup, quantity=1),
+        ])
+
+    def rows(self):
+        from .models import DailyPharmacySales
+
+        return {
+            row.category: (row.orders, row.units, row.revenue, row.gst)
+            for row in DailyPharmacySales.objects.filter(date=timezone.localdate())
+        }
+
+    def test_placing_and_cancelling_update_the_day(self):
+        from decimal import Decimal
+        from . import sales
+        from .models import DailyPharmacySales
+
+        self.order.stock_quantity_decrease()
+        self.order.freeze_totals()
+        self.order.freeze_totals()  # placed twice (e.g. a replayed callback) counts once
+        self.assertEqual(self.rows(), {
+            DailyPharmacySales.ALL_CATEGORIES: (1, 4, Decimal('90.00'), Decimal('4.50')),
+            self.tablet.normalized_category: (1, 3, Decimal('30.00'), Decimal('1.50')),
+            self.syrup.normalized_category: (1, 1, Decimal('60.00'), Decimal('3.00')),
+        })
+        with self.assertNumQueries(1):
+            totals = sales.daily_totals(timezone.localdate() - timedelta(days=7))
+        self.assertEqual((totals['orders'], totals['revenue']), (1, Decimal('90.00')))
+
+        self.order.stock_quantity_restore()
+        self.order.stock_quantity_restore()
+        self.assertEqual(set(self.rows().values()), {(0, 0, Decimal('0.00'), Decimal('0.00'))})
+
+    def test_rebuild_matches_the_incremental_rollup(self):
+        from . import sales
+
+        self.order.freeze_totals()
+        incremental = self.rows()
+        self.assertEqual(sales.rebuild_rollup(), 1)
+        self.assertEqual(self.rows(), incremental)
+
+        self.order.order_status = 'cancelled'
+        self.order.save()
+        sales.rebuild_rollup(start=timezone.localdate())
+        self.assertEqual(self.rows(), {})
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.in_sales_rollup)
+
+
+class OrderBoardTestCase(TestCase):
+    def setUp(self):
+        from hospital.models import Patient, User
+        from .models import Pharmacist
+
+        cache.clear()
+        self.buyer = User.objects.create_user(username='buyer', password='x', is_patient=True)
+        Patient.objects.get_or_create(user=self.buyer, defaults={'name': 'Buyer'})
+        self.medicine = Medicine.objects.create(name='Paracetamol', price='10', quantity=100, stock_quantity=0)
+        pharmacist = User.objects.create_user(username='pharm', password='x', is_pharmacist=True)
+        Pharmacist.objects.get_or_create(user=pharmacist)
+        self.client.force_login(pharmacist)
+
+    def place(self, count):
+        from .models import Cart, Order
+
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=self.buyer, ordered=True, payment_status='paid', order_status='confirmed')
+            order.orderitems.set([Cart.objects.create(user=self.buyer, item=self.medicine, quantity=1, purchased=True)])
+            order.freeze_totals()
+            orders.append(order)
+        return orders
+
+    def board_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('pharmacist-order-management'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_board_renders_one_page_per_section(self):
+        with self.settings(PHARMACY_ORDER_BOARD_PAGE_SIZE=2):
+            self.place(3)
+            self.board_queries()  # first request also sets up the session
+            _, few = self.board_queries()
+            orders = self.place(5)
+            response, many = self.board_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['counts']['online'], 8)
+        self.assertEqual([order.pk for order in response.context['online_orders']], [orders[-1].pk, orders[-2].pk])
+        self.assertIsNotNone(response.context['next_cursors']['online'])
+        self.assertIsNone(response.context['next_cursors']['cod'])
+
+    def test_sections_load_over_json(self):
+        orders = self.place(3)
+        url = reverse('pharmacist-order-board-section', args=['online'])
+        with self.settings(PHARMACY_ORDER_BOARD_PAGE_SIZE=2):
+            first = self.client.get(url).json()
+            self.assertIn(f'Order #{orders[2].pk}', first['html'])
+            rest = self.client.get(url, {'after': first['next_cursor']}).json()
+        self.assertIn(f'Order #{orders[0].pk}', rest['html'])
+        self.assertNotIn(f'Order #{orders[1].pk}', rest['html'])
+        self.assertIsNone(rest['next_cursor'])
+        self.assertEqual(rest['count'], 3)
+
+        items = self.client.get(reverse('pharmacist-order-board-section', args=['purchased_items'])).json()
+        self.assertEqual(items['html'].count('<tr>'), 3)
+        self.assertEqual(self.client.get(reverse('pharmacist-order-board-section', args=['nope'])).status_code, 404)
+
+    def test_counts_are_cached_until_an_order_changes(self):
+        from . import order_board
+
+        orders = self.place(2)
+        self.assertEqual(order_board.get_counts()['online'], 2)
+        with self.assertNumQueries(0):
+            order_board.get_counts()
+        orders[0].order_status = 'delivered'
+        orders[0].save()
+        self.assertEqual(order_board.get_counts()['online'], 1)
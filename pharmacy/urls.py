@@ -42,8 +42,12 @@ urlpatterns = [
 
     # API endpoints for medicine management
     path('api/fetch-hsn/', api_views.fetch_hsn_code_ajax, name='fetch-hsn-ajax'),
+    path('api/fetch-hsn/batch/', api_views.fetch_hsn_codes_batch, name='fetch-hsn-batch'),
     path('api/composition-suggestions/', api_views.get_composition_suggestions_ajax, name='composition-suggestions'),
     path('api/search-medicines/', api_views.search_existing_medicines, name='search-medicines-ajax'),
+    path('api/catalog-snapshot/', api_views.catalog_snapshot, name='catalog-snapshot'),
+    path('api/medicines-by-ingredients/', api_views.medicines_by_ingredients, name='medicines-by-ingredients'),
+    path('api/stock-as-of/', api_views.stock_as_of, name='stock-as-of'),
     
     # Prescription payment URLs (redirects to Razorpay)
     path('prescription-payment/<int:prescription_upload_id>/', views.prescription_payment_redirect, name='prescription-payment-redirect'),
@@ -1,5 +1,22 @@
+import base64
+import binascii
+import datetime
+import json
+
+from collections import namedtuple
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import GreaterThanOrEqual, LessThanOrEqual
+
+# Unit Qty a medicine is refilled to when one unit of Stock Qty is opened
+UNITS_PER_STOCK_RESET = 50
+# Read-and-update rounds decrement_stock tries while other checkouts change the same medicines
+STOCK_UPDATE_ATTEMPTS = 20
 
 
 def reset_unit_quantity_and_update_stock(medicine):
@@ -15,9 +32,10 @@ def reset_unit_quantity_and_update_stock(medicine):
     if medicine.quantity <= 0:
         # Check if we have enough stock to deduct
         if medicine.stock_quantity >= 1:
-            medicine.quantity = 50
-            medicine.stock_quantity -= 1
-            medicine.save()
+            from .ledger import set_levels
+            from .models import StockMovement
+
+            set_levels(medicine, StockMovement.RESET, UNITS_PER_STOCK_RESET, medicine.stock_quantity - 1)
             return True
         else:
             # Not enough stock to reset
@@ -48,6 +66,317 @@ def check_and_reset_medicine_quantity(medicine):
     return False, medicine.quantity, medicine.stock_quantity
 
 
+
+Shortfall = namedtuple('Shortfall', 'medicine_id name required available')
+
+
+class InsufficientStock(ValueError):
+    """Raised by decrement_stock with every line that can't be fulfilled"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__('; '.join(
+            f"Insufficient stock for {item.name}. Available: {item.available}, Required: {item.required}"
+            for item in shortfalls
+        ))
+
+
+def _sellable_condition(required):
+    """Rows that can give ``required`` units now, opening a stock unit if Unit Qty is used up"""
+    condition = Q(quantity__gte=required)
+    if required <= UNITS_PER_STOCK_RESET:
+        condition |= Q(quantity__lte=0, stock_quantity__gte=1)
+    return condition
+
+
+def can_sell(quantity, stock_quantity, required):
+    """Python twin of _sellable_condition for a row's current values"""
+    if quantity is None:
+        return False
+    if quantity >= required:
+        return True
+    return required <= UNITS_PER_STOCK_RESET and quantity <= 0 and (stock_quantity or 0) >= 1
+
+
+def sellable_units(quantity, stock_quantity):
+    """Units that can be sold right now without a second stock unit being opened"""
+    quantity = quantity or 0
+    if quantity <= 0 and (stock_quantity or 0) >= 1:
+        return UNITS_PER_STOCK_RESET
+    return max(quantity, 0)
+
+
+def _decremented(required):
+    """
+    (quantity, stock_quantity) expressions for selling ``required`` units
+
+    Same rules as the old per-item loop, written over the row's current
+    values so the database applies them atomically:
+    1. Unit Qty used up (<= 0): open a stock unit (Unit Qty = 50, Stock Qty - 1)
+    2. take ``required`` units off Unit Qty and off Stock Qty (not below 0)
+    3. Unit Qty now used up and stock left: open the next stock unit
+    """
+    opened_first = Q(quantity__lte=0)
+    quantity = Case(When(opened_first, then=Value(UNITS_PER_STOCK_RESET)), default=F('quantity')) - required
+    stock = Greatest(Case(When(opened_first, then=F('stock_quantity') - 1), default=F('stock_quantity')) - required, Value(0))
+    reopen = Q(LessThanOrEqual(quantity, 0)) & Q(GreaterThanOrEqual(stock, 1))
+    return (
+        Case(When(reopen, then=Value(UNITS_PER_STOCK_RESET)), default=quantity),
+        Case(When(stock_quantity__isnull=True, then=Value(None)), When(reopen, then=stock - 1), default=stock),
+    )
+
+
+def sale_steps(quantity, stock_quantity, required):
+    """
+    Python twin of _decremented as ledger steps
+
+    Returns:
+        list of (kind, quantity change, stock change) for selling ``required``
+        units from a row holding ``quantity`` / ``stock_quantity``
+    """
+    from .models import StockMovement
+
+    steps = []
+    quantity = quantity or 0
+    stock = stock_quantity or 0
+    if quantity <= 0:
+        steps.append((StockMovement.RESET, UNITS_PER_STOCK_RESET - quantity, -1))
+        quantity, stock = UNITS_PER_STOCK_RESET, stock - 1
+    sold_stock = max(stock - required, 0)
+    steps.append((StockMovement.SALE, -required, sold_stock - stock))
+    quantity, stock = quantity - required, sold_stock
+    if quantity <= 0 and stock >= 1:
+        steps.append((StockMovement.RESET, UNITS_PER_STOCK_RESET - quantity, -1))
+    if stock_quantity is None:
+        # NULL Stock Qty stays NULL in the UPDATE
+        steps = [(kind, units, 0) for kind, units, _ in steps]
+    return steps
+
+
+def _required_by_medicine(lines):
+    required = {}
+    for medicine_id, quantity in lines:
+        required[medicine_id] = required.get(medicine_id, 0) + quantity
+    return required
+
+
+def stock_shortfalls(lines, held=None):
+    """
+    Lines that can't be fulfilled from current stock, without changing anything
+
+    Units other carts hold (see pharmacy.reservations) aren't available.
+
+    Args:
+        lines: (medicine pk, quantity) pairs; repeated medicines are summed
+        held: medicine pk -> units of the reservations that belong to ``lines``
+
+    Returns:
+        list of Shortfall
+    """
+    from .models import Medicine
+
+    required = _required_by_medicine(lines)
+    held = held or {}
+    found = {
+        pk: (name, quantity, stock_quantity, reserved)
+        for pk, name, quantity, stock_quantity, reserved in Medicine.objects.filter(
+            serial_number__in=required
+        ).values_list('serial_number', 'name', 'quantity', 'stock_quantity', 'reserved_quantity')
+    }
+    shortfalls = []
+    for pk, units in required.items():
+        name, quantity, stock_quantity, reserved = found.get(pk, (f"Medicine #{pk}", 0, 0, 0))
+        quantity = _unreserved(quantity, reserved, held.get(pk, 0))
+        if not can_sell(quantity, stock_quantity, units):
+            shortfalls.append(Shortfall(pk, name, units, sellable_units(quantity, stock_quantity)))
+    return shortfalls
+
+
+def _unreserved(quantity, reserved, own):
+    """Unit Qty less what other carts hold"""
+    if quantity is None:
+        return None
+    return quantity - max((reserved or 0) - own, 0)
+
+
+def decrement_stock(lines, reference='', user=None, order=None):
+    """
+    Take ``lines`` out of stock atomically, all or nothing
+
+    A single conditional UPDATE (``quantity = quantity - n ... WHERE quantity
+    >= n``, per medicine) applies every line, so concurrent checkouts can't
+    oversell. If any line is short, nothing is changed and InsufficientStock
+    lists all of them. Units held by other carts can't be sold; the order's
+    own holds are released by the same UPDATE (see pharmacy.reservations).
+    The sale (and any stock unit opened) is written to the stock ledger, and
+    the units are taken from the medicines' batches first-expiry-first-out,
+    in the same transaction.
+
+    The UPDATE is also pinned to the levels read just before it, so the
+    ledger steps match what it did; if another checkout got in between, the
+    read and UPDATE are retried. (Reading under select_for_update instead
+    would deadlock SQLite writers upgrading their read locks.)
+
+    Args:
+        lines: (medicine pk, quantity) pairs; repeated medicines are summed
+        reference: ledger reference, e.g. 'order:42'
+        user: who made the sale (User or pk), for the ledger
+        order: Order to record the batch allocations against and whose
+            cart holds become the sale
+
+    Returns:
+        list of the medicine pks that were updated
+    """
+    from .models import Medicine
+    from .signals import medicines_bulk_changed
+
+    required = {pk: units for pk, units in _required_by_medicine(lines).items() if units > 0}
+    if not required:
+        return []
+
+    for _ in range(STOCK_UPDATE_ATTEMPTS):
+        try:
+            _decrement_from_current_levels(required, reference, getattr(user, 'pk', user), order)
+            break
+        except _StockChanged:
+            continue
+    else:
+        raise OperationalError("Stock levels kept changing while the order was being placed; try again")
+
+    pks = list(required)
+    # The UPDATE bypasses post_save; bring the search indexes and snapshot up to date
+    transaction.on_commit(lambda: medicines_bulk_changed.send(
+        sender=Medicine, pks=pks, fields=['quantity', 'stock_quantity', 'batch_no', 'expiry_date']
+    ))
+    return pks
+
+
+class _StockChanged(Exception):
+    """A row changed between the read and the UPDATE; rolls back the attempt"""
+
+
+def _decrement_from_current_levels(required, reference, user_id, order):
+    from . import alerts, batches
+    from .ledger import record_many
+    from .models import BatchAllocation, Medicine, StockMovement, StockReservation
+
+    # The order's own cart holds are converted into the sale
+    holds, held = [], {}
+    if order is not None:
+        for hold_pk, medicine_id, units in StockReservation.objects.filter(cart__order=order).values_list('pk', 'medicine_id', 'quantity'):
+            holds.append(hold_pk)
+            held[medicine_id] = held.get(medicine_id, 0) + units
+
+    before, reserved = {}, {}
+    for pk, quantity, stock_quantity, reserved_quantity in Medicine.objects.filter(
+        serial_number__in=required
+    ).values_list('serial_number', 'quantity', 'stock_quantity', 'reserved_quantity'):
+        before[pk] = (quantity, stock_quantity)
+        reserved[pk] = reserved_quantity
+    if any(
+        pk not in before or not can_sell(_unreserved(before[pk][0], reserved[pk], held.get(pk, 0)), before[pk][1], units)
+        for pk, units in required.items()
+    ):
+        raise InsufficientStock(stock_shortfalls(required.items(), held))
+
+    quantity_cases, stock_cases, reserved_cases, condition = [], [], [], Q()
+    for pk, units in required.items():
+        quantity, stock = _decremented(units)
+        quantity_cases.append(When(serial_number=pk, then=quantity))
+        stock_cases.append(When(serial_number=pk, then=stock))
+        if held.get(pk):
+            reserved_cases.append(When(serial_number=pk, then=Greatest(F('reserved_quantity') - held[pk], Value(0))))
+        current_quantity, current_stock = before[pk]
+        unchanged = Q(quantity=current_quantity, reserved_quantity=reserved[pk]) & (
+            Q(stock_quantity__isnull=True) if current_stock is None else Q(stock_quantity=current_stock)
+        )
+        condition |= Q(serial_number=pk) & _sellable_condition(units) & unchanged
+
+    with transaction.atomic():
+        updated = Medicine.objects.filter(condition).update(
+            quantity=Case(*quantity_cases, default=F('quantity')),
+            stock_quantity=Case(*stock_cases, default=F('stock_quantity')),
+            reserved_quantity=Case(*reserved_cases, default=F('reserved_quantity')),
+        )
+        if updated != len(required):
+            # Roll back the lines that did fit and read the levels again
+            raise _StockChanged()
+        if holds:
+            StockReservation.objects.filter(pk__in=holds).delete()
+        steps = {pk: sale_steps(*before[pk], units) for pk, units in required.items()}
+        record_many(
+            StockMovement(medicine_id=pk, kind=kind, quantity_change=units, stock_change=stock,
+                          reference=reference, user_id=user_id)
+            for pk, medicine_steps in steps.items()
+            for kind, units, stock in medicine_steps
+        )
+        alerts.queue_low_stock({
+            pk: (before[pk][0], (before[pk][0] or 0) + sum(units for _, units, _ in medicine_steps))
+            for pk, medicine_steps in steps.items()
+        })
+        allocations = batches.allocate(required)
+        if order is not None:
+            BatchAllocation.objects.bulk_create(
+                BatchAllocation(order=order, batch=batch, quantity=units)
+                for taken in allocations.values()
+                for batch, units in taken
+            )
+        # Only an emptied batch can change which one is the medicine's current batch
+        batches.refresh_summary(
+            pk for pk, taken in allocations.items() if any(batch.quantity == 0 for batch, _ in taken)
+        )
+
+
+def restore_stock(lines, reference='', user=None, order=None):
+    """
+    Put ``lines`` back into stock (cancelled orders), recorded as returns
+
+    Args:
+        lines: (medicine pk, quantity) pairs; repeated medicines are summed
+        order: Order whose batch allocations the units go back to; units
+            without one go to the medicine's current batch
+
+    Returns:
+        list of the medicine pks that were updated
+    """
+    from . import batches
+    from .ledger import record_many
+    from .models import Medicine, StockMovement
+    from .signals import medicines_bulk_changed
+
+    returned = {pk: units for pk, units in _required_by_medicine(lines).items() if units > 0}
+    if not returned:
+        return []
+
+    with transaction.atomic():
+        stock_levels = dict(
+            Medicine.objects.select_for_update().filter(serial_number__in=returned)
+            .values_list('serial_number', 'stock_quantity')
+        )
+        returned = {pk: units for pk, units in returned.items() if pk in stock_levels}
+        if not returned:
+            return []
+        # NULL Stock Qty stays NULL, as before
+        Medicine.objects.filter(serial_number__in=returned).update(
+            quantity=Case(*(When(serial_number=pk, then=Coalesce(F('quantity'), 0) + units) for pk, units in returned.items())),
+            stock_quantity=Case(*(When(serial_number=pk, then=F('stock_quantity') + units) for pk, units in returned.items())),
+        )
+        record_many(
+            StockMovement(medicine_id=pk, kind=StockMovement.RETURN, quantity_change=units,
+                          stock_change=0 if stock_levels[pk] is None else units, reference=reference, user_id=getattr(user, 'pk', user))
+            for pk, units in returned.items()
+        )
+        to_batches = batches.return_allocations(order) if order is not None else {}
+        batches.apply_changes(
+            (pk, units - to_batches.get(pk, 0), None, None) for pk, units in returned.items()
+        )
+
+    pks = list(returned)
+    transaction.on_commit(lambda: medicines_bulk_changed.send(
+        sender=Medicine, pks=pks, fields=['quantity', 'stock_quantity', 'batch_no', 'expiry_date']
+    ))
+    return pks
+
 def searchMedicines(request):
     """
     Search medicines based on query parameters
@@ -66,14 +395,115 @@ def searchMedicines(request):
     medicines = Medicine.objects.all()
     
     if search_query:
-        medicines = medicines.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(medicine_category__icontains=search_query) |
-            Q(medicine_type__icontains=search_query)
-        )
+        if getattr(settings, 'PHARMACY_FULLTEXT_SEARCH', True):
+            # Ranked by relevance via FTS5 / tsvector
+            from .fulltext import search
+            medicines = search(medicines, search_query)
+        else:
+            medicines = medicines.filter(
+                Q(name__icontains=search_query) |
+                Q(description__icontains=search_query) |
+                Q(medicine_category__icontains=search_query) |
+                Q(medicine_type__icontains=search_query)
+            )
     
     if category_filter:
-        medicines = medicines.filter(medicine_category__iexact=category_filter)
+        # normalized_category is indexed, unlike an iexact match on the raw value
+        from .models import normalize_category
+        medicines = medicines.filter(normalized_category=normalize_category(category_filter))
     
-    return medicines, search_query
\ No newline at end of file
+    return medicines, search_query
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, but datetimes keep their microseconds (a cursor must match the row exactly)"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque URL-safe token"""
+    raw = json.dumps(list(values), cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor(); returns None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(field, value, descending):
+    """Rows that sort strictly after ``value`` on ``field``"""
+    if value is None:
+        # NULL is first ascending (everything else follows) and last descending (nothing does)
+        return Q(**{f'{field}__in': []}) if descending else Q(**{f'{field}__isnull': False})
+    step = Q(**{f'{field}__{"lt" if descending else "gt"}': value})
+    if descending:
+        step |= Q(**{f'{field}__isnull': True})
+    return step
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=24):
+    """
+    Seek-method pagination: fetch the page after ``cursor`` without OFFSET
+    
+    Args:
+        queryset: queryset to paginate
+        ordering: field names, ``-`` prefix for descending; the last one must be unique
+        cursor: token returned as ``next_cursor`` by the previous call
+        page_size: rows per page
+        
+    Returns:
+        tuple: (list of objects, next_cursor or None on the last page)
+    """
+    fields = [name.lstrip('-') for name in ordering]
+    descending = [name.startswith('-') for name in ordering]
+
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == len(fields):
+        # (a, b, c) > (x, y, z)  ==  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        for i, field in enumerate(fields):
+            step = _after(field, values[i], descending[i])
+            for previous, value in zip(fields[:i], values[:i]):
+                step &= Q(**{f'{previous}__isnull': True}) if value is None else Q(**{previous: value})
+            condition |= step
+        queryset = queryset.filter(condition)
+
+    # NULLs sort before everything ascending and after everything descending
+    queryset = queryset.order_by(*[
+        F(field).desc(nulls_last=True) if desc else F(field).asc(nulls_first=True)
+        for field, desc in zip(fields, descending)
+    ])
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field) for field in fields)
+    return items, next_cursor
+
+
+def with_substitutes(prescription, limit=5):
+    """
+    Prescription medicines of an upload, each with ``substitutes``: in-stock
+    medicines with the same active ingredients
+    """
+    from .ingredients import find_substitutes
+
+    prescription_medicines = list(
+        prescription.medicines.select_related('medicine').prefetch_related('medicine__ingredients')
+    )
+    for prescription_medicine in prescription_medicines:
+        prescription_medicine.substitutes = find_substitutes(prescription_medicine.medicine, limit=limit)
+    return prescription_medicines
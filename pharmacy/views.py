@@ -9,10 +9,16 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Q
 from django.utils import timezone
 from django.core.paginator import Paginator
+from urllib.parse import urlencode
 
 from hospital.models import Patient
-from pharmacy.models import Medicine, Cart, Order, PrescriptionUpload, PrescriptionMedicine
-from .utils import searchMedicines
+from pharmacy.models import (
+    Medicine, Cart, Order, PrescriptionUpload, PrescriptionMedicine,
+    SHOP_CATEGORY_TABS, SHOP_CATEGORY_KEYS, normalize_category,
+)
+from .utils import searchMedicines, keyset_paginate
+from . import batches, reservations
+from .search_index import medicine_index
 import requests
 import base64
 
@@ -25,11 +31,13 @@ def pharmacy_single_product(request, pk):
         medicines = Medicine.objects.get(serial_number=pk)
         orders = Order.objects.filter(user=request.user, ordered=False)
         carts = Cart.objects.filter(user=request.user, purchased=False)
+        # The batch (and expiry) this purchase would be filled from
+        next_batch = batches.next_batch(medicines)
         if carts.exists() and orders.exists():
             order = orders[0]
-            context = {'patient': patient, 'medicines': medicines, 'carts': carts, 'order': order, 'orders': orders}
+            context = {'patient': patient, 'medicines': medicines, 'carts': carts, 'order': order, 'orders': orders, 'next_batch': next_batch}
         else:
-            context = {'patient': patient, 'medicines': medicines, 'carts': carts, 'orders': orders}
+            context = {'patient': patient, 'medicines': medicines, 'carts': carts, 'orders': orders, 'next_batch': next_batch}
         return render(request, 'pharmacy/product-single.html', context)
     else:
         logout(request)
@@ -46,43 +54,38 @@ def pharmacy_shop(request):
         orders = Order.objects.filter(user=request.user, ordered=False)
         carts = Cart.objects.filter(user=request.user, purchased=False)
 
-        # Normalize category for JS filtering
-        for med in medicines:
-            raw_cat = med.medicine_category or ""
-            normalized = (
-                raw_cat.lower()
-                .replace(" ", "")
-                .replace("/", "")
-                .replace("&", "")
-                .replace("(", "")
-                .replace(")", "")
-                .replace("-", "")
-                .replace(".", "")
+        category = normalize_category(request.GET.get('category', ''))
+        if category not in SHOP_CATEGORY_KEYS:
+            category = ''
+        page_size = getattr(settings, 'PHARMACY_SHOP_PAGE_SIZE', 24)
+        base_query = {}
+        if search_query:
+            base_query['search'] = search_query
+        if category:
+            base_query['category'] = category
+
+        next_page_url = first_page_url = None
+        if search_query:
+            # Relevance-ranked results: bounded pages over the matches
+            page_obj = Paginator(medicines, page_size).get_page(request.GET.get('page'))
+            medicines = list(page_obj.object_list)
+            if page_obj.has_next():
+                next_page_url = '?' + urlencode({**base_query, 'page': page_obj.next_page_number()})
+            if page_obj.number > 1:
+                first_page_url = '?' + urlencode(base_query)
+        else:
+            # Browsing: seek on (name, serial_number) so deep pages cost the same as the first
+            cursor = request.GET.get('after')
+            medicines, next_cursor = keyset_paginate(
+                medicines, ('name', 'serial_number'), cursor=cursor, page_size=page_size
             )
-            # Map some common categories to tab values
-            mapping = {
-                "fever": "fever",
-                "pain": "pain",
-                "cough": "cough",
-                "cold": "cold",
-                "flu": "flu",
-                "allergy": "allergy",
-                "infection": "infection",
-                "stomach": "stomach",
-                "hypertension": "hypertension",
-                "heart": "hypertension",
-                "diabetes": "diabetes",
-                "skin": "skin",
-                "vitamins": "vitamins",
-                "eyeearnose": "eye",
-                "respiratoryasthmabronchitis": "respiratory",
-                "urinary": "urinary",
-                "firstaid": "firstaid",
-            }
-            med.normalized_category = mapping.get(normalized, normalized)
+            if next_cursor:
+                next_page_url = '?' + urlencode({**base_query, 'after': next_cursor})
+            if cursor:
+                first_page_url = '?' + urlencode(base_query)
 
-        # Find expiring medicines (within 30 days)
-        expiring_medicines = [med for med in medicines if getattr(med, 'is_expiring_soon', False)]
+        # Batches in stock nearing expiry, from the expiry index
+        expiring_medicines = batches.expiring_batches(Medicine.EXPIRY_WARNING_DAYS)[:page_size]
 
         context = {
             'patient': patient,
@@ -90,7 +93,11 @@ def pharmacy_shop(request):
             'carts': carts,
             'orders': orders,
             'search_query': search_query,
-            'expiring_medicines': expiring_medicines
+            'expiring_medicines': expiring_medicines,
+            'category_tabs': SHOP_CATEGORY_TABS,
+            'current_category': category,
+            'next_page_url': next_page_url,
+            'first_page_url': first_page_url,
         }
         if orders.exists():
             context['order'] = orders[0]
@@ -130,7 +137,7 @@ def add_to_cart(request, pk):
     if request.user.is_authenticated and request.user.is_patient:
         item = get_object_or_404(Medicine, pk=pk)
         
-        # Check if item has sufficient unit quantity
+        # Check if item has sufficient unit quantity (the hold below checks other carts)
         if item.quantity <= 0:
             messages.error(request, f"{item.name} is out of stock.")
             return redirect('pharmacy-shop')
@@ -141,20 +148,25 @@ def add_to_cart(request, pk):
         if order_qs.exists():
             order = order_qs[0]
             if order.orderitems.filter(item=item).exists():
-                # Check if adding one more would exceed unit quantity
-                if order_item.quantity + 1 > item.quantity:
-                    messages.error(request, f"Cannot add more {item.name}. Only {item.quantity} units left.")
+                # Hold one more unit; fails if it would exceed the available quantity
+                if not reservations.hold(order_item, order_item.quantity + 1):
+                    messages.error(request, f"Cannot add more {item.name}. Only {item.available_quantity} units left.")
                     return redirect('pharmacy-cart')
                 order_item.quantity += 1
                 order_item.save()
                 messages.info(request, f"{item.name} quantity in cart was updated.")
-            else:
-                order.orderitems.add(order_item)
-                messages.success(request, f"{item.name} was added to your cart.")
+                return redirect('pharmacy-shop')
         else:
             order = Order.objects.create(user=request.user)
-            order.orderitems.add(order_item)
-            messages.success(request, f"{item.name} was added to your cart.")
+
+        # Another cart may have taken the last units since the check above
+        if not reservations.hold(order_item, order_item.quantity):
+            if created:
+                order_item.delete()
+            messages.error(request, f"{item.name} is out of stock.")
+            return redirect('pharmacy-shop')
+        order.orderitems.add(order_item)
+        messages.success(request, f"{item.name} was added to your cart.")
 
         # Return to shop instead of cart to allow continuous shopping
         return redirect('pharmacy-shop')
@@ -174,6 +186,7 @@ def remove_from_cart(request, pk):
             order = order_qs[0]
             if order.orderitems.filter(item=item).exists():
                 order_item = Cart.objects.filter(item=item, user=request.user, purchased=False)[0]
+                reservations.release(order_item)
                 order.orderitems.remove(order_item)
                 order_item.delete()
                 messages.warning(request, f"{item.name} was removed from your cart.")
@@ -198,9 +211,9 @@ def increase_cart(request, pk):
             order = order_qs[0]
             if order.orderitems.filter(item=item).exists():
                 order_item = Cart.objects.filter(item=item, user=request.user, purchased=False)[0]
-                # Check if increasing would exceed unit quantity
-                if order_item.quantity + 1 > item.quantity:
-                    messages.error(request, f"Cannot add more {item.name}. Only {item.quantity} units left.")
+                # Hold one more unit; fails if it would exceed the available quantity
+                if not reservations.hold(order_item, order_item.quantity + 1):
+                    messages.error(request, f"Cannot add more {item.name}. Only {item.available_quantity} units left.")
                     return redirect('pharmacy-cart')
                 order_item.quantity += 1
                 order_item.save()
@@ -225,8 +238,10 @@ def decrease_cart(request, pk):
                 if order_item.quantity > 1:
                     order_item.quantity -= 1
                     order_item.save()
+                    reservations.hold(order_item, order_item.quantity)
                     messages.info(request, f"{item.name} quantity in cart has been updated")
                 else:
+                    reservations.release(order_item)
                     order.orderitems.remove(order_item)
                     order_item.delete()
                     messages.warning(request, f"{item.name} has been removed from your cart.")
@@ -680,6 +695,7 @@ def prescription_to_cart(request, prescription_upload_id):
         )
         
         added_count = 0
+        unheld = []
         for prescription_medicine in prescription_upload.medicines.all():
             # Check if medicine is already in cart
             existing_cart_item = Cart.objects.filter(
@@ -689,8 +705,9 @@ def prescription_to_cart(request, prescription_upload_id):
             ).first()
             
             if existing_cart_item:
-                existing_cart_item.quantity += prescription_medicine.quantity
-                existing_cart_item.save()
+                cart_item = existing_cart_item
+                cart_item.quantity += prescription_medicine.quantity
+                cart_item.save()
             else:
                 cart_item = Cart.objects.create(
                     user=request.user,
@@ -699,10 +716,14 @@ def prescription_to_cart(request, prescription_upload_id):
                     purchased=False
                 )
                 order.orderitems.add(cart_item)
+            if not reservations.hold(cart_item, cart_item.quantity):
+                unheld.append(prescription_medicine.medicine.name)
             
             added_count += 1
         
         messages.success(request, f'Successfully added {added_count} medicines to your cart!')
+        if unheld:
+            messages.warning(request, f"Not enough stock to hold {', '.join(unheld)} for you; availability is checked again at checkout.")
         return redirect('pharmacy-cart')
     else:
         logout(request)
@@ -739,28 +760,8 @@ def ajax_medicine_search(request):
         if len(query) < 1:
             return JsonResponse({'medicines': []})
         
-        # Search medicines by name, description, category, or type
-        from django.db.models import Q
-        medicines = Medicine.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(medicine_category__icontains=query) |
-            Q(medicine_type__icontains=query),
-            quantity__gt=0  # Only show in-stock medicines
-        ).order_by('name')[:10]  # Limit to 10 results for performance
-        
-        # Serialize medicine data
-        medicine_data = []
-        for med in medicines:
-            medicine_data.append({
-                'id': med.serial_number,
-                'name': med.name,
-                'price': float(med.price) if med.price else 0.0,
-                'description': med.description or '',
-                'category': med.medicine_category or '',
-                'type': med.medicine_type or '',
-                'stock': med.quantity,
-                'image_url': med.get_medicine_image()
-            })
+        # Served from the in-process prefix/trigram index instead of an
+        # icontains scan; exact and prefix name matches are ranked first
+        medicine_data = medicine_index.search(query, limit=10, in_stock_only=True)
         
         return JsonResponse({'medicines': medicine_data})
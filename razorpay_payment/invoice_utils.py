@@ -839,18 +839,23 @@ def generate_pharmacy_invoice_pdf(order):
         elements.append(Paragraph("Medicine Details", header_style))
         
         # Table headers with professional styling
-        medicine_data = [['Medicine Name', 'Quantity', 'Unit Price', 'Total Price']]
+        medicine_data = [['Medicine Name', 'Batch No.', 'Quantity', 'Unit Price', 'Total Price']]
+        
+        # Batches the order was filled from (GST bills carry batch numbers)
+        from pharmacy.batches import order_batch_labels
+        batch_labels = order_batch_labels(order)
         
         # Add medicine items
         for item in order.orderitems.all():
             medicine_data.append([
                 item.item.name,
+                Paragraph(batch_labels.get(item.item_id) or item.item.batch_no or '-', styles['Normal']),
                 str(item.quantity),
-                f'₹{item.item.price:.2f}',
+                f'₹{item.get_unit_price():.2f}',
                 f'₹{item.get_total():.2f}'
             ])
         
-        medicine_table = Table(medicine_data, colWidths=[3.5*inch, 1*inch, 1.5*inch, 1.5*inch])
+        medicine_table = Table(medicine_data, colWidths=[2.5*inch, 1.5*inch, 0.8*inch, 1.2*inch, 1.5*inch])
         medicine_table.setStyle(TableStyle([
             # Header styling - professional blue
             ('BACKGROUND', (0, 0), (-1, 0), colors.Color(0.2, 0.4, 0.8)),
@@ -875,7 +880,7 @@ def generate_pharmacy_invoice_pdf(order):
         
         subtotal = order.get_totals()
         gst_amount = order.get_gst_amount()
-        delivery_fee = 40 if order.delivery_method == 'delivery' else 0
+        delivery_fee = order.get_delivery_fee()
         total_amount = order.final_bill()
         
         billing_data = [
@@ -1,4 +1,7 @@
-from django.test import TestCase
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 from .models import RazorpayPayment, Invoice, InvoiceItem
@@ -8,7 +11,17 @@ from hospital.models import Patient
 
 User = get_user_model()
 
+# Generated invoice PDFs go here instead of static/images/invoices
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
 class InvoiceGenerationTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
     def setUp(self):
         """Set up test data"""
         # Create a user
@@ -5,6 +5,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 import razorpay
 import json
 import hmac
@@ -22,6 +23,8 @@ def get_lab_test_vat():
     """Get lab test VAT amount from settings"""
     return getattr(settings, 'LAB_TEST_VAT_AMOUNT', 20.00)
 from pharmacy.models import Order
+from pharmacy import reservations
+from pharmacy.utils import InsufficientStock
 
 # Initialize Razorpay client
 razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
@@ -206,18 +209,26 @@ def create_pharmacy_payment(request, order_id):
         # Check if payment method is provided
         payment_method = request.GET.get('method', 'online')
         
+        # Hold every item for the payment window; items whose cart hold
+        # lapsed are held again if the stock is still there
+        if not order.ordered:
+            unavailable = reservations.hold_order(order)
+            if unavailable:
+                names = ', '.join(cart.item.name for cart in unavailable)
+                messages.error(request, f'Sorry, {names} is no longer available in the quantity in your cart. Please update your cart.')
+                return redirect('pharmacy-cart')
+        
         # Handle Cash on Delivery (COD) for pharmacy
         if payment_method == 'cod':
-            # Mark as COD and proceed without Razorpay
-            order.payment_status = 'cod'
-            order.ordered = True
-            order.order_status = 'confirmed_cod'
-            order.save()
-            
-            # Mark cart items as purchased
-            for cart_item in order.orderitems.all():
-                cart_item.purchased = True
-                cart_item.save()
+            if order.ordered:
+                messages.info(request, 'This order has already been placed.')
+                return redirect('patient-dashboard')
+            try:
+                # Mark as COD and proceed without Razorpay
+                place_pharmacy_cod_order(order, payment_status='cod', order_status='confirmed_cod')
+            except InsufficientStock as e:
+                messages.error(request, f'{e}. Please update your cart.')
+                return redirect('pharmacy-cart')
             
             messages.success(request, 'Order confirmed with Cash on Delivery. Please pay upon receiving your medicines.')
             return redirect('patient-dashboard')
@@ -307,6 +318,27 @@ def create_pharmacy_payment(request, order_id):
         messages.error(request, f'Error creating payment: {str(e)}. You can still proceed with Cash on Delivery.')
         return redirect(f'/razorpay/pharmacy/{order_id}/?method=cod_fallback')
 
+def place_pharmacy_cod_order(order, payment_status, order_status):
+    """
+    Confirm a cash-on-delivery pharmacy order: its cart holds become the sale
+    and the order is marked placed, in one transaction
+
+    Raises:
+        InsufficientStock if an item can no longer be supplied; nothing changes then
+    """
+    with transaction.atomic():
+        order.stock_quantity_decrease()
+        order.freeze_totals()
+        order.payment_status = payment_status
+        order.ordered = True
+        order.order_status = order_status
+        order.save()
+
+        # Mark cart items as purchased
+        for cart_item in order.orderitems.all():
+            cart_item.purchased = True
+            cart_item.save()
+
 @login_required
 def create_test_payment(request, test_order_id):
     """Create Razorpay order for test payment with COD option"""
@@ -478,6 +510,7 @@ def payment_success(request):
                 payment.order.payment_status = 'paid'
                 payment.order.ordered = True
                 payment.order.order_status = 'confirmed'  # Set initial status after payment
+                payment.order.freeze_totals()
                 payment.order.save()
                 
                 # Update stock quantities
@@ -521,6 +554,7 @@ def payment_success(request):
 
                 # Add cart items to order
                 order.orderitems.set(cart_items)
+                order.freeze_totals()
 
                 # Update stock quantities
                 try:
@@ -961,6 +995,7 @@ def cod_prescription_payment(request, prescription_upload_id):
 
         # Add cart items to order
         order.orderitems.set(cart_items)
+        order.freeze_totals()
 
         # Link prescription to order and update status to paid_pending (waiting for pharmacy processing)
         prescription_upload.related_order = order
@@ -1142,16 +1177,16 @@ def cod_pharmacy_payment(request, order_id):
             messages.error(request, 'You do not have permission to access this order.')
             return redirect('patient-dashboard')
 
-        # Mark as COD and proceed
-        order.payment_status = 'cash_on_delivery'
-        order.ordered = True
-        order.order_status = 'confirmed'
-        order.save()
+        if order.ordered:
+            messages.info(request, 'This order has already been placed.')
+            return redirect('patient-dashboard')
 
-        # Mark cart items as purchased
-        for cart_item in order.orderitems.all():
-            cart_item.purchased = True
-            cart_item.save()
+        # Mark as COD and proceed
+        try:
+            place_pharmacy_cod_order(order, payment_status='cash_on_delivery', order_status='confirmed')
+        except InsufficientStock as e:
+            messages.error(request, f'{e}. Please update your cart.')
+            return redirect('pharmacy-cart')
 
         # Send notification email to admin
         send_cod_notification_email('pharmacy', order)
@@ -1818,10 +1853,13 @@ Items:
         total = 0
         try:
             if hasattr(order, 'orderitems'):
+                from pharmacy.batches import order_batch_labels
+                batch_labels = order_batch_labels(order)
                 for item in order.orderitems.all():
                     item_total = getattr(item, 'get_total', lambda: 0)()
                     total += item_total
-                    content += f"- {item.item.name} x{item.quantity}: Rs.{item_total}\\n"
+                    batch = batch_labels.get(item.item_id) or item.item.batch_no or '-'
+                    content += f"- {item.item.name} x{item.quantity} (Batch: {batch}): Rs.{item_total}\\n"
         except:
             content += "Items information not available\\n"
         